@@ -1,3 +1,5 @@
+import threading
+
 from flask import Flask
 from config import Config
 
@@ -32,11 +34,39 @@ def create_app():
     app.register_blueprint(conferencia_bp, url_prefix='/conferencia')
     app.register_blueprint(api_bp, url_prefix='/api')
     
-    # 5. Rota da Página Inicial (Menu Principal)
+    # 5. Serviços de fundo: começam na primeira requisição, não aqui.
+    # Com debug=True o reloader do Werkzeug executa o create_app em dois processos (o pai só vigia os
+    # arquivos e reinicia o filho). Só o processo que atende requisições pode subir as threads: dois
+    # observadores em processos diferentes mesclariam os mesmos caches e um apagaria as notas do outro,
+    # e duas sincronizações do espelho copiariam o ERP inteiro para o mesmo SQLite.
+    estado = {'iniciados': False}
+    trava = threading.Lock()
+
+    @app.before_request
+    def iniciar_servicos_de_fundo():
+        if estado['iniciados']: return
+        with trava:
+            if estado['iniciados']: return
+            estado['iniciados'] = True
+            _iniciar_servicos_de_fundo(app)
+    
+    # 6. Rota da Página Inicial (Menu Principal)
     # Agora que libertámos o endereço '/', esta rota vai funcionar e abrir o Menu.
     @app.route('/')
     def menu():
         from flask import render_template
         return render_template('menu.html')
         
-    return app
\ No newline at end of file
+    return app
+
+def _iniciar_servicos_de_fundo(app):
+    """Threads que rodam enquanto o sistema está no ar (uma vez por processo)."""
+    # Espelho local das tabelas de cadastro do ERP (sincroniza em segundo plano)
+    if app.config.get('ESPELHO_ATIVO'):
+        from app.repository.espelho_repo import iniciar_sincronizacao_espelho
+        iniciar_sincronizacao_espelho()
+
+    # Observador da pasta de XML (notas novas entram nos caches sem varredura completa)
+    if app.config.get('OBSERVADOR_XML_ATIVO') and app.config.get('CAMINHO_XML_PADRAO'):
+        from app.services.observador_xml import iniciar_observador
+        iniciar_observador(app)
@@ -1,5 +1,6 @@
-from flask import Blueprint, jsonify, request, current_app
-import threading
+from flask import Blueprint, jsonify, request, current_app, Response, stream_with_context
+import json
+import time
 
 # Importações dos repositórios
 from app.repository.geral_repo import (
@@ -14,8 +15,19 @@ from app.repository.gestao_repo import (
     _carregar_workflow_local
 )
 
-# Importações do serviço de processamento (lógica pesada que roda em segundo plano)
-from app.services.processamento_service import STATUS_GLOBAL, resetar_progresso, tarefa_background
+from app.database import estatisticas_pool
+from app.metricas_sql import resumo_metricas, limpar_metricas
+from app.repository.cache_consultas import invalidar_cache, estatisticas_cache
+from app.repository.espelho_repo import status_espelho, pedir_sincronizacao
+from app.services.observador_xml import status_observador
+from app.services.divergencia_itens import divergencias_da_nota
+from app.services.cache_service import estatisticas_memoria, esquecer_memoria
+from app.services.notas_service import MODULOS, ORDENACOES_NOTAS, consultar_notas, buscar_nota, opcoes_filtros
+
+# Importações do serviço de tarefas (processamento pesado que roda em segundo plano)
+from app.services.tarefas_service import (
+    FINALIZADOS, iniciar_tarefa, cancelar_tarefa, buscar_tarefa, listar_tarefas, esperar_mudanca
+)
 from config import Config
 
 # Criação do Blueprint 'api'
@@ -23,25 +35,17 @@ from config import Config
 # Tudo que for definido aqui será acessível via prefixo definido no create_app (ex: /api)
 api_bp = Blueprint('api', __name__)
 
-# --- FUNÇÃO WRAPPER PARA THREAD (SOLUÇÃO DO ERRO DE CONTEXTO) ---
-def executor_thread(app_real, modulo, app_config):
-    """
-    Esta função roda dentro da Thread.
-    Ela 'empurra' o contexto da aplicação para que o database.py 
-    consiga ler a string de conexão sem dar erro.
-    """
-    with app_real.app_context():
-        tarefa_background(modulo, app_config)
+# Resposta do /progresso quando nenhuma tarefa rodou ainda
+_PROGRESSO_PARADO = {'atual': 0, 'total': 0, 'percentual': 0, 'status': 'parado', 'msg': ''}
 
 # --- ROTAS DE PROCESSAMENTO (TAREFAS DEMORADAS) ---
 
 @api_bp.route('/iniciar_processamento', methods=['POST'])
 def api_iniciar():
-    if STATUS_GLOBAL['status'] == 'rodando':
-        return jsonify({'status': 'ocupado'})
-    
-    resetar_progresso()
-    
+    """
+    Cria a tarefa de processamento do módulo. Roda na hora ou espera na fila (limites por módulo e no
+    total, ver tarefas_service). Responde {'status': 'iniciado' | 'na_fila', 'id': id da tarefa}.
+    """
     modulo = request.json.get('modulo', 'geral')
     
     # 1. Captura a aplicação real (não o proxy) para passar à thread
@@ -54,30 +58,131 @@ def api_iniciar():
         'CFOPS_PADRAO': Config.CFOPS_PADRAO
     }
     
-    # 3. Inicia a Thread passando a APP REAL para o executor
-    thread = threading.Thread(target=executor_thread, args=(app_real, modulo, app_config))
-    thread.start()
+    # 3. Registra a tarefa (a thread é criada pelo tarefas_service quando houver vaga)
+    tarefa = iniciar_tarefa(app_real, modulo, app_config)
     
-    return jsonify({'status': 'iniciado'})
+    return jsonify({'status': 'na_fila' if tarefa.status == 'na_fila' else 'iniciado', 'id': tarefa.id})
 
 @api_bp.route('/progresso')
 def api_progresso():
     """
-    Rota que o Front-end chama repetidamente (Polling) para atualizar a barra de progresso.
-    Lê a variável global STATUS_GLOBAL que a Thread está atualizando.
+    Progresso de uma tarefa (?id=), ou da rodando mais recente. Mesmo formato de antes
+    (atual, total, percentual, status, msg) mais o id e o módulo.
     """
-    pct = 0
-    # Evita divisão por zero
-    if STATUS_GLOBAL['total'] > 0:
-        pct = int((STATUS_GLOBAL['atual'] / STATUS_GLOBAL['total']) * 100)
-    
-    return jsonify({
-        'atual': STATUS_GLOBAL['atual'], 
-        'total': STATUS_GLOBAL['total'],
-        'percentual': pct, 
-        'status': STATUS_GLOBAL['status'], 
-        'msg': STATUS_GLOBAL['msg']
-    })
+    tarefa = buscar_tarefa(request.args.get('id'))
+    if tarefa is None: return jsonify(_PROGRESSO_PARADO)
+    dados = tarefa.retrato()
+    return jsonify({campo: dados[campo] for campo in ('id', 'modulo', 'atual', 'total', 'percentual', 'status', 'msg')})
+
+@api_bp.route('/progresso/stream')
+def api_progresso_stream():
+    """
+    Progresso em Server-Sent Events de uma tarefa (?id=, ou a rodando mais recente): o servidor manda
+    um evento a cada mudança (no máximo um a cada PROGRESSO_SSE_INTERVALO segundos) com os campos do
+    /progresso, arquivos/s, segundos restantes e o tempo de cada fase. Termina quando a tarefa termina.
+    """
+    tarefa = buscar_tarefa(request.args.get('id'))
+
+    def eventos():
+        if tarefa is None:
+            yield f"data: {json.dumps(_PROGRESSO_PARADO)}\n\n"
+            return
+        while True:
+            dados = tarefa.retrato()
+            versao = dados['versao']
+            yield f"data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+            if dados['status'] in FINALIZADOS: return
+
+            # Junta as mudanças de arquivo a arquivo num evento só
+            time.sleep(Config.PROGRESSO_SSE_INTERVALO)
+            while esperar_mudanca(tarefa, versao, Config.PROGRESSO_SSE_PING) == versao:
+                yield ": ping\n\n"
+
+    return Response(stream_with_context(eventos()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@api_bp.route('/tarefas')
+def api_tarefas():
+    """Tarefas rodando, na fila e as últimas terminadas (histórico), da mais nova para a mais antiga."""
+    return jsonify(listar_tarefas())
+
+@api_bp.route('/tarefas/<id_tarefa>')
+def api_tarefa(id_tarefa):
+    tarefa = buscar_tarefa(id_tarefa)
+    if tarefa is None: return jsonify({'erro': 'Tarefa não encontrada'}), 404
+    return jsonify(tarefa.retrato())
+
+@api_bp.route('/tarefas/<id_tarefa>/cancelar', methods=['POST'])
+def api_cancelar_tarefa(id_tarefa):
+    """Na fila: sai na hora. Rodando: para no próximo arquivo ou fase, sem gravar o cache."""
+    tarefa = cancelar_tarefa(id_tarefa)
+    if tarefa is None: return jsonify({'erro': 'Tarefa não encontrada'}), 404
+    return jsonify(tarefa.retrato())
+
+@api_bp.route('/db/pool')
+def api_pool():
+    """Estatísticas do pool de conexões (em uso, aguardando, criadas, recicladas)."""
+    return jsonify(estatisticas_pool())
+
+@api_bp.route('/metricas/sql')
+def api_metricas_sql():
+    """
+    Métricas das consultas ao ERP por nome (chamadas, erros, linhas, percentis de tempo)
+    e o estado atual do pool de conexões. Use ?limpar=1 para zerar os contadores após a leitura.
+    """
+    resposta = {'consultas': resumo_metricas(), 'pool': estatisticas_pool()}
+    if request.args.get('limpar') == '1': limpar_metricas()
+    return jsonify(resposta)
+
+@api_bp.route('/cache_consultas')
+def api_cache_consultas():
+    """Hits/misses do cache em memória das consultas de referência (filiais, fornecedores...)."""
+    return jsonify(estatisticas_cache())
+
+@api_bp.route('/cache_consultas/invalidar', methods=['POST'])
+def api_invalidar_cache_consultas():
+    """
+    Força a releitura do ERP na próxima chamada.
+    Corpo opcional: {"nome": "buscar_filiais"}. Sem nome, limpa todos.
+    """
+    nome = (request.get_json(silent=True) or {}).get('nome')
+    return jsonify({'success': True, 'limpos': invalidar_cache(nome)})
+
+@api_bp.route('/cache_modulos')
+def api_cache_modulos():
+    """Hits/misses e tempo de carga dos caches dos módulos guardados na memória (acerto, devolução, geral)."""
+    return jsonify(estatisticas_memoria())
+
+@api_bp.route('/cache_modulos/esquecer', methods=['POST'])
+def api_esquecer_cache_modulos():
+    """
+    Força a releitura do arquivo na próxima leitura do cache.
+    Corpo opcional: {"modulo": "acerto"}. Sem módulo, esquece todos.
+    """
+    modulo = (request.get_json(silent=True) or {}).get('modulo')
+    esquecer_memoria(modulo)
+    return jsonify({'success': True})
+
+@api_bp.route('/espelho')
+def api_espelho():
+    """Situação do espelho local das tabelas de cadastro (última sincronização, linhas)."""
+    return jsonify(status_espelho())
+
+@api_bp.route('/espelho/sincronizar', methods=['POST'])
+def api_sincronizar_espelho():
+    """
+    Pede uma sincronização à thread do espelho. Corpo opcional: {"completa": true}.
+    409 se o espelho está desligado ou já sincronizando.
+    """
+    completa = (request.get_json(silent=True) or {}).get('completa')
+    erro = pedir_sincronizacao(completa)
+    if erro: return jsonify({'erro': erro}), 409
+    return jsonify({'status': 'iniciado'})
+
+@api_bp.route('/observador')
+def api_observador():
+    """Situação do observador da pasta de XML (modo, pendências, notas mescladas nos caches)."""
+    return jsonify(status_observador())
 
 # --- ROTAS DE CONSULTA BÁSICA ---
 
@@ -107,6 +212,69 @@ def api_buscar_pedido():
     tipo = request.args.get('tipo', 1)
     return jsonify(buscar_pedido_manual(pedido, tipo))
 
+@api_bp.route('/divergencias', methods=['POST'])
+def api_divergencias():
+    """
+    Confronto item a item de uma nota com um pedido escolhido na tela (o da própria nota vem em 'Divergencias' do buscar_nota).
+    Corpo: {'itens': itens do XML, 'itens_erp': itens do /buscar_pedido}.
+    """
+    p = request.json or {}
+    linhas, resumo = divergencias_da_nota(p.get('itens') or [], p.get('itens_erp') or [])
+    return jsonify({'linhas': linhas, 'resumo': resumo})
+
+# --- NOTAS DOS CACHES (LISTA PAGINADA) ---
+# As telas buscam só a página visível e, ao escolher uma nota, a nota inteira (ver notas_service)
+
+_FILTROS_NOTAS = ('filial', 'fornecedor', 'nota', 'dia_acerto', 'cfop', 'data_ini', 'data_fim', 'status', 'divergencia', 'q')
+
+@api_bp.route('/notas/<modulo>')
+def api_notas(modulo):
+    """
+    Uma página das notas do cache do módulo (JSON).
+    Parâmetros: os filtros de _FILTROS_NOTAS + ordem, direcao (asc/desc), limite, offset
+    e campos (lista separada por vírgula; sem ela vem tudo menos os itens).
+    """
+    if modulo not in MODULOS:
+        return jsonify({'erro': f"Módulo inválido. Use: {', '.join(MODULOS)}"}), 404
+    ordem = request.args.get('ordem', 'emissao')
+    if ordem not in ORDENACOES_NOTAS:
+        return jsonify({'erro': f"Ordem inválida. Use: {', '.join(ORDENACOES_NOTAS)}"}), 400
+    try:
+        limite = int(request.args.get('limite', Config.NOTAS_PAGINA_TAMANHO))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'erro': 'limite e offset devem ser números'}), 400
+    limite = max(1, min(limite, Config.NOTAS_PAGINA_MAXIMO))
+
+    campos = [c.strip() for c in request.args.get('campos', '').split(',') if c.strip()]
+    pagina = consultar_notas(
+        modulo,
+        filtros={f: request.args.get(f) for f in _FILTROS_NOTAS},
+        ordem=ordem,
+        direcao=request.args.get('direcao', 'desc'),
+        limite=limite,
+        offset=max(0, offset),
+        campos=campos or None
+    )
+    return jsonify(pagina)
+
+@api_bp.route('/notas/<modulo>/opcoes')
+def api_notas_opcoes(modulo):
+    """Valores distintos dos filtros (nota, fornecedor, dia de acerto, filial, CFOP) para as sugestões das telas."""
+    if modulo not in MODULOS:
+        return jsonify({'erro': f"Módulo inválido. Use: {', '.join(MODULOS)}"}), 404
+    return jsonify(opcoes_filtros(modulo))
+
+@api_bp.route('/notas/<modulo>/nota/<path:chave>')
+def api_nota(modulo, chave):
+    """A nota inteira (itens do XML, do ERP e divergências), pela chave de acesso."""
+    if modulo not in MODULOS:
+        return jsonify({'erro': f"Módulo inválido. Use: {', '.join(MODULOS)}"}), 404
+    nota = buscar_nota(modulo, chave)
+    if nota is None:
+        return jsonify({'erro': 'Nota não encontrada no cache.'}), 404
+    return jsonify(nota)
+
 @api_bp.route('/dados_fornecedor')
 def api_dados_fornecedor():
     cod = request.args.get('cod_cli')
@@ -5,14 +5,16 @@ import pandas as pd
 # Time: Para gerar timestamps (marcas de tempo) úteis para cache.
 import time
 # Flask: Framework web. Importamos ferramentas para rotas, templates, redirecionamento, sessão, mensagens e arquivos.
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, send_file, current_app
+# partial: "congela" os argumentos de uma função para ela rodar depois, em outra thread.
+from functools import partial
 # BytesIO: Permite tratar arquivos na memória RAM (sem salvar no disco rígido), o que é mais rápido e seguro.
 from io import BytesIO
 
 # Importações dos nossos Serviços e Repositórios (Camada de Lógica e Dados)
 # Service: Onde fica a regra de negócio (cálculos, processamento).
 # Repository: Onde fica o acesso ao banco de dados (SQL).
-from app.services.cache_service import ler_cache
+from app.services.cache_service import data_cache
 from app.repository.geral_repo import buscar_filiais, listar_fornecedores
 from app.repository.conferencia_repo import buscar_pedidos_para_conferencia
 from app.services.conferencia_service import (
@@ -21,8 +23,10 @@ from app.services.conferencia_service import (
     calcular_conferencia_padrao, cache_save, cache_get,
     gerar_planilha_acao, calcular_qtd_final_acao, gerar_resumo_acao,
     calcular_qtd_final, gerar_resumo_consolidado,
-    atualizar_cache_manual  # <--- (NOVO) Função necessária para salvar edições no disco
+    atualizar_cache_manual,  # <--- (NOVO) Função necessária para salvar edições no disco
+    carregar_fontes_concorrente
 )
+from config import Config
 
 # Criação do Blueprint 'conferencia'
 # Isso isola todas as rotas deste módulo. Prefixo URL será definido no create_app (ex: /conferencia)
@@ -53,8 +57,9 @@ def leitor_xml():
     """
     Tela do Leitor Geral de XMLs.
     Exibe dados processados previamente (cache 'geral') e lista de lojas disponíveis.
+    As notas são buscadas pela tela em páginas filtradas (/api/notas/geral).
     """
-    dados, ts = ler_cache('geral')
+    ts = data_cache('geral')
     lojas = []
     try:
         # Busca filiais no banco para o filtro lateral
@@ -62,7 +67,8 @@ def leitor_xml():
         if not df.empty: lojas = sorted(df['Nome_Filial'].unique().tolist())
     except: 
         pass # Se falhar o banco, a tela carrega sem a lista de lojas, sem travar.
-    return render_template('leitor_geral.html', dados=dados, ultima_atualizacao=ts, lista_lojas=lojas)
+    return render_template('leitor_geral.html', ultima_atualizacao=ts, lista_lojas=lojas,
+                           tamanho_pagina=Config.NOTAS_PAGINA_TAMANHO)
 
 # --- ROTAS DE API AUXILIAR (AJAX) ---
 
@@ -112,40 +118,50 @@ def iniciar_processamento():
                 flash('Selecione ao menos um pedido.', 'error')
                 return redirect(request.referrer)
             
-            # 2. Busca os itens de acerto (Devolução/Entrada) no Banco
-            df_acerto, _, fornecedor = processar_acerto_sql_service(pedidos)
-            
-            # 3. Busca vendas no período
             d_ini, d_fim = request.form.get('data_inicio_vendas'), request.form.get('data_fim_vendas')
+            d_ini_ac, d_fim_ac = request.form.get('data_inicio_vendas_acao'), request.form.get('data_fim_vendas_acao')
             forn_id = request.form.get('fornecedor_id')
             
+            # 2. Monta as fontes independentes para rodarem em paralelo:
+            #    itens de acerto, vendas do período, vendas da ação e relatórios de quebra.
+            fontes = {'Acerto': partial(processar_acerto_sql_service, pedidos, propagar_erro=True)}
             if not is_acao:
                 # Se for conferência padrão, busca venda geral
-                df_venda = processar_vendas_sql_service(d_ini, d_fim, forn_id)
-            
-            # 4. Se houver período de Ação definido, busca venda específica da ação
-            d_ini_ac, d_fim_ac = request.form.get('data_inicio_vendas_acao'), request.form.get('data_fim_vendas_acao')
+                fontes['Vendas do período'] = partial(processar_vendas_sql_service, d_ini, d_fim, forn_id, propagar_erro=True)
             if d_ini_ac and d_fim_ac:
-                df_acao_raw = processar_vendas_sql_service(d_ini_ac, d_fim_ac, forn_id)
-                if not df_acao_raw.empty:
-                    # Renomeia para evitar conflito de colunas e seleciona apenas o necessário
-                    df_acao = df_acao_raw.rename(columns={'Quant_venda': 'Quant_acao'})[['filial', 'ISBN', 'Quant_acao']]
-                    if is_acao:
-                        # Calcula totais brutos para o cabeçalho do resumo
-                        venda_sum = df_acao_raw.groupby('filial', as_index=False).agg({'Vl. Unit._venda': 'sum'}).rename(columns={'Vl. Unit._venda': 'Venda Bruta'})
-
-            # 5. Processa arquivos de quebra (MÚLTIPLOS)
-            files_quebra = request.files.getlist('quebra_file')
-            dfs_quebra_temp = []
+                # Se houver período de Ação definido, busca venda específica da ação
+                fontes['Vendas da ação'] = partial(processar_vendas_sql_service, d_ini_ac, d_fim_ac, forn_id, propagar_erro=True)
             
-            for f_q in files_quebra:
+            # Os uploads são lidos aqui (precisam do contexto da requisição); só o processamento vai para as threads
+            nomes_quebra = []
+            for i, f_q in enumerate(request.files.getlist('quebra_file')):
                 if f_q.filename == '': continue
-                # Processa cada arquivo individualmente para ler o cabeçalho daquela filial
-                df_temp = carregar_quebra_inventario(BytesIO(f_q.read()))
-                if not df_temp.empty:
-                    dfs_quebra_temp.append(df_temp)
+                nome_fonte = f'Quebra {i + 1} ({f_q.filename})'
+                fontes[nome_fonte] = partial(carregar_quebra_inventario, BytesIO(f_q.read()))
+                nomes_quebra.append(nome_fonte)
+            
+            resultados, erros = carregar_fontes_concorrente(fontes, timeout=current_app.config['CONFERENCIA_TIMEOUT'])
+            
+            # 3. Qualquer fonte que falhou invalida o cálculo: avisa qual foi e volta para a tela
+            if erros:
+                for nome_fonte, msg in erros.items():
+                    print(f"Erro ao carregar '{nome_fonte}': {msg}")
+                    flash(f'Falha ao carregar {nome_fonte}: {msg}', 'error')
+                return redirect(request.referrer)
+            
+            df_acerto, _, fornecedor = resultados['Acerto']
+            df_venda = resultados.get('Vendas do período', df_venda)
             
-            # Junta todos os DataFrames de quebra em um só
+            df_acao_raw = resultados.get('Vendas da ação')
+            if df_acao_raw is not None and not df_acao_raw.empty:
+                # Renomeia para evitar conflito de colunas e seleciona apenas o necessário
+                df_acao = df_acao_raw.rename(columns={'Quant_venda': 'Quant_acao'})[['filial', 'ISBN', 'Quant_acao']]
+                if is_acao:
+                    # Calcula totais brutos para o cabeçalho do resumo
+                    venda_sum = df_acao_raw.groupby('filial', as_index=False).agg({'Vl. Unit._venda': 'sum'}).rename(columns={'Vl. Unit._venda': 'Venda Bruta'})
+
+            # 4. Junta todos os DataFrames de quebra em um só (na ordem dos arquivos enviados)
+            dfs_quebra_temp = [resultados[n] for n in nomes_quebra if not resultados[n].empty]
             if dfs_quebra_temp:
                 df_quebra = pd.concat(dfs_quebra_temp, ignore_index=True)
                 has_quebra = True
@@ -6,7 +6,9 @@ from datetime import datetime, timedelta
 
 # Repositórios: Funções que buscam dados no SQL ou arquivos locais.
 from app.repository.gestao_repo import (
-    listar_propostas_gestao, 
+    listar_propostas_gestao_pagina, 
+    contar_propostas_gestao, 
+    ORDENACOES_PROPOSTAS, 
     buscar_detalhes_proposta, 
     adicionar_historico_repo, 
     excluir_historico_repo, 
@@ -16,6 +18,7 @@ from app.repository.gestao_repo import (
 # Serviços: Cache para carregar dados processados pelo robô.
 from app.services.cache_service import ler_cache
 from app.repository.geral_repo import buscar_filiais
+from config import Config
 
 # Criação do Blueprint 'gestao'
 gestao_bp = Blueprint('gestao', __name__)
@@ -26,39 +29,76 @@ gestao_bp = Blueprint('gestao', __name__)
 def index():
     """
     Tela principal de Gestão de Propostas.
-    Lista as propostas com base nos filtros da URL (GET).
+    Só desenha os filtros: a lista e o painel são carregados pelo navegador
+    em páginas (/api/propostas) e totais (/api/propostas/totais).
     """
-    # 1. Configuração de Datas Padrão (Últimos 30 dias se não informado)
+    filtros = _ler_filtros_propostas()
+
+    # Renderiza o HTML passando os filtros atuais (para manter os campos preenchidos)
+    return render_template('gestao_propostas.html', 
+                           filtros={
+                               'ini': filtros['data_ini'], 
+                               'fim': filtros['data_fim'], 
+                               'status': filtros['status_filtro'], 
+                               'proposta': filtros['filtro_proposta'], 
+                               'fornecedor': filtros['filtro_fornecedor'], 
+                               'filial': filtros['filtro_filial'],
+                               'ordem': request.args.get('ordem', 'data'),
+                               'direcao': request.args.get('direcao', 'desc')
+                           },
+                           tamanho_pagina=Config.GESTAO_PAGINA_TAMANHO)
+
+def _ler_filtros_propostas():
+    """Filtros da URL (GET), com o período padrão dos últimos 30 dias."""
     hoje = datetime.now()
     inicio = hoje - timedelta(days=30)
     
     # request.args.get: Pega o valor da URL ou usa o padrão definido
-    data_ini = request.args.get('data_ini', inicio.strftime('%Y-%m-%d'))
-    data_fim = request.args.get('data_fim', hoje.strftime('%Y-%m-%d'))
-    status = request.args.get('status', 'todos')
-    
-    # Filtros de texto opcionais
-    filtro_proposta = request.args.get('filtro_proposta', '')
-    filtro_fornecedor = request.args.get('filtro_fornecedor', '')
-    filtro_filial = request.args.get('filtro_filial', '')
-
-    # 2. Busca no Banco de Dados
-    propostas = listar_propostas_gestao(
-        data_ini, data_fim, status, 
-        filtro_proposta, filtro_fornecedor, filtro_filial
-    )
-
-    # 3. Renderiza o HTML passando os dados e os filtros atuais (para manter os campos preenchidos)
-    return render_template('gestao_propostas.html', 
-                           propostas=propostas, 
-                           filtros={
-                               'ini': data_ini, 
-                               'fim': data_fim, 
-                               'status': status, 
-                               'proposta': filtro_proposta, 
-                               'fornecedor': filtro_fornecedor, 
-                               'filial': filtro_filial
-                           })
+    return {
+        'data_ini': request.args.get('data_ini', inicio.strftime('%Y-%m-%d')),
+        'data_fim': request.args.get('data_fim', hoje.strftime('%Y-%m-%d')),
+        'status_filtro': request.args.get('status', 'todos'),
+        # Filtros de texto opcionais
+        'filtro_proposta': request.args.get('filtro_proposta', ''),
+        'filtro_fornecedor': request.args.get('filtro_fornecedor', ''),
+        'filtro_filial': request.args.get('filtro_filial', ''),
+    }
+
+@gestao_bp.route('/api/propostas')
+def api_propostas():
+    """
+    Uma página da lista de propostas (JSON).
+    Parâmetros: os mesmos filtros da tela + ordem, direcao (asc/desc), limite e
+    cursor (ordem por data) ou offset (demais ordens), devolvidos pela página anterior.
+    """
+    ordem = request.args.get('ordem', 'data')
+    if ordem not in ORDENACOES_PROPOSTAS:
+        return jsonify({'erro': f"Ordem inválida. Use: {', '.join(ORDENACOES_PROPOSTAS)}"}), 400
+    try:
+        limite = int(request.args.get('limite', Config.GESTAO_PAGINA_TAMANHO))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'erro': 'limite e offset devem ser números'}), 400
+    limite = max(1, min(limite, Config.GESTAO_PAGINA_MAXIMO))
+
+    try:
+        pagina = listar_propostas_gestao_pagina(
+            **_ler_filtros_propostas(),
+            ordem=ordem,
+            direcao=request.args.get('direcao', 'desc'),
+            limite=limite,
+            cursor=request.args.get('cursor') or None,
+            offset=offset
+        )
+    except ValueError as e:
+        # Cursor que não veio de uma página anterior (adulterado ou de outra versão)
+        return jsonify({'erro': str(e)}), 400
+    return jsonify(pagina)
+
+@gestao_bp.route('/api/propostas/totais')
+def api_propostas_totais():
+    """Contagem e somatórios do filtro inteiro, para o painel (independe da página carregada)."""
+    return jsonify(contar_propostas_gestao(**_ler_filtros_propostas()))
 
 # --- ROTA SECUNDÁRIA: WORKFLOW (FOLLOW-UP) ---
 
@@ -1,44 +1,455 @@
+import concurrent.futures
+import importlib.util
 import pyodbc
+import numpy as np
 import pandas as pd
+import sys
+import threading
+import time
 import warnings
+from contextlib import contextmanager
 
 from config import Config
+from app.metricas_sql import registrar_consulta
 warnings.filterwarnings('ignore', category=UserWarning)
 
-def get_connection():
+# PyArrow é opcional: se estiver instalado, colunas de texto podem ser guardadas em formato Arrow (mais compacto).
+# Só verifica se o pacote existe; quem o importa é o pandas, ao montar a coluna 'string[pyarrow]'.
+TEM_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+# --- POOL DE CONEXÕES ---
+# Abrir uma conexão no SQL Server custa um handshake TDS completo (login, negociação, etc).
+# O pool mantém conexões abertas e as reaproveita entre as requisições e as threads de background.
+
+class PoolConexoes:
     """
-    Cria uma conexão com o banco usando a string definida no config.py
+    Pool de conexões thread-safe.
+
+    - min_conexoes / max_conexoes: limites de conexões abertas ao mesmo tempo.
+    - Health check: conexões paradas há mais de 'intervalo_health_check' segundos
+      são testadas com 'SELECT 1' antes de serem entregues.
+    - Expiração: conexões ociosas há mais de 'tempo_ocioso' segundos são fechadas
+      (sempre respeitando o mínimo).
+    - Reuso por thread: se a mesma thread pedir outra conexão enquanto já tem uma,
+      recebe a mesma (evita esgotar o pool em chamadas aninhadas).
     """
-    try:
-        conn_str = Config.SQL_CONNECTION_STRING
-        return pyodbc.connect(conn_str)
-    except Exception as e:
-        print(f"CRITICAL: Erro ao conectar no banco: {e}")
-        return None
 
-def execute_query(sql, params=None):
+    def __init__(self, fabrica, min_conexoes=1, max_conexoes=10, tempo_ocioso=300,
+                 intervalo_health_check=30, timeout_espera=30):
+        self._fabrica = fabrica
+        self.min_conexoes = max(0, min_conexoes)
+        self.max_conexoes = max(1, max_conexoes, self.min_conexoes)
+        self.tempo_ocioso = tempo_ocioso
+        self.intervalo_health_check = intervalo_health_check
+        self.timeout_espera = timeout_espera
+
+        self._cond = threading.Condition()
+        self._livres = []           # Lista de (conexao, ultimo_uso). Usada como pilha (LIFO).
+        self._total = 0             # Conexões abertas (livres + em uso + sendo criadas)
+        self._local = threading.local()
+        self._stats = {'em_uso': 0, 'aguardando': 0, 'criadas': 0, 'recicladas': 0, 'expiradas': 0, 'emprestimos': 0}
+
+    # --- Auxiliares internas ---
+
+    def _criar(self):
+        conn = self._fabrica()
+        with self._cond:
+            self._stats['criadas'] += 1
+        return conn
+
+    @staticmethod
+    def _fechar(conn):
+        try: conn.close()
+        except: pass
+
+    @staticmethod
+    def _saudavel(conn):
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            return True
+        except:
+            return False
+
+    def _expirar_ociosas(self):
+        """Fecha conexões ociosas além do mínimo. Deve ser chamada com o lock adquirido."""
+        if not self.tempo_ocioso: return []
+        agora = time.monotonic()
+        expiradas = []
+        # As mais antigas ficam no início da pilha
+        while self._livres and self._total > self.min_conexoes:
+            conn, ultimo_uso = self._livres[0]
+            if agora - ultimo_uso < self.tempo_ocioso: break
+            self._livres.pop(0)
+            self._total -= 1
+            self._stats['expiradas'] += 1
+            expiradas.append(conn)
+        return expiradas
+
+    # --- API pública ---
+
+    def adquirir(self, compartilhada=True):
+        """
+        Retira uma conexão do pool (ou reaproveita a que a thread atual já possui).
+        compartilhada=False entrega uma conexão exclusiva, que não é reaproveitada pela thread.
+        Use isso quando a conexão vai ficar com um cursor aberto (leitura em lotes), pois o
+        SQL Server não aceita outra consulta na mesma conexão enquanto há resultados pendentes.
+        """
+        local = self._local
+        if compartilhada and getattr(local, 'conn', None) is not None:
+            local.profundidade += 1
+            return local.conn
+
+        limite = time.monotonic() + self.timeout_espera if self.timeout_espera else None
+        while True:
+            conn, ultimo_uso, criar = None, None, False
+            with self._cond:
+                expiradas = self._expirar_ociosas()
+                while not self._livres and self._total >= self.max_conexoes:
+                    restante = None if limite is None else limite - time.monotonic()
+                    if restante is not None and restante <= 0:
+                        raise TimeoutError(f"Pool esgotado: {self.max_conexoes} conexões em uso")
+                    self._stats['aguardando'] += 1
+                    try: self._cond.wait(restante)
+                    finally: self._stats['aguardando'] -= 1
+                if self._livres:
+                    conn, ultimo_uso = self._livres.pop()
+                else:
+                    self._total += 1
+                    criar = True
+
+            for c in expiradas: self._fechar(c)
+
+            if criar:
+                try:
+                    conn = self._criar()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            elif time.monotonic() - ultimo_uso >= self.intervalo_health_check and not self._saudavel(conn):
+                # Conexão morta (timeout do servidor, queda de rede...): descarta e tenta outra
+                self._fechar(conn)
+                with self._cond:
+                    self._total -= 1
+                    self._stats['recicladas'] += 1
+                    self._cond.notify()
+                continue
+
+            with self._cond:
+                self._stats['em_uso'] += 1
+                self._stats['emprestimos'] += 1
+            if not compartilhada: return conn
+            local.conn = conn
+            local.profundidade = 1
+            local.descartar = False
+            return conn
+
+    def devolver(self, conn, descartar=False):
+        """
+        Devolve a conexão ao pool.
+        Use descartar=True quando a conexão apresentou erro e não deve ser reutilizada.
+        """
+        local = self._local
+        if getattr(local, 'conn', None) is conn:
+            # Chamadas aninhadas na mesma thread: só devolve quando a mais externa terminar
+            local.profundidade -= 1
+            local.descartar = local.descartar or descartar
+            if local.profundidade > 0: return
+            descartar = local.descartar
+            local.conn = None
+            local.descartar = False
+
+        with self._cond:
+            self._stats['em_uso'] -= 1
+            if descartar:
+                self._total -= 1
+                self._stats['recicladas'] += 1
+            else:
+                self._livres.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if descartar: self._fechar(conn)
+
+    @contextmanager
+    def conexao(self, compartilhada=True):
+        """Uso: with pool.conexao() as conn: ..."""
+        conn = self.adquirir(compartilhada)
+        descartar = False
+        try:
+            yield conn
+        except Exception as e:
+            # Erro de driver/rede: a conexão pode ter ficado inconsistente
+            descartar = _erro_de_conexao(e)
+            raise
+        finally:
+            self.devolver(conn, descartar)
+
+    def fechar_todas(self):
+        """Fecha as conexões livres (as que estão em uso serão fechadas ao serem descartadas)."""
+        with self._cond:
+            livres, self._livres = self._livres, []
+            self._total -= len(livres)
+        for conn, _ in livres: self._fechar(conn)
+
+    def estatisticas(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'abertas': self._total,
+                'livres': len(self._livres),
+                'min': self.min_conexoes,
+                'max': self.max_conexoes,
+            })
+        return stats
+
+def _erro_de_conexao(e):
+    """True se o erro indica conexão quebrada (o pandas embrulha o erro do pyodbc em __cause__)."""
+    erro = e if isinstance(e, pyodbc.Error) else getattr(e, '__cause__', None)
+    return isinstance(erro, (pyodbc.OperationalError, pyodbc.InterfaceError))
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def _nova_conexao():
+    # autocommit: o sistema só faz leituras; assim nenhuma transação implícita fica
+    # aberta enquanto a conexão descansa no pool.
+    return pyodbc.connect(Config.SQL_CONNECTION_STRING, autocommit=True)
+
+def obter_pool():
+    """Devolve o pool global, criando-o na primeira chamada."""
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = PoolConexoes(
+                    _nova_conexao,
+                    min_conexoes=Config.DB_POOL_MIN,
+                    max_conexoes=Config.DB_POOL_MAX,
+                    tempo_ocioso=Config.DB_POOL_TEMPO_OCIOSO,
+                    intervalo_health_check=Config.DB_POOL_HEALTH_CHECK,
+                    timeout_espera=Config.DB_POOL_TIMEOUT,
+                )
+    return _POOL
+
+def estatisticas_pool():
+    """Estatísticas do pool (em uso, aguardando, criadas, recicladas...) para dimensionamento."""
+    return obter_pool().estatisticas()
+
+# --- MATERIALIZAÇÃO TIPADA ---
+# Tipos aceitos no parâmetro 'schema' das funções de consulta: {'COLUNA': 'tipo'}
+TIPOS_SCHEMA = ('numerico', 'inteiro', 'data', 'categoria', 'texto')
+
+def _coluna_tipada(valores, tipo, arrow=False):
+    """Monta uma coluna já no tipo certo a partir da tupla de valores vinda do pyodbc."""
+    if tipo == 'numerico':
+        try:
+            # Caminho rápido: Decimal/int/float/None direto para float64, sem passar por coluna 'object'
+            return np.fromiter((np.nan if v is None else float(v) for v in valores), dtype='float64', count=len(valores))
+        except (TypeError, ValueError):
+            return pd.to_numeric(pd.Series(valores, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    if tipo == 'inteiro':
+        try: return pd.array(valores, dtype='Int64')
+        except (TypeError, ValueError): return _coluna_tipada(valores, 'numerico')
+    if tipo == 'data':
+        return pd.to_datetime(pd.Series(valores, dtype=object), errors='coerce').to_numpy()
+    if tipo == 'categoria':
+        return pd.Categorical(valores)
+    if tipo == 'texto':
+        if arrow and TEM_PYARROW: return pd.array(valores, dtype='string[pyarrow]')
+        return np.array(valores, dtype=object)
+    raise ValueError(f"Tipo de coluna desconhecido no schema: {tipo} (aceitos: {', '.join(TIPOS_SCHEMA)})")
+
+def _materializar(linhas, colunas, schema=None, arrow=False):
+    """
+    Converte as linhas do cursor em DataFrame.
+    Colunas declaradas no schema já nascem tipadas; as demais seguem a regra do pd.read_sql.
+    """
+    if not schema:
+        # coerce_float: Decimal -> float, igual ao pd.read_sql
+        return pd.DataFrame.from_records(linhas, columns=colunas, coerce_float=True)
+
+    # Transpõe uma única vez: uma tupla de valores por coluna
+    valores = list(zip(*linhas)) if linhas else [()] * len(colunas)
+
+    livres = [i for i, c in enumerate(colunas) if c not in schema]
+    df = pd.DataFrame.from_records(
+        list(zip(*(valores[i] for i in livres))) if linhas else [],
+        columns=[colunas[i] for i in livres], coerce_float=True
+    ) if livres else pd.DataFrame(index=pd.RangeIndex(len(linhas)))
+
+    for i, c in enumerate(colunas):
+        if c in schema: df[c] = _coluna_tipada(valores[i], schema[c], arrow)
+    return df[colunas]
+
+def _nome_chamador():
+    """Nome da função que chamou o execute_query (rótulo padrão nas métricas)."""
+    try: return sys._getframe(2).f_code.co_name
+    except ValueError: return 'desconhecido'
+
+def execute_query(sql, params=None, schema=None, arrow=None, nome=None, propagar_erro=False):
     """
     Executa uma query e retorna um DataFrame pandas.
-    Esta é a função que o resto do sistema está a tentar importar e não encontra.
+    A conexão vem do pool e é devolvida a ele ao final (não é fechada).
+
+    schema (opcional): {'COLUNA': 'numerico' | 'inteiro' | 'data' | 'categoria' | 'texto'}.
+    As colunas declaradas são montadas já no tipo certo direto das linhas do pyodbc,
+    dispensando o pd.to_numeric / pd.to_datetime depois da consulta.
+    arrow: guarda as colunas 'texto' em formato Arrow (se o pyarrow estiver instalado).
+    Por padrão segue Config.SQL_ARROW.
+    nome: rótulo da consulta nas métricas e no log de consultas lentas
+    (por padrão, o nome da função que chamou).
+    propagar_erro: repassa a exceção em vez de devolver DataFrame vazio
+    (para quem precisa distinguir "sem dados" de "falhou" e tentar outro caminho).
     """
-    conn = get_connection()
-    
-    if conn is None:
+    if arrow is None: arrow = Config.SQL_ARROW
+    nome = nome or _nome_chamador()
+    pool = obter_pool()
+
+    t0 = time.perf_counter()
+    try:
+        conn = pool.adquirir()
+    except Exception as e:
+        print(f"CRITICAL: Erro ao conectar no banco: {e}")
+        registrar_consulta(nome, sql, params, (time.perf_counter() - t0) * 1000, 0.0, 0.0, 0, 0, erro=e)
+        if propagar_erro: raise
         return pd.DataFrame()
-    
+    t1 = t2 = time.perf_counter()
+
+    descartar = False
+    df, erro = pd.DataFrame(), None
     try:
-        if params:
-            df = pd.read_sql(sql, conn, params=params)
-        else:
-            df = pd.read_sql(sql, conn)
+        cursor = conn.cursor()
+        try:
+            if params: cursor.execute(sql, params)
+            else: cursor.execute(sql)
+            t2 = time.perf_counter()
+            colunas = [c[0] for c in cursor.description]
+            df = _materializar(cursor.fetchall(), colunas, schema, arrow)
+        finally:
+            cursor.close()
         return df
-        
+
     except Exception as e:
         print(f"Erro na execução da query: {e}")
+        # Se a conexão caiu, ela não volta para o pool
+        descartar = _erro_de_conexao(e)
+        erro = e
+        if propagar_erro: raise
         return pd.DataFrame()
-        
+
     finally:
-        try:
-            conn.close()
-        except:
-            pass
\ No newline at end of file
+        pool.devolver(conn, descartar)
+        t3 = time.perf_counter()
+        # deep=False: conta só os ponteiros das colunas de texto (aproximado, mas barato)
+        bytes_aprox = int(df.memory_usage(index=False, deep=False).sum()) if not df.empty else 0
+        registrar_consulta(nome, sql, params, (t1 - t0) * 1000, (t2 - t1) * 1000, (t3 - t2) * 1000, len(df), bytes_aprox, erro)
+
+def execute_query_em_lotes(sql, params=None, tamanho_lote=None, schema=None, arrow=None, nome='lotes'):
+    """
+    Versão em streaming do execute_query: devolve um gerador de DataFrames com no
+    máximo 'tamanho_lote' linhas cada (cursor.fetchmany).
+    Serve para extrações grandes, em que carregar tudo num único DataFrame estoura a memória.
+
+    Aceita o mesmo 'schema' do execute_query.
+    Diferente do execute_query, erros são propagados: quem consome decide o que fazer
+    com um resultado parcial.
+    """
+    tamanho_lote = tamanho_lote or Config.SQL_TAMANHO_LOTE
+    if arrow is None: arrow = Config.SQL_ARROW
+
+    # Tempos acumulados: o tempo que o consumidor gasta entre um lote e outro não entra na conta
+    conexao_ms = execucao_ms = leitura_ms = 0.0
+    linhas_total = bytes_total = 0
+    erro = None
+
+    t0 = time.perf_counter()
+    # Conexão exclusiva: o cursor fica aberto enquanto o gerador é consumido
+    try:
+        with obter_pool().conexao(compartilhada=False) as conn:
+            t1 = time.perf_counter()
+            conexao_ms = (t1 - t0) * 1000
+            cursor = conn.cursor()
+            try:
+                if params: cursor.execute(sql, params)
+                else: cursor.execute(sql)
+                execucao_ms = (time.perf_counter() - t1) * 1000
+                colunas = [c[0] for c in cursor.description]
+
+                while True:
+                    t = time.perf_counter()
+                    linhas = cursor.fetchmany(tamanho_lote)
+                    if not linhas: break
+                    lote = _materializar(linhas, colunas, schema, arrow)
+                    leitura_ms += (time.perf_counter() - t) * 1000
+                    linhas_total += len(lote)
+                    bytes_total += int(lote.memory_usage(index=False, deep=False).sum())
+                    yield lote
+            finally:
+                try: cursor.close()
+                except: pass
+    except Exception as e:
+        erro = e
+        raise
+    finally:
+        registrar_consulta(nome, sql, params, conexao_ms, execucao_ms, leitura_ms, linhas_total, bytes_total, erro)
+
+# --- CONSULTAS COM LISTAS GRANDES DE CHAVES (IN) ---
+
+def _tamanho_lote_chaves(qtd, maximo):
+    """
+    Arredonda a quantidade de chaves para a próxima potência de 2 (mínimo 8, até o máximo).
+    Assim só existem poucos "formatos" de IN (?, ?, ...) e o SQL Server reaproveita o plano.
+    """
+    tamanho = 8
+    while tamanho < qtd and tamanho < maximo: tamanho *= 2
+    return min(tamanho, maximo)
+
+def execute_query_por_chaves(sql, chaves, params_antes=None, params_depois=None, tamanho_lote=None,
+                             max_workers=None, schema=None, nome=None, propagar_erro=False):
+    """
+    Executa uma consulta com 'IN ({placeholders})' para uma lista de chaves de qualquer tamanho.
+
+    - As chaves são deduplicadas e divididas em lotes de tamanho fixo (Config.SQL_LOTE_CHAVES).
+      O último lote é completado repetindo a última chave, para todos terem o mesmo formato
+      (o SQL Server limita a 2100 parâmetros por comando e não reaproveita planos de IN com tamanhos variados).
+    - Os lotes rodam em paralelo, cada um com sua conexão do pool.
+    - O resultado é um único DataFrame, igual ao que o execute_query devolveria.
+
+    params_antes / params_depois: parâmetros que aparecem no SQL antes/depois do IN.
+    propagar_erro: como no execute_query. Se um lote falha, a consulta inteira falha (exceção ou DataFrame vazio):
+    nunca volta só a parte dos lotes que deu certo.
+    """
+    chaves = list(dict.fromkeys(chaves))  # remove repetidas mantendo a ordem
+    if not chaves: return pd.DataFrame()
+
+    nome = nome or _nome_chamador()
+    maximo = tamanho_lote or Config.SQL_LOTE_CHAVES
+    tamanho = _tamanho_lote_chaves(len(chaves), maximo)
+    sql_lote = sql.replace('{placeholders}', ','.join('?' * tamanho))
+    antes, depois = list(params_antes or []), list(params_depois or [])
+
+    lotes = []
+    for i in range(0, len(chaves), tamanho):
+        lote = chaves[i:i + tamanho]
+        lote += [lote[-1]] * (tamanho - len(lote))
+        lotes.append(antes + lote + depois)
+
+    if len(lotes) == 1:
+        return execute_query(sql_lote, lotes[0], schema=schema, nome=nome, propagar_erro=propagar_erro)
+
+    workers = min(len(lotes), max_workers or Config.SQL_LOTE_CHAVES_WORKERS)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            resultados = list(executor.map(lambda p: execute_query(sql_lote, p, schema=schema, nome=nome, propagar_erro=True), lotes))
+    except Exception:
+        # O erro do lote já foi impresso e registrado pelo execute_query
+        if propagar_erro: raise
+        return pd.DataFrame()
+
+    com_dados = [df for df in resultados if not df.empty]
+    if not com_dados: return resultados[0]
+    return pd.concat(com_dados, ignore_index=True)
@@ -0,0 +1,96 @@
+# --- MÉTRICAS DAS CONSULTAS SQL ---
+# O execute_query registra aqui o tempo de cada chamada (conexão, execução, leitura),
+# a quantidade de linhas e o tamanho aproximado do resultado, agrupados por nome da consulta.
+# Consultas acima do limite configurado vão para o log de consultas lentas (uma linha JSON por consulta).
+
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from collections import deque
+from datetime import datetime
+
+from config import Config
+
+_LOCK = threading.Lock()
+_LOCK_LOG = threading.Lock()
+_METRICAS = {}  # nome -> {'chamadas', 'erros', 'linhas', 'bytes', 'amostras': deque}
+
+def _arquivo_log_lento():
+    if Config.SLOW_QUERY_LOG: return Config.SLOW_QUERY_LOG
+    return os.path.join(Config.PATH_CACHE or tempfile.gettempdir(), 'vila_slow_queries.log')
+
+def _gravar_consulta_lenta(registro):
+    try:
+        with _LOCK_LOG:
+            with open(_arquivo_log_lento(), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+    except Exception as e:
+        print(f"Erro ao gravar log de consultas lentas: {e}")
+
+def registrar_consulta(nome, sql, params, conexao_ms, execucao_ms, leitura_ms, linhas, bytes_aprox, erro=None):
+    """Guarda a medição de uma chamada e, se passou do limite, escreve no log de consultas lentas."""
+    total_ms = conexao_ms + execucao_ms + leitura_ms
+    amostra = (total_ms, conexao_ms, execucao_ms, leitura_ms)
+
+    with _LOCK:
+        m = _METRICAS.get(nome)
+        if m is None:
+            m = _METRICAS[nome] = {'chamadas': 0, 'erros': 0, 'linhas': 0, 'bytes': 0,
+                                   'amostras': deque(maxlen=Config.METRICAS_AMOSTRAS)}
+        m['chamadas'] += 1
+        m['linhas'] += linhas
+        m['bytes'] += bytes_aprox
+        if erro: m['erros'] += 1
+        m['amostras'].append(amostra)
+
+    if Config.SLOW_QUERY_MS and total_ms >= Config.SLOW_QUERY_MS:
+        _gravar_consulta_lenta({
+            'data': datetime.now().isoformat(timespec='seconds'),
+            'nome': nome,
+            'total_ms': round(total_ms, 1),
+            'conexao_ms': round(conexao_ms, 1),
+            'execucao_ms': round(execucao_ms, 1),
+            'leitura_ms': round(leitura_ms, 1),
+            'linhas': linhas,
+            'bytes_aprox': bytes_aprox,
+            'qtd_parametros': len(params) if params else 0,
+            'erro': str(erro) if erro else None,
+            'sql': re.sub(r'\s+', ' ', sql).strip()[:2000],
+        })
+
+def _percentil(valores_ordenados, p):
+    if not valores_ordenados: return 0.0
+    # Método nearest-rank
+    idx = min(len(valores_ordenados) - 1, max(0, math.ceil(p / 100.0 * len(valores_ordenados)) - 1))
+    return round(valores_ordenados[idx], 1)
+
+def resumo_metricas():
+    """Percentis de tempo (sobre as últimas N chamadas) e totais por consulta, do mais lento para o mais rápido (p95)."""
+    with _LOCK:
+        copia = {nome: (dict(m), list(m['amostras'])) for nome, m in _METRICAS.items()}
+
+    resumo = {}
+    for nome, (m, amostras) in copia.items():
+        total = sorted(a[0] for a in amostras)
+        conexao = sorted(a[1] for a in amostras)
+        execucao = sorted(a[2] for a in amostras)
+        leitura = sorted(a[3] for a in amostras)
+        resumo[nome] = {
+            'chamadas': m['chamadas'],
+            'erros': m['erros'],
+            'linhas_media': round(m['linhas'] / m['chamadas'], 1) if m['chamadas'] else 0,
+            'bytes_media': int(m['bytes'] / m['chamadas']) if m['chamadas'] else 0,
+            'total_ms': {'p50': _percentil(total, 50), 'p90': _percentil(total, 90), 'p95': _percentil(total, 95),
+                         'p99': _percentil(total, 99), 'max': round(total[-1], 1) if total else 0.0},
+            'conexao_ms_p50': _percentil(conexao, 50),
+            'execucao_ms_p50': _percentil(execucao, 50),
+            'leitura_ms_p50': _percentil(leitura, 50),
+        }
+    return dict(sorted(resumo.items(), key=lambda kv: kv[1]['total_ms']['p95'], reverse=True))
+
+def limpar_metricas():
+    with _LOCK:
+        _METRICAS.clear()
@@ -0,0 +1,132 @@
+# --- CACHE EM MEMÓRIA PARA CONSULTAS DE REFERÊNCIA ---
+# Filiais, fornecedores e consignações mudam poucas vezes por dia, mas são lidos
+# em quase toda tela e em toda execução do robô. Este módulo guarda o resultado
+# dessas consultas na memória por um tempo (TTL), evitando idas repetidas ao ERP.
+
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import pandas as pd
+
+# Registro de todas as funções decoradas (nome -> cache), usado para invalidação e estatísticas
+_CACHES = {}
+
+def _copiar(valor):
+    """
+    Entrega uma cópia do valor guardado.
+    Quem chama costuma alterar o resultado (ex: df['KEY_CNPJ'] = ...), e isso não pode sujar o cache.
+    """
+    if isinstance(valor, pd.DataFrame):
+        return valor.copy()
+    if isinstance(valor, list):
+        return [dict(v) if isinstance(v, dict) else v for v in valor]
+    return valor
+
+def _vazio(valor):
+    if isinstance(valor, pd.DataFrame): return valor.empty
+    if isinstance(valor, (list, dict)): return not valor
+    return valor is None
+
+class CacheTTL:
+    """Cache LRU com expiração por tempo. Thread-safe."""
+
+    def __init__(self, nome, ttl, max_itens):
+        self.nome = nome
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._dados = OrderedDict()  # chave -> (expira_em, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.despejados = 0
+
+    def obter(self, chave):
+        """Devolve (True, valor) se a chave estiver válida no cache, senão (False, None)."""
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is not None:
+                expira_em, valor = item
+                if time.monotonic() < expira_em:
+                    self._dados.move_to_end(chave)
+                    self.hits += 1
+                    return True, valor
+                del self._dados[chave]
+                self.expirados += 1
+            self.misses += 1
+            return False, None
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = (time.monotonic() + self.ttl, valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+                self.despejados += 1
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'ttl': self.ttl,
+                'itens': len(self._dados),
+                'max_itens': self.max_itens,
+                'hits': self.hits,
+                'misses': self.misses,
+                'taxa_acerto': round(self.hits / total, 4) if total else 0.0,
+                'expirados': self.expirados,
+                'despejados': self.despejados,
+            }
+
+def cache_ttl(ttl=600, max_itens=64):
+    """
+    Decorador que memoriza o resultado da função pelos argumentos recebidos.
+
+    - ttl: segundos que o resultado fica válido.
+    - max_itens: quantas combinações de argumentos guardar (as menos usadas saem primeiro).
+
+    Resultados vazios não são guardados: o execute_query devolve DataFrame vazio quando
+    o banco falha, e não queremos "lembrar" de uma falha por minutos.
+    """
+    def decorador(func):
+        cache = CacheTTL(func.__name__, ttl, max_itens)
+        _CACHES[func.__name__] = cache
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Argumentos vêm da URL como texto ('1') ou do código como número (1): normaliza
+            chave = (tuple(str(a) for a in args), tuple(sorted((k, str(v)) for k, v in kwargs.items())))
+            achou, valor = cache.obter(chave)
+            if achou: return _copiar(valor)
+
+            valor = func(*args, **kwargs)
+            if not _vazio(valor): cache.guardar(chave, _copiar(valor))
+            return valor
+
+        wrapper.cache = cache
+        return wrapper
+    return decorador
+
+def invalidar_cache(nome=None):
+    """
+    Limpa o cache de uma função (pelo nome) ou de todas, se nome=None.
+    Retorna a lista de caches limpos.
+    """
+    nomes = [nome] if nome else list(_CACHES.keys())
+    limpos = []
+    for n in nomes:
+        cache = _CACHES.get(n)
+        if cache is not None:
+            cache.limpar()
+            limpos.append(n)
+    return limpos
+
+def estatisticas_cache():
+    """Hits, misses e tamanho de cada cache registrado."""
+    return {nome: cache.estatisticas() for nome, cache in _CACHES.items()}
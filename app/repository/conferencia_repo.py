@@ -1,6 +1,6 @@
 # --- IMPORTAÇÕES ---
 # Importa a função genérica de execução de SQL (que gerencia a conexão)
-from app.database import execute_query
+from app.database import execute_query, execute_query_em_lotes, execute_query_por_chaves
 # Pandas: Essencial para receber os dados do SQL já em formato de tabela
 import pandas as pd
 import sys
@@ -23,12 +23,13 @@ def buscar_pedidos_para_conferencia(fornecedor_id, status_id, data_ini, data_fim
     """
     
     # Executa a query passando os parâmetros de forma segura (evita SQL Injection)
-    df = execute_query(sql, [fornecedor_id, status_id, data_ini, data_fim])
+    # O schema faz a coluna de data já chegar como datetime (sem conversão depois)
+    df = execute_query(sql, [fornecedor_id, status_id, data_ini, data_fim], schema={'DT_PED': 'data'})
     
     # Se encontrou dados, faz um tratamento estético antes de enviar para o site
     if not df.empty:
         # Formata a data para o padrão brasileiro (DD/MM/AAAA)
-        df['DT_PED'] = pd.to_datetime(df['DT_PED']).dt.strftime('%d/%m/%Y')
+        df['DT_PED'] = df['DT_PED'].dt.strftime('%d/%m/%Y')
         # Preenche filiais vazias para não quebrar o layout
         df['FILIAL'] = df['FILIAL'].fillna('')
         # Retorna lista de dicionários (formato fácil para o HTML ler)
@@ -36,18 +37,17 @@ def buscar_pedidos_para_conferencia(fornecedor_id, status_id, data_ini, data_fim
         
     return []
 
-def buscar_acerto_sql_repo(pedidos_list):
+def buscar_acerto_sql_repo(pedidos_list, propagar_erro=False):
     """
     Busca os ITENS detalhados dos pedidos selecionados pelo usuário.
     Esta consulta traz ISBN, Quantidade, Valor Unitário, etc.
+    propagar_erro=True repassa a falha do banco em vez de devolver um resultado vazio.
     """
     if not pedidos_list: return pd.DataFrame()
     
-    # Cria uma string de '?, ?, ?' baseada na quantidade de pedidos selecionados
-    # Necessário para a cláusula 'IN' do SQL funcionar com parâmetros dinâmicos
-    placeholders = ','.join('?' for _ in pedidos_list)
-    
-    sql = f"""
+    # O '{placeholders}' vira '?, ?, ?' no execute_query_por_chaves, que divide
+    # listas grandes de pedidos em lotes de tamanho fixo
+    sql = """
         SELECT 
             C2.FANTASIA AS FILIAL, 
             PIT.DESCRICAO AS Titulo, 
@@ -70,34 +70,61 @@ def buscar_acerto_sql_repo(pedidos_list):
         WHERE PC.PEDIDO IN ({placeholders}) AND PC.TIPO_ACERTO = 1 
     """
     
-    return execute_query(sql, pedidos_list)
+    # Valores já tipados na leitura (o serviço não precisa reconverter colunas 'object')
+    schema = {c: 'numerico' for c in ['Quant', 'VlUnit', 'VlLiqItem', 'DescontoHeader', 'VlLiq', 'TotalLiq']}
+    return execute_query_por_chaves(sql, pedidos_list, schema=schema, propagar_erro=propagar_erro)
+
+# Tipos das colunas do relatório de vendas
+_SCHEMA_VENDAS = {'Valor_Total': 'numerico', 'Quantidade': 'numerico'}
 
-def buscar_vendas_sql_repo(data_ini, data_fim, fornecedor_id):
+# SQL do relatório de vendas (uma linha por item de nota), lido em lotes
+_SQL_VENDAS = """
+    SELECT SUBSTRING(f.FANTASIA, 1, 150) AS Filial, ISNULL(p.novo_isbn, p.cod_barra) AS ISBN,
+    round(i.QTT*i.PRECUNITLIQ,4) + isnull(i.VALOR_IPI,0) + isnull(i.VL_ICMS_ST,0) - isnull(i.VL_ITEM_DESCONTO,0) + isnull(i.OUTRASDESPESAS_ACESSORIOS,0) + isnull(i.VL_FRETEXITEM,0) as Valor_Total, ISNULL(ROUND(i.QTT, 3), 0) AS Quantidade
+    FROM ERIS_LIVRARIAVILA.dbo.NF_CAB N
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.NF_ITEM I ON N.NF = I.NF AND N.EMITENTE = i.EMITENTE
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.NATOPER NTOP ON N.NATUREZA_ID = NTOP.NATUREZA_ID
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.CLIENTE f ON n.EMITENTE = f.CODECLI
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.PRODUTO p ON i.PRODCODE = p.PRODCODE
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.PROD_LINHA pl ON p.LINPROD_ID = pl.LINPROD_ID
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.CLIENTE Forn ON pl.CODECLI = Forn.CODECLI
+    WHERE N.STATUS = 0 AND N.TIPOPAG <> 4 AND N.TIPO_NF = 0 AND NTOP.TIPONATUREZA = 1 
+    AND ISNULL(N.IS_NF_COMPLEMENTAR, '-1') NOT IN ('1')
+    AND N.DT_FAT >= ? AND N.DT_FAT <= ? AND ISNULL(forn.codecli, 0) = ?
+"""
+
+def buscar_vendas_sql_repo_em_lotes(data_ini, data_fim, fornecedor_id, tamanho_lote=None):
     """
-    Busca o relatório de VENDAS no período para cruzar com o Acerto.
-    Essencial para o cálculo da divergência (O que deveria ser devolvido vs O que foi vendido).
+    Busca o relatório de VENDAS no período para cruzar com o Acerto, entregue em pedaços (gerador de DataFrames).
+    Para fornecedores grandes em períodos longos, evita ter todas as linhas de NF_ITEM na memória ao mesmo tempo.
     """
-    sql = """
-        SELECT SUBSTRING(f.FANTASIA, 1, 150) AS Filial, ISNULL(p.novo_isbn, p.cod_barra) AS ISBN,
-        round(i.QTT*i.PRECUNITLIQ,4) + isnull(i.VALOR_IPI,0) + isnull(i.VL_ICMS_ST,0) - isnull(i.VL_ITEM_DESCONTO,0) + isnull(i.OUTRASDESPESAS_ACESSORIOS,0) + isnull(i.VL_FRETEXITEM,0) as Valor_Total, ISNULL(ROUND(i.QTT, 3), 0) AS Quantidade
-        FROM ERIS_LIVRARIAVILA.dbo.NF_CAB N
-        LEFT JOIN ERIS_LIVRARIAVILA.dbo.NF_ITEM I ON N.NF = I.NF AND N.EMITENTE = i.EMITENTE
-        LEFT JOIN ERIS_LIVRARIAVILA.dbo.NATOPER NTOP ON N.NATUREZA_ID = NTOP.NATUREZA_ID
-        LEFT JOIN ERIS_LIVRARIAVILA.dbo.CLIENTE f ON n.EMITENTE = f.CODECLI
-        LEFT JOIN ERIS_LIVRARIAVILA.dbo.PRODUTO p ON i.PRODCODE = p.PRODCODE
-        LEFT JOIN ERIS_LIVRARIAVILA.dbo.PROD_LINHA pl ON p.LINPROD_ID = pl.LINPROD_ID
-        LEFT JOIN ERIS_LIVRARIAVILA.dbo.CLIENTE Forn ON pl.CODECLI = Forn.CODECLI
-        WHERE N.STATUS = 0 AND N.TIPOPAG <> 4 AND N.TIPO_NF = 0 AND NTOP.TIPONATUREZA = 1 
-        AND ISNULL(N.IS_NF_COMPLEMENTAR, '-1') NOT IN ('1')
-        AND N.DT_FAT >= ? AND N.DT_FAT <= ? AND ISNULL(forn.codecli, 0) = ?
+    return execute_query_em_lotes(_SQL_VENDAS, [data_ini, data_fim, fornecedor_id], tamanho_lote,
+                                  schema=_SCHEMA_VENDAS, nome='buscar_vendas_sql_repo_em_lotes')
+
+# Versão agregada: o próprio SQL Server agrupa por filial/ISBN (já aparados e em minúsculas).
+# Em vez de uma linha por item de nota, chega uma linha por título em cada loja.
+_SQL_VENDAS_AGREGADAS = """
+    SELECT LOWER(LTRIM(RTRIM(SUBSTRING(f.FANTASIA, 1, 150)))) AS Filial,
+    LTRIM(RTRIM(ISNULL(p.novo_isbn, p.cod_barra))) AS ISBN,
+    SUM(round(i.QTT*i.PRECUNITLIQ,4) + isnull(i.VALOR_IPI,0) + isnull(i.VL_ICMS_ST,0) - isnull(i.VL_ITEM_DESCONTO,0) + isnull(i.OUTRASDESPESAS_ACESSORIOS,0) + isnull(i.VL_FRETEXITEM,0)) as Valor_Total,
+    SUM(ISNULL(ROUND(i.QTT, 3), 0)) AS Quantidade
+    FROM ERIS_LIVRARIAVILA.dbo.NF_CAB N
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.NF_ITEM I ON N.NF = I.NF AND N.EMITENTE = i.EMITENTE
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.NATOPER NTOP ON N.NATUREZA_ID = NTOP.NATUREZA_ID
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.CLIENTE f ON n.EMITENTE = f.CODECLI
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.PRODUTO p ON i.PRODCODE = p.PRODCODE
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.PROD_LINHA pl ON p.LINPROD_ID = pl.LINPROD_ID
+    LEFT JOIN ERIS_LIVRARIAVILA.dbo.CLIENTE Forn ON pl.CODECLI = Forn.CODECLI
+    WHERE N.STATUS = 0 AND N.TIPOPAG <> 4 AND N.TIPO_NF = 0 AND NTOP.TIPONATUREZA = 1 
+    AND ISNULL(N.IS_NF_COMPLEMENTAR, '-1') NOT IN ('1')
+    AND N.DT_FAT >= ? AND N.DT_FAT <= ? AND ISNULL(forn.codecli, 0) = ?
+    GROUP BY LOWER(LTRIM(RTRIM(SUBSTRING(f.FANTASIA, 1, 150)))), LTRIM(RTRIM(ISNULL(p.novo_isbn, p.cod_barra)))
+"""
+
+def buscar_vendas_agregadas_sql_repo(data_ini, data_fim, fornecedor_id):
     """
-    
-    df_raw = execute_query(sql, [data_ini, data_fim, fornecedor_id])
-    
-    # Tratamento de erro importante:
-    # Se não houver vendas, retorna um DataFrame vazio MAS com as colunas certas.
-    # Isso evita erros de "KeyError" no serviço de cálculo quando ele tentar acessar essas colunas.
-    if df_raw.empty: 
-        return pd.DataFrame(columns=['filial', 'ISBN', 'Quant_venda', 'Vl. Unit._venda', 'Preco_Venda_F'])
-    
-    return df_raw
\ No newline at end of file
+    Vendas do período já somadas por (filial, ISBN) no servidor.
+    A limpeza completa do ISBN (regex) continua no serviço, mas agora sobre os valores distintos.
+    Erros são propagados para o serviço poder voltar à leitura item a item.
+    """
+    return execute_query(_SQL_VENDAS_AGREGADAS, [data_ini, data_fim, fornecedor_id], schema=_SCHEMA_VENDAS, propagar_erro=True)
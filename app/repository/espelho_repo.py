@@ -0,0 +1,242 @@
+# --- ESPELHO LOCAL DAS TABELAS DE DIMENSÃO DO ERP ---
+# O cadastro de clientes (CLIENTE: filiais e fornecedores) aparece em quase toda tela do sistema.
+# Este módulo mantém uma cópia dele num arquivo SQLite local, atualizada em segundo plano:
+#   - Sincronização incremental (a cada ESPELHO_INTERVALO_MIN): traz só as linhas com chave
+#     maior que a última copiada (cadastros novos).
+#   - Sincronização completa (a cada ESPELHO_COMPLETA_HORAS): recopia a tabela inteira numa
+#     tabela auxiliar e troca de uma vez, capturando alterações e exclusões.
+# Sem uma coluna de data de alteração conhecida em CLIENTE para sincronizar por ela, o espelho só vale enquanto a última cópia
+# completa tem menos de ESPELHO_IDADE_MAXIMA_HORAS. Depois disso as consultas voltam ao ERP.
+# Consultas que só precisam de dados de cadastro (lista de filiais, contato do fornecedor)
+# respondem daqui, sem depender do servidor do ERP. PRODUTO, PROD_LINHA e COND_PAG não são
+# espelhadas: só aparecem em junções com as tabelas de movimento, que vão ao ERP de qualquer jeito.
+
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from app.database import execute_query_em_lotes
+from config import Config
+
+_TABELAS = {
+    'CLIENTE': {
+        'chave': 'CODECLI',
+        'colunas': ['CODECLI', 'CGC_CPF', 'FANTASIA', 'RAZAOSOCIAL', 'CATEGORIA', 'TELEFONE', 'EMAIL'],
+        'indices': ['CATEGORIA'],
+    },
+}
+
+_LOCK_SYNC = threading.Lock()
+_THREAD_SYNC = None
+# Sincronização pedida pela rota (/api/espelho/sincronizar): quem roda é a própria thread do espelho
+_LOCK_PEDIDO = threading.Lock()
+_ACORDAR = threading.Event()
+_PEDIDO = {'completa': None}
+
+# Leitura: uma conexão por thread, aberta uma vez (o WAL e as tabelas são preparados pela sincronização),
+# e a data da última cópia completa de cada tabela guardada na memória (a sincronização atualiza)
+_LOCAL = threading.local()
+_SITUACAO = None  # tabela -> ULTIMA_COMPLETA
+
+def _caminho_db():
+    if Config.ESPELHO_DB_PATH: return Config.ESPELHO_DB_PATH
+    return os.path.join(Config.PATH_CACHE or tempfile.gettempdir(), 'vila_espelho_erp.db')
+
+def _leitura():
+    db = getattr(_LOCAL, 'db', None)
+    if db is None:
+        db = _LOCAL.db = sqlite3.connect(_caminho_db(), timeout=30)
+    return db
+
+def _situacao():
+    """ULTIMA_COMPLETA de cada tabela, lida do _SYNC só na primeira consulta ({} se ainda não sincronizou)."""
+    global _SITUACAO
+    if _SITUACAO is None:
+        if not os.path.exists(_caminho_db()): return {}
+        try: _SITUACAO = dict(_leitura().execute("SELECT TABELA, ULTIMA_COMPLETA FROM _SYNC").fetchall())
+        except sqlite3.OperationalError: return {}  # arquivo sem o _SYNC
+    return _SITUACAO
+
+def _conectar():
+    db = sqlite3.connect(_caminho_db(), timeout=30)
+    # WAL: leitores não bloqueiam enquanto a sincronização escreve
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("""CREATE TABLE IF NOT EXISTS _SYNC (
+        TABELA TEXT PRIMARY KEY, ULTIMA_COMPLETA TEXT, ULTIMA_INCREMENTAL TEXT, LINHAS INTEGER)""")
+    return db
+
+def _criar_tabela(db, nome_fisico, tabela):
+    cfg = _TABELAS[tabela]
+    colunas = cfg['colunas']
+    defs = ", ".join(f"{c} PRIMARY KEY" if c == cfg['chave'] else c for c in colunas)
+    db.execute(f"CREATE TABLE IF NOT EXISTS {nome_fisico} ({defs})")
+
+def _criar_indices(db, tabela):
+    for col in _TABELAS[tabela]['indices']:
+        db.execute(f"CREATE INDEX IF NOT EXISTS IX_{tabela}_{col} ON {tabela} ({col})")
+
+def _gravar_lote(db, nome_fisico, tabela, lote):
+    cfg = _TABELAS[tabela]
+    lote = lote[cfg['colunas']]
+    # astype(object) + where: tipos do numpy viram tipos do Python e NaN vira NULL
+    linhas = lote.astype(object).where(lote.notna(), None).values.tolist()
+    colunas = cfg['colunas']
+    marcadores = ",".join("?" * len(colunas))
+    db.executemany(f"INSERT OR REPLACE INTO {nome_fisico} ({','.join(colunas)}) VALUES ({marcadores})", linhas)
+    return len(linhas)
+
+def _sincronizar_tabela(db, tabela, completa):
+    cfg = _TABELAS[tabela]
+    chave = cfg['chave']
+    sql = f"SELECT {', '.join(cfg['colunas'])} FROM ERIS_LIVRARIAVILA.DBO.{tabela}"
+    agora = datetime.now().isoformat(timespec='seconds')
+
+    if completa:
+        # Copia para uma tabela auxiliar e troca no final: quem lê nunca vê a tabela pela metade
+        destino = f"{tabela}_NOVA"
+        db.execute(f"DROP TABLE IF EXISTS {destino}")
+        _criar_tabela(db, destino, tabela)
+        params = None
+    else:
+        destino = tabela
+        _criar_tabela(db, destino, tabela)
+        ultimo = db.execute(f"SELECT MAX({chave}) FROM {tabela}").fetchone()[0]
+        if ultimo is None: return _sincronizar_tabela(db, tabela, completa=True)
+        sql += f" WHERE {chave} > ?"
+        params = [ultimo]
+
+    total = 0
+    for lote in execute_query_em_lotes(sql + f" ORDER BY {chave}", params, nome=f'espelho_{tabela}'):
+        total += _gravar_lote(db, destino, tabela, lote)
+        db.commit()
+
+    if completa:
+        db.execute("BEGIN")
+        db.execute(f"DROP TABLE IF EXISTS {tabela}")
+        db.execute(f"ALTER TABLE {destino} RENAME TO {tabela}")
+        _criar_indices(db, tabela)
+        db.execute("INSERT OR REPLACE INTO _SYNC (TABELA, ULTIMA_COMPLETA, ULTIMA_INCREMENTAL, LINHAS) VALUES (?, ?, ?, ?)",
+                   [tabela, agora, agora, total])
+        db.commit()
+    else:
+        db.execute("UPDATE _SYNC SET ULTIMA_INCREMENTAL = ?, LINHAS = (SELECT COUNT(*) FROM " + tabela + ") WHERE TABELA = ?",
+                   [agora, tabela])
+        db.commit()
+    return total
+
+def _descartar_tabelas_antigas(db):
+    # Tabelas copiadas por versões anteriores (PRODUTO, PROD_LINHA, COND_PAG) só ocupariam espaço no arquivo
+    existentes = [r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name <> '_SYNC'")]
+    for nome in existentes:
+        if nome.removesuffix('_NOVA') not in _TABELAS:
+            db.execute(f"DROP TABLE IF EXISTS {nome}")
+    db.execute(f"DELETE FROM _SYNC WHERE TABELA NOT IN ({','.join('?' * len(_TABELAS))})", list(_TABELAS))
+    db.commit()
+
+def sincronizar_espelho(completa=None):
+    """
+    Atualiza todas as tabelas do espelho.
+    completa=None decide sozinho: completa se a última completa for mais antiga que ESPELHO_COMPLETA_HORAS.
+    Retorna {tabela: linhas copiadas} (ou a mensagem de erro da tabela).
+    """
+    resultado = {}
+    with _LOCK_SYNC:
+        db = _conectar()
+        try:
+            _descartar_tabelas_antigas(db)
+            for tabela in _TABELAS:
+                try:
+                    fazer_completa = completa
+                    if fazer_completa is None:
+                        row = db.execute("SELECT ULTIMA_COMPLETA FROM _SYNC WHERE TABELA = ?", [tabela]).fetchone()
+                        idade_h = (datetime.now() - datetime.fromisoformat(row[0])).total_seconds() / 3600 if row and row[0] else None
+                        fazer_completa = idade_h is None or idade_h >= Config.ESPELHO_COMPLETA_HORAS
+                    resultado[tabela] = _sincronizar_tabela(db, tabela, fazer_completa)
+                except Exception as e:
+                    db.rollback()
+                    print(f"Erro ao sincronizar espelho ({tabela}): {e}")
+                    resultado[tabela] = f"erro: {e}"
+            global _SITUACAO
+            _SITUACAO = dict(db.execute("SELECT TABELA, ULTIMA_COMPLETA FROM _SYNC").fetchall())
+        finally:
+            db.close()
+    return resultado
+
+def _loop_sincronizacao():
+    while True:
+        with _LOCK_PEDIDO:
+            completa, _PEDIDO['completa'] = _PEDIDO['completa'], None
+            _ACORDAR.clear()
+        try: sincronizar_espelho(completa)
+        except Exception as e: print(f"Erro na sincronização do espelho: {e}")
+        # Dorme até o próximo intervalo ou até um pedido de sincronização
+        _ACORDAR.wait(Config.ESPELHO_INTERVALO_MIN * 60)
+
+def pedir_sincronizacao(completa=None):
+    """Acorda a thread do espelho para sincronizar agora. Retorna None se aceito, ou o motivo da recusa."""
+    if not Config.ESPELHO_ATIVO: return "Espelho desligado (ESPELHO_ATIVO)."
+    if _THREAD_SYNC is None or not _THREAD_SYNC.is_alive(): return "Sincronização do espelho não está rodando."
+    with _LOCK_PEDIDO:
+        if _LOCK_SYNC.locked() or _ACORDAR.is_set(): return "Sincronização já em andamento."
+        _PEDIDO['completa'] = completa
+        _ACORDAR.set()
+    return None
+
+def iniciar_sincronizacao_espelho():
+    """Sobe a thread de sincronização em segundo plano (uma única vez por processo)."""
+    global _THREAD_SYNC
+    if _THREAD_SYNC is not None and _THREAD_SYNC.is_alive(): return
+    _THREAD_SYNC = threading.Thread(target=_loop_sincronizacao, name='espelho_erp', daemon=True)
+    _THREAD_SYNC.start()
+
+def status_espelho():
+    """Data da última sincronização e quantidade de linhas de cada tabela."""
+    try:
+        db = _conectar()
+        try:
+            rows = db.execute("SELECT TABELA, ULTIMA_COMPLETA, ULTIMA_INCREMENTAL, LINHAS FROM _SYNC").fetchall()
+        finally:
+            db.close()
+    except Exception as e:
+        return {'erro': str(e)}
+    return {r[0]: {'ultima_completa': r[1], 'ultima_incremental': r[2], 'linhas': r[3], 'pronta': _pronta(r[1])} for r in rows}
+
+def _pronta(ultima_completa):
+    # A idade conta da última cópia completa: a incremental só traz cadastros novos, e uma linha
+    # alterada no ERP (nome, CNPJ) só chega ao espelho na completa
+    if not ultima_completa: return False
+    idade_h = (datetime.now() - datetime.fromisoformat(ultima_completa)).total_seconds() / 3600
+    return idade_h < Config.ESPELHO_IDADE_MAXIMA_HORAS
+
+def _consultar(sql, params, tabelas):
+    """
+    Roda uma consulta no espelho. Devolve None se o espelho estiver desligado, ainda não sincronizado
+    ou velho demais: nesse caso quem chamou deve ir ao ERP.
+    """
+    if not Config.ESPELHO_ATIVO: return None
+    try:
+        situacao = _situacao()
+        if not all(_pronta(situacao.get(tabela)) for tabela in tabelas): return None
+        return pd.read_sql(sql, _leitura(), params=params)
+    except Exception as e:
+        print(f"Erro ao consultar espelho: {e}")
+        return None
+
+# --- CONSULTAS RESPONDIDAS PELO ESPELHO ---
+
+def buscar_filiais_espelho():
+    """Mesmo formato de geral_repo.buscar_filiais (CNPJ, Nome_Filial)."""
+    df = _consultar("SELECT CGC_CPF AS CNPJ, FANTASIA AS Nome_Filial FROM CLIENTE WHERE CATEGORIA = 6 ORDER BY CODECLI ASC",
+                    [], ['CLIENTE'])
+    if df is not None and not df.empty:
+        df = df.drop_duplicates(subset=['CNPJ'], keep='first').reset_index(drop=True)
+    return df
+
+def buscar_contato_espelho(cod_cli):
+    """Mesmo formato de gestao_repo.buscar_contato_fornecedor."""
+    return _consultar("SELECT CODECLI AS COD, FANTASIA AS NOME, CGC_CPF AS CNPJ, TELEFONE, EMAIL FROM CLIENTE WHERE CODECLI = ?",
+                      [cod_cli], ['CLIENTE'])
@@ -1,7 +1,15 @@
-from app.database import execute_query
+from app.database import execute_query, execute_query_por_chaves
+from app.repository.cache_consultas import cache_ttl
+from app.repository.espelho_repo import buscar_filiais_espelho
+from config import Config
 import pandas as pd
 
+@cache_ttl(ttl=Config.CACHE_TTL_FILIAIS, max_itens=1)
 def buscar_filiais():
+    # Cadastro de lojas: responde pelo espelho local quando ele está em dia
+    df = buscar_filiais_espelho()
+    if df is not None and not df.empty: return df
+
     sql = "SELECT CGC_CPF AS CNPJ, FANTASIA AS Nome_Filial, CODECLI FROM CLIENTE WHERE CATEGORIA = 6 ORDER BY CODECLI ASC"
     df = execute_query(sql)
     if not df.empty:
@@ -9,6 +17,7 @@ def buscar_filiais():
         df = df.drop(columns=['CODECLI'])
     return df
 
+@cache_ttl(ttl=Config.CACHE_TTL_LISTAS, max_itens=8)
 def listar_fornecedores(tipo_acerto=1):
     sql = """
     SELECT DISTINCT TOP 2000 C.CODECLI, C.FANTASIA 
@@ -20,6 +29,7 @@ def listar_fornecedores(tipo_acerto=1):
     """
     return execute_query(sql, [tipo_acerto]).to_dict('records')
 
+@cache_ttl(ttl=Config.CACHE_TTL_LISTAS, max_itens=512)
 def listar_filiais_do_fornecedor(cod_cli, tipo_acerto=1):
     sql = """
     SELECT DISTINCT C2.CODECLI, C2.FANTASIA 
@@ -46,13 +56,18 @@ def listar_pedidos_do_fornecedor(cod_cli, cod_filial=None, data_ini=None, data_f
     if data_fim: sql += " AND P.DT_PED <= ?"; params.append(data_fim)
     sql += " ORDER BY P.DT_PED DESC"
     
-    df = execute_query(sql, params)
+    df = execute_query(sql, params, schema={'Data_Emissao': 'data', 'Valor_Total': 'numerico'})
     if not df.empty:
         # Garante string para o JSON
-        df['Data_Emissao'] = pd.to_datetime(df['Data_Emissao']).astype(str)
+        df['Data_Emissao'] = df['Data_Emissao'].astype(str)
         return df.to_dict('records')
     return []
 
+# Tipos das colunas de itens de pedido (buscar_pedido_manual / buscar_itens_pedidos_lote)
+_COLS_VALORES_PEDIDO = ['Quant', 'Valor_Liquido', 'Valor_Bruto', 'VlLiqUnit']
+_SCHEMA_ITENS_PEDIDO = {c: 'numerico' for c in _COLS_VALORES_PEDIDO}
+_SCHEMA_ITENS_PEDIDO['Data_Emissao'] = 'data'
+
 def buscar_pedido_manual(numero_pedido, tipo_acerto=1):
     sql = """
     SELECT PC.PEDIDO AS Numero_Pedido, PC.TIPO_ACERTO, C2.FANTASIA AS Filial, C.FANTASIA AS Fornecedor,
@@ -66,10 +81,9 @@ def buscar_pedido_manual(numero_pedido, tipo_acerto=1):
     LEFT JOIN ERIS_LIVRARIAVILA.DBO.CLIENTE C ON P.CODECLI = C.CODECLI
     WHERE PC.PEDIDO = ? AND PC.TIPO_ACERTO = ? AND P.STATUS = 1
     """
-    df = execute_query(sql, [numero_pedido, tipo_acerto])
+    df = execute_query(sql, [numero_pedido, tipo_acerto], schema=_SCHEMA_ITENS_PEDIDO)
     if not df.empty:
-        for c in ['Quant', 'Valor_Liquido', 'Valor_Bruto', 'VlLiqUnit']: 
-            df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0)
+        df[_COLS_VALORES_PEDIDO] = df[_COLS_VALORES_PEDIDO].fillna(0.0)
         return df.to_dict('records') # Retorna lista de dicts
     return []
 
@@ -77,8 +91,8 @@ def buscar_itens_pedidos_lote(lista_pedidos, tipo_acerto_alvo=1):
     pedidos = list(set([str(p) for p in lista_pedidos if p]))
     if not pedidos: return pd.DataFrame()
     
-    placeholders = ','.join(['?'] * len(pedidos))
-    sql = f"""
+    # '{placeholders}' é preenchido em lotes pelo execute_query_por_chaves (milhares de pedidos numa varredura)
+    sql = """
     SELECT PC.PEDIDO AS Numero_Pedido_Chave, PC.TIPO_ACERTO, C2.FANTASIA AS Filial, C.FANTASIA AS Fornecedor,
     P.DT_PED AS Data_Emissao, PRODUTO.COD_BARRA AS ISBN, PIT.DESCRICAO AS Titulo, PIT.QTT AS Quant,
     PIT.PRECUNITLIQ AS VlLiqUnit, (PIT.PRECUNITLIQ * PIT.QTT) AS Valor_Liquido, (PIT.PRECUNITTAB * PIT.QTT) AS Valor_Bruto
@@ -88,15 +102,15 @@ def buscar_itens_pedidos_lote(lista_pedidos, tipo_acerto_alvo=1):
     INNER JOIN ERIS_LIVRARIAVILA.DBO.PEDC_CAB_CONSIG PC ON P.PEDIDO = PC.PEDIDO
     LEFT JOIN ERIS_LIVRARIAVILA.DBO.CLIENTE C2 ON P.EMITENTE = C2.CODECLI
     LEFT JOIN ERIS_LIVRARIAVILA.DBO.CLIENTE C ON P.CODECLI = C.CODECLI
-    WHERE PC.PEDIDO IN ({placeholders}) AND PC.TIPO_ACERTO = {tipo_acerto_alvo} AND P.STATUS = 1
+    WHERE PC.PEDIDO IN ({placeholders}) AND PC.TIPO_ACERTO = ? AND P.STATUS = 1
     """
-    df = execute_query(sql, pedidos)
+    df = execute_query_por_chaves(sql, pedidos, params_depois=[tipo_acerto_alvo], schema=_SCHEMA_ITENS_PEDIDO)
     if not df.empty: 
         df['Numero_Pedido_Chave'] = df['Numero_Pedido_Chave'].astype(str)
-        for c in ['Quant', 'Valor_Liquido', 'Valor_Bruto', 'VlLiqUnit']: 
-            df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0)
+        df[_COLS_VALORES_PEDIDO] = df[_COLS_VALORES_PEDIDO].fillna(0.0)
     return df
 
+@cache_ttl(ttl=Config.CACHE_TTL_FORNECEDORES, max_itens=1)
 def buscar_dados_fornecedores():
     sql = """
     SELECT F.CGC_CPF AS CNPJ, F.Fantasia AS Nome_Fantasia, condpag_desc AS Prazo, FORMAT(co.DATA_VENCIMENTO, 'dd') AS Dia_Acerto
@@ -107,4 +121,4 @@ def buscar_dados_fornecedores():
     """
     df = execute_query(sql)
     if not df.empty: return df.drop_duplicates(subset=['CNPJ'])
-    return df
\ No newline at end of file
+    return df
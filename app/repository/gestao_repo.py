@@ -2,7 +2,9 @@
 import json  # Para salvar o histórico localmente
 import os    # Para verificar se arquivos existem
 import pandas as pd
+from datetime import datetime
 from app.database import execute_query
+from app.repository.espelho_repo import buscar_contato_espelho
 
 # Nome do arquivo onde salvamos o histórico de mensagens/workflow.
 # Isso funciona como um "banco de dados portátil" para dados que não existem no ERP.
@@ -43,8 +45,11 @@ def buscar_contato_fornecedor(cod_cli):
     Busca telefone e email do fornecedor no ERP.
     Usada quando o usuário clica no botão 'Contato'.
     """
-    sql = "SELECT CODECLI AS COD, FANTASIA AS NOME, CGC_CPF AS CNPJ, TELEFONE, EMAIL FROM ERIS_LIVRARIAVILA.DBO.CLIENTE WHERE CODECLI = ?"
-    df = execute_query(sql, [cod_cli])
+    # Cadastro do fornecedor vem do espelho local; se ele não estiver disponível, vai ao ERP
+    df = buscar_contato_espelho(cod_cli)
+    if df is None:
+        sql = "SELECT CODECLI AS COD, FANTASIA AS NOME, CGC_CPF AS CNPJ, TELEFONE, EMAIL FROM ERIS_LIVRARIAVILA.DBO.CLIENTE WHERE CODECLI = ?"
+        df = execute_query(sql, [cod_cli])
     
     if not df.empty:
         # fillna('') remove "NaN" (Not a Number) feio do pandas, trocando por vazio
@@ -109,15 +114,26 @@ def excluir_historico_repo(chave, index):
             return _salvar_workflow_local(db)
     return False
 
-def listar_propostas_gestao(data_ini, data_fim, status_filtro=None, filtro_proposta=None, filtro_fornecedor=None, filtro_filial=None):
-    """
-    A QUERY MONSTRA. Busca propostas, calcula totais, pendências e faturamentos.
-    Esta função alimenta o painel principal de gestão.
-    """
-    # OUTER APPLY: Uma técnica avançada de SQL. É como fazer um "loop" para cada linha da tabela principal (P),
-    # rodando uma subconsulta que soma os itens (I) daquela proposta específica.
-    # Isso permite trazer somatórios (VLR_TOTAL, QTD_ITENS) numa única consulta rápida.
-    sql = """
+# Base comum das consultas de propostas (listagem, página e totais).
+# OUTER APPLY: Uma técnica avançada de SQL. É como fazer um "loop" para cada linha da tabela principal (P),
+# rodando uma subconsulta que soma os itens (I) daquela proposta específica.
+# Isso permite trazer somatórios (VLR_TOTAL, QTD_ITENS) numa única consulta rápida.
+_SQL_PROPOSTAS_FROM = """
+        FROM ERIS_LIVRARIAVILA.DBO.PEDC_CAB P
+        INNER JOIN ERIS_LIVRARIAVILA.DBO.PEDC_CAB_CONSIG PC ON P.PEDIDO = PC.PEDIDO
+        LEFT JOIN ERIS_LIVRARIAVILA.DBO.CLIENTE C_FILIAL ON P.EMITENTE = C_FILIAL.CODECLI
+        LEFT JOIN ERIS_LIVRARIAVILA.DBO.CLIENTE C_FORN ON P.CODECLI = C_FORN.CODECLI
+        OUTER APPLY (
+            SELECT SUM(I.QTT * I.PRECUNITLIQ) AS VLR_TOTAL, COUNT(*) AS QTD_ITENS,
+            SUM(ISNULL(I.QTT_FATURADO, 0)) AS QTD_FATURADA_SUM,
+            SUM(CASE WHEN I.STATUS <> 5 THEN (I.QTT - ISNULL(I.QTT_FATURADO, 0)) ELSE 0 END) AS QTD_PENDENTE_SUM,
+            SUM(CASE WHEN I.STATUS <> 5 THEN (I.QTT - ISNULL(I.QTT_FATURADO, 0)) * I.PRECUNITLIQ ELSE 0 END) AS VLR_PENDENTE_SUM
+            FROM ERIS_LIVRARIAVILA.DBO.PEDC_ITEM I WHERE I.PEDIDO = P.PEDIDO
+        ) ITENS
+        WHERE PC.TIPO_ACERTO = 1 AND P.DT_PED >= ? AND P.DT_PED <= ?
+"""
+
+_SQL_PROPOSTAS_COLUNAS = """
         SELECT 
             P.PEDIDO, P.DT_PED, C_FILIAL.FANTASIA AS FILIAL, C_FORN.FANTASIA AS FORNECEDOR,
             C_FORN.CODECLI AS COD_FORNECEDOR, P.STATUS AS COD_STATUS,
@@ -132,21 +148,26 @@ def listar_propostas_gestao(data_ini, data_fim, status_filtro=None, filtro_propo
             ISNULL(ITENS.QTD_FATURADA_SUM, 0) AS QTD_FATURADA,
             ISNULL(ITENS.QTD_PENDENTE_SUM, 0) AS QTD_PENDENTE,
             ISNULL(ITENS.VLR_PENDENTE_SUM, 0) AS VALOR_PENDENTE
-        FROM ERIS_LIVRARIAVILA.DBO.PEDC_CAB P
-        INNER JOIN ERIS_LIVRARIAVILA.DBO.PEDC_CAB_CONSIG PC ON P.PEDIDO = PC.PEDIDO
-        LEFT JOIN ERIS_LIVRARIAVILA.DBO.CLIENTE C_FILIAL ON P.EMITENTE = C_FILIAL.CODECLI
-        LEFT JOIN ERIS_LIVRARIAVILA.DBO.CLIENTE C_FORN ON P.CODECLI = C_FORN.CODECLI
-        OUTER APPLY (
-            SELECT SUM(I.QTT * I.PRECUNITLIQ) AS VLR_TOTAL, COUNT(*) AS QTD_ITENS,
-            SUM(ISNULL(I.QTT_FATURADO, 0)) AS QTD_FATURADA_SUM,
-            SUM(CASE WHEN I.STATUS <> 5 THEN (I.QTT - ISNULL(I.QTT_FATURADO, 0)) ELSE 0 END) AS QTD_PENDENTE_SUM,
-            SUM(CASE WHEN I.STATUS <> 5 THEN (I.QTT - ISNULL(I.QTT_FATURADO, 0)) * I.PRECUNITLIQ ELSE 0 END) AS VLR_PENDENTE_SUM
-            FROM ERIS_LIVRARIAVILA.DBO.PEDC_ITEM I WHERE I.PEDIDO = P.PEDIDO
-        ) ITENS
-        WHERE PC.TIPO_ACERTO = 1 AND P.DT_PED >= ? AND P.DT_PED <= ?
-    """
-    
-    # Construção Dinâmica dos Filtros SQL
+"""
+
+_SCHEMA_PROPOSTAS = {'DT_PED': 'data', 'VALOR_TOTAL': 'numerico', 'QTD_FATURADA': 'numerico',
+                     'QTD_PENDENTE': 'numerico', 'VALOR_PENDENTE': 'numerico'}
+
+# Ordenações aceitas pela API (nome na URL -> expressão SQL). Nada vindo da URL entra direto no SQL.
+# 'data' usa paginação por chave (DT_PED, PEDIDO); as demais usam OFFSET/FETCH com PEDIDO como desempate.
+ORDENACOES_PROPOSTAS = {
+    'data': 'P.DT_PED',
+    'pedido': 'P.PEDIDO',
+    'valor': 'ISNULL(ITENS.VLR_TOTAL, 0)',
+    'pendente': 'ISNULL(ITENS.VLR_PENDENTE_SUM, 0)',
+    'fornecedor': 'C_FORN.FANTASIA',
+    'filial': 'C_FILIAL.FANTASIA',
+    'status': 'P.STATUS',
+}
+
+def _filtros_propostas(data_ini, data_fim, status_filtro=None, filtro_proposta=None, filtro_fornecedor=None, filtro_filial=None):
+    """Monta os filtros opcionais (SQL + parâmetros) usados por todas as consultas de propostas."""
+    sql = ""
     params = [data_ini, data_fim]
     if status_filtro and status_filtro != 'todos': 
         sql += " AND P.STATUS = ?"
@@ -160,52 +181,137 @@ def listar_propostas_gestao(data_ini, data_fim, status_filtro=None, filtro_propo
     if filtro_filial: 
         sql += " AND C_FILIAL.FANTASIA LIKE ?"
         params.append(f"%{filtro_filial}%")
-        
-    sql += " ORDER BY P.DT_PED DESC, P.PEDIDO DESC"
+    return sql, params
+
+def _enriquecer_propostas(df):
+    """Mistura o workflow local (JSON) nas propostas e formata datas e moedas para a tela."""
+    if df.empty: return []
 
-    df = execute_query(sql, params)
+    # Carrega dados locais (JSON) para misturar com os dados do SQL
+    workflow_db = _carregar_workflow_local()
     
-    # Pós-processamento dos dados (Data Enrichment)
-    if not df.empty:
-        # Carrega dados locais (JSON) para misturar com os dados do SQL
-        workflow_db = _carregar_workflow_local()
+    # Função interna para buscar o último status de workflow de cada linha
+    def get_wf(row):
+        ped = str(row['PEDIDO'])
+        d = workflow_db.get(ped, {})
+        # Tratamento de legado
+        if isinstance(d, str): d = {'status': d}
         
-        # Função interna para buscar o último status de workflow de cada linha
-        def get_wf(row):
-            ped = str(row['PEDIDO'])
-            d = workflow_db.get(ped, {})
-            # Tratamento de legado
-            if isinstance(d, str): d = {'status': d}
-            
-            hist = d.get('historico', [])
-            ult = hist[-1] if hist else {}
-            
-            # Retorna uma série para ser incorporada como colunas no DataFrame principal
-            return pd.Series({
-                'WF_RESPONSAVEL': ult.get('responsavel', d.get('responsavel', '')),
-                'WF_DATA_COBRANCA': ult.get('data', d.get('data_contato', '')),
-                'WF_OBS': ult.get('obs', d.get('observacao', '')),
-                'WF_HISTORY_JSON': json.dumps(hist) if hist else '[]' # JSON stringificado para o front-end
-            })
+        hist = d.get('historico', [])
+        ult = hist[-1] if hist else {}
         
-        # Aplica a função linha a linha
-        df = pd.concat([df, df.apply(get_wf, axis=1)], axis=1)
+        # Retorna uma série para ser incorporada como colunas no DataFrame principal
+        return pd.Series({
+            'WF_RESPONSAVEL': ult.get('responsavel', d.get('responsavel', '')),
+            'WF_DATA_COBRANCA': ult.get('data', d.get('data_contato', '')),
+            'WF_OBS': ult.get('obs', d.get('observacao', '')),
+            'WF_HISTORY_JSON': json.dumps(hist) if hist else '[]' # JSON stringificado para o front-end
+        })
+    
+    # Aplica a função linha a linha
+    df = pd.concat([df, df.apply(get_wf, axis=1)], axis=1)
+    
+    try:
+        # Formatação de Datas e Moedas para exibição bonita (DT_PED já vem como datetime pelo schema)
+        df['DT_PED_FMT'] = df['DT_PED'].dt.strftime('%d/%m/%Y')
         
-        try:
-            # Formatação de Datas e Moedas para exibição bonita
-            df['DT_PED'] = pd.to_datetime(df['DT_PED'])
-            df['DT_PED_FMT'] = df['DT_PED'].dt.strftime('%d/%m/%Y')
-            
-            def fmt(x): return f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-            
-            df['VALOR_TOTAL_FMT'] = df['VALOR_TOTAL'].fillna(0).apply(fmt)
-            df['VALOR_PENDENTE'] = df['VALOR_PENDENTE'].fillna(0).apply(fmt)
-            
-            return df.to_dict('records')
-        except: 
-            return []
-            
-    return []
+        def fmt(x): return f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+        
+        df['VALOR_TOTAL_FMT'] = df['VALOR_TOTAL'].fillna(0).apply(fmt)
+        df['VALOR_PENDENTE'] = df['VALOR_PENDENTE'].fillna(0).apply(fmt)
+        
+        return df.to_dict('records')
+    except: 
+        return []
+
+def _cursor_para_texto(dt_ped, pedido):
+    return f"{pd.Timestamp(dt_ped).isoformat()}|{pedido}"
+
+def _texto_para_cursor(cursor):
+    """
+    '2024-05-01T00:00:00|12345' -> (datetime, 12345).
+    Cursor inválido levanta ValueError: voltar à primeira página faria a rolagem infinita repetir linhas.
+    """
+    try:
+        dt_txt, ped_txt = cursor.split('|', 1)
+        return datetime.fromisoformat(dt_txt), int(ped_txt)
+    except (ValueError, AttributeError):
+        raise ValueError(f"Cursor inválido: {cursor!r}")
+
+def listar_propostas_gestao_pagina(data_ini, data_fim, status_filtro=None, filtro_proposta=None, filtro_fornecedor=None,
+                                   filtro_filial=None, ordem='data', direcao='desc', limite=50, cursor=None, offset=0):
+    """
+    Uma página de propostas, já enriquecida com o workflow.
+
+    - ordem='data': paginação por chave em (DT_PED, PEDIDO). O cursor é a última linha da página anterior,
+      então o banco vai direto ao ponto certo pelo índice, sem contar as linhas já vistas.
+    - outras ordens: OFFSET/FETCH, com PEDIDO como desempate para a ordem ser estável.
+
+    Retorna {'itens', 'tem_mais', 'proximo_cursor', 'proximo_offset'}. Cursor inválido: ValueError.
+    """
+    expr = ORDENACOES_PROPOSTAS.get(ordem, ORDENACOES_PROPOSTAS['data'])
+    desc = str(direcao).lower() != 'asc'
+    sentido = 'DESC' if desc else 'ASC'
+    filtros, params = _filtros_propostas(data_ini, data_fim, status_filtro, filtro_proposta, filtro_fornecedor, filtro_filial)
+
+    keyset = expr == ORDENACOES_PROPOSTAS['data']
+    if keyset:
+        offset = 0
+        chave = _texto_para_cursor(cursor) if cursor else None
+        if chave:
+            op = '<' if desc else '>'
+            filtros += f" AND (P.DT_PED {op} ? OR (P.DT_PED = ? AND P.PEDIDO {op} ?))"
+            params += [chave[0], chave[0], chave[1]]
+        ordenacao = f" ORDER BY P.DT_PED {sentido}, P.PEDIDO {sentido}"
+    else:
+        ordenacao = f" ORDER BY {expr} {sentido}, P.PEDIDO {sentido}"
+
+    # Pede uma linha a mais só para saber se existe próxima página
+    sql = _SQL_PROPOSTAS_COLUNAS + _SQL_PROPOSTAS_FROM + filtros + ordenacao + " OFFSET ? ROWS FETCH NEXT ? ROWS ONLY"
+    df = execute_query(sql, params + [max(0, offset), limite + 1], schema=_SCHEMA_PROPOSTAS)
+
+    tem_mais = len(df) > limite
+    df = df.iloc[:limite]
+    proximo_cursor = None
+    if tem_mais and keyset:
+        ultima = df.iloc[-1]
+        proximo_cursor = _cursor_para_texto(ultima['DT_PED'], ultima['PEDIDO'])
+
+    itens = _enriquecer_propostas(df)
+    for item in itens:
+        # Timestamp não vai bem para JSON: a tela usa DT_PED_FMT, a data crua segue em ISO
+        item['DT_PED'] = item['DT_PED'].isoformat() if pd.notna(item['DT_PED']) else None
+
+    return {
+        'itens': itens,
+        'tem_mais': tem_mais,
+        'proximo_cursor': proximo_cursor,
+        'proximo_offset': None if keyset or not tem_mais else offset + limite,
+    }
+
+def contar_propostas_gestao(data_ini, data_fim, status_filtro=None, filtro_proposta=None, filtro_fornecedor=None, filtro_filial=None):
+    """
+    Totais do filtro inteiro (quantidade de propostas e somatórios do painel), em consulta separada
+    da listagem: a página não precisa esperar a contagem e a contagem não depende da página.
+    """
+    filtros, params = _filtros_propostas(data_ini, data_fim, status_filtro, filtro_proposta, filtro_fornecedor, filtro_filial)
+    sql = """
+        SELECT COUNT(*) AS TOTAL,
+            SUM(ISNULL(ITENS.VLR_PENDENTE_SUM, 0)) AS VALOR_PENDENTE,
+            SUM(ISNULL(ITENS.QTD_PENDENTE_SUM, 0)) AS QTD_PENDENTE,
+            SUM(ISNULL(ITENS.QTD_FATURADA_SUM, 0)) AS QTD_FATURADA
+    """ + _SQL_PROPOSTAS_FROM + filtros
+    schema = {'TOTAL': 'numerico', 'VALOR_PENDENTE': 'numerico', 'QTD_PENDENTE': 'numerico', 'QTD_FATURADA': 'numerico'}
+    df = execute_query(sql, params, schema=schema)
+
+    if df.empty: return {'total': 0, 'valor_pendente': 0.0, 'qtd_pendente': 0, 'qtd_faturada': 0}
+    row = df.fillna(0).iloc[0]
+    return {
+        'total': int(row['TOTAL']),
+        'valor_pendente': round(float(row['VALOR_PENDENTE']), 2),
+        'qtd_pendente': int(row['QTD_PENDENTE']),
+        'qtd_faturada': int(row['QTD_FATURADA']),
+    }
 
 def buscar_detalhes_proposta(pedido):
     """
@@ -226,7 +332,8 @@ def buscar_detalhes_proposta(pedido):
         LEFT JOIN ERIS_LIVRARIAVILA.DBO.PRODUTO P ON I.PRODCODE = P.PRODCODE
         WHERE I.PEDIDO = ? ORDER BY P.DESCRICAO
     """
-    df = execute_query(sql, [pedido])
+    schema = {c: 'numerico' for c in ['QUANTIDADE', 'QTD_FATURADA', 'QTD_PENDENTE', 'VL_UNIT', 'VL_TOTAL']}
+    df = execute_query(sql, [pedido], schema=schema)
     
     if not df.empty:
         try:
@@ -1,7 +1,11 @@
 # --- IMPORTAÇÕES ---
 import os           # Para verificar se arquivos existem e manipular caminhos
-import json         # Para ler e gravar arquivos no formato JSON (texto estruturado)
+import json         # Formato dos caches (texto estruturado, sem indentação)
 import tempfile
+import threading
+import time
+import zlib         # Compressão dos caches (o JSON com indentação chegava a dezenas de MB)
+from datetime import datetime
 
 from config import Config     # Para encontrar a pasta temporária do sistema (ex: /tmp no Linux ou %TEMP% no Windows)
 
@@ -10,9 +14,117 @@ from config import Config     # Para encontrar a pasta temporária do sistema (e
 # Usamos 'tempfile.gettempdir()' para garantir que funcione em qualquer computador,
 # pois ele busca automaticamente a pasta temporária correta do sistema operacional.
 path=Config.PATH_CACHE
-CACHE_ACERTO = os.path.join(path, 'vila_cache_acerto.json')
-CACHE_DEVOLUCAO = os.path.join(path, 'vila_cache_devolucao.json')
-CACHE_GERAL = os.path.join(path, 'vila_cache_geral.json')
+CACHE_ACERTO = os.path.join(path, 'vila_cache_acerto.json.zlib')
+CACHE_DEVOLUCAO = os.path.join(path, 'vila_cache_devolucao.json.zlib')
+CACHE_GERAL = os.path.join(path, 'vila_cache_geral.json.zlib')
+
+# --- FORMATO DO ARQUIVO ---
+# O cache é o JSON compacto (sem indentação) de {'versao', 'timestamp', 'dados'} comprimido com zlib.
+# Não é pickle de propósito: o PATH_CACHE pode ser uma pasta compartilhada, e carregar um pickle
+# executa o que estiver no arquivo. Ler JSON custa mais que o pickle, mas o arquivo só é decodificado
+# quando muda (ver a memória dos caches abaixo).
+# Os caches antigos em JSON com indentação (vila_cache_*.json) ainda são lidos enquanto o novo não
+# existe: na primeira gravação no formato novo o JSON antigo é apagado.
+VERSAO_CACHE = 1
+
+def _arquivo_legado(arquivo):
+    """Caminho do cache antigo em JSON que corresponde ao arquivo do formato novo."""
+    return arquivo[:-len('.zlib')] if arquivo.endswith('.json.zlib') else arquivo
+
+def _carregar(arquivo):
+    """Conteúdo do cache ({'timestamp', 'dados'}), no formato novo ou no JSON antigo. {} se não existe."""
+    if os.path.exists(arquivo):
+        with open(arquivo, 'rb') as f:
+            conteudo = json.loads(zlib.decompress(f.read()))
+        if conteudo.get('versao') != VERSAO_CACHE:
+            print(f"Cache de outra versão ignorado: {arquivo}")
+            return {}
+        return conteudo
+    legado = _arquivo_legado(arquivo)
+    if legado != arquivo and os.path.exists(legado):
+        with open(legado, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+# Mapa de Seleção: um dicionário simples para escolher o arquivo certo baseado no 'tipo' pedido.
+_ARQUIVOS = {
+    'geral': CACHE_GERAL,
+    'acerto': CACHE_ACERTO,
+    'devolucao': CACHE_DEVOLUCAO
+}
+
+# --- MEMÓRIA DOS CACHES LIDOS ---
+# Cada tela abria e decodificava o arquivo do módulo a cada acesso, mesmo sem nada novo desde a última vez.
+# O conteúdo lido fica guardado na memória do processo, um por arquivo, junto com a "versão" do arquivo:
+# inode, tamanho e data de modificação. Como a gravação troca o arquivo inteiro (os.replace), cada cache
+# publicado tem inode novo; enquanto a versão não muda, a leitura custa só um os.stat.
+# Um lock por arquivo: duas requisições que chegam juntas depois de uma atualização leem o arquivo uma vez só.
+_MEMORIA = {}        # arquivo -> {'versao', 'conteudo', 'lock' e as estatísticas}
+_LOCK_MEMORIA = threading.Lock()
+
+def _versao_arquivo(arquivo):
+    """(caminho lido, inode, tamanho, mtime) do arquivo que _carregar vai abrir; None se nenhum existe."""
+    for caminho in (arquivo, _arquivo_legado(arquivo)):
+        try: st = os.stat(caminho)
+        except OSError: continue
+        return (caminho, st.st_ino, st.st_size, st.st_mtime_ns)
+    return None
+
+def _entrada_memoria(arquivo):
+    with _LOCK_MEMORIA:
+        entrada = _MEMORIA.get(arquivo)
+        if entrada is None:
+            entrada = _MEMORIA[arquivo] = {'versao': None, 'conteudo': {}, 'lock': threading.Lock(), 'carregado': False,
+                                           'hits': 0, 'misses': 0, 'segundos_ultima_carga': 0.0, 'segundos_total_carga': 0.0}
+        return entrada
+
+def _carregar_memorizado(arquivo):
+    """Conteúdo do cache como _carregar, relido do disco só quando o arquivo mudou."""
+    entrada = _entrada_memoria(arquivo)
+    with entrada['lock']:
+        versao = _versao_arquivo(arquivo)
+        if entrada['carregado'] and versao == entrada['versao']:
+            entrada['hits'] += 1
+            return entrada['conteudo']
+
+        entrada['misses'] += 1
+        inicio = time.perf_counter()
+        # Se o arquivo for trocado entre o stat e a leitura, a versão guardada é a antiga: a próxima chamada relê
+        conteudo = _carregar(arquivo) if versao else {}
+        segundos = time.perf_counter() - inicio
+        entrada.update(versao=versao, conteudo=conteudo, carregado=True,
+                       segundos_ultima_carga=segundos, segundos_total_carga=entrada['segundos_total_carga'] + segundos)
+        return conteudo
+
+def esquecer_memoria(tipo=None):
+    """Descarta o conteúdo guardado de um módulo (ou de todos): a próxima leitura vai ao disco."""
+    arquivos = [_ARQUIVOS.get(tipo, CACHE_GERAL)] if tipo else list(_ARQUIVOS.values())
+    for arquivo in arquivos:
+        entrada = _entrada_memoria(arquivo)
+        with entrada['lock']:
+            entrada.update(versao=None, conteudo={}, carregado=False)
+
+def estatisticas_memoria():
+    """Hits, misses e tempo de carga de cada cache de módulo, com a versão que está na memória."""
+    estatisticas = {}
+    for tipo, arquivo in _ARQUIVOS.items():
+        entrada = _entrada_memoria(arquivo)
+        with entrada['lock']:
+            total = entrada['hits'] + entrada['misses']
+            versao = entrada['versao']
+            estatisticas[tipo] = {
+                'arquivo': versao[0] if versao else arquivo,
+                'carregado': entrada['carregado'],
+                'notas': len(entrada['conteudo'].get('dados', [])),
+                'timestamp': entrada['conteudo'].get('timestamp'),
+                'tamanho_arquivo': versao[2] if versao else 0,
+                'hits': entrada['hits'],
+                'misses': entrada['misses'],
+                'taxa_acerto': round(entrada['hits'] / total, 4) if total else 0.0,
+                'segundos_ultima_carga': round(entrada['segundos_ultima_carga'], 4),
+                'segundos_total_carga': round(entrada['segundos_total_carga'], 4),
+            }
+    return estatisticas
 
 def ler_cache(tipo='geral'):
     """
@@ -24,42 +136,101 @@ def ler_cache(tipo='geral'):
     
     Returns:
         tuple: Retorna dois valores (dados, timestamp).
-               - dados: A lista de registros.
+               - dados: A lista de registros (cópias rasas: quem chama pode acrescentar campos à vontade,
+                 mas as listas de itens de cada nota são as da memória e não devem ser alteradas).
                - timestamp: A data/hora da última atualização.
     """
     
     # 1. Mapa de Seleção
-    # Um dicionário simples para escolher o arquivo certo baseado no 'tipo' pedido.
-    mapa = {
-        'geral': CACHE_GERAL,
-        'acerto': CACHE_ACERTO,
-        'devolucao': CACHE_DEVOLUCAO
-    }
-    
     # Pega o caminho do arquivo no mapa. Se o tipo não existir, usa o GERAL por segurança.
-    arquivo = mapa.get(tipo, CACHE_GERAL)
+    arquivo = _ARQUIVOS.get(tipo, CACHE_GERAL)
     
-    # 2. Verificação de Existência
-    # Antes de tentar abrir, perguntamos ao sistema operacional: "Esse arquivo existe?"
-    if os.path.exists(arquivo):
-        try:
-            # 3. Leitura do Arquivo
-            # 'with open' é a maneira segura de abrir arquivos em Python.
-            # Ele garante que o arquivo será fechado automaticamente depois de ler,
-            # mesmo que dê erro no meio do caminho.
-            with open(arquivo, 'r', encoding='utf-8') as f:
-                # O json.load converte o texto do arquivo de volta para Dicionários/Listas do Python
-                c = json.load(f)
-                
-                # Retorna os dados encontrados e a hora que foi salvo.
-                # O .get() é usado para evitar erro se a chave não existir (retorna padrão [] ou '-')
-                return c.get('dados', []), c.get('timestamp', '-')
-                
-        except Exception as e:
-            # Se o arquivo estiver corrompido ou ilegível, não travamos o site.
-            # Apenas retornamos vazio e seguimos a vida.
-            print(f"Erro ao ler cache ({tipo}): {e}")
-            return [], None
-            
+    # 2. Leitura do Arquivo
+    # _carregar abre o formato novo (binário comprimido) e, se ele ainda não existe, o JSON antigo.
+    # Quem lê durante uma atualização pega a versão anterior inteira: o arquivo novo só aparece pronto.
+    # Sem mudança no arquivo desde a última leitura, o conteúdo vem da memória.
+    try:
+        c = _carregar_memorizado(arquivo)
+    except Exception as e:
+        # Se o arquivo estiver corrompido ou ilegível, não travamos o site.
+        # Apenas retornamos vazio e seguimos a vida.
+        print(f"Erro ao ler cache ({tipo}): {e}")
+        return [], None
+
     # Se o arquivo não existir (primeira vez rodando), retorna vazio.
-    return [], None
\ No newline at end of file
+    if not c: return [], None
+
+    # Retorna os dados encontrados e a hora que foi salvo.
+    # O .get() é usado para evitar erro se a chave não existir (retorna padrão [] ou '-')
+    return [dict(n) for n in c.get('dados', [])], c.get('timestamp', '-')
+
+def data_cache(tipo='geral'):
+    """Só o timestamp do cache (o mesmo do ler_cache), sem copiar as notas: para as telas que não usam os dados."""
+    try:
+        c = _carregar_memorizado(_ARQUIVOS.get(tipo, CACHE_GERAL))
+    except Exception as e:
+        print(f"Erro ao ler cache ({tipo}): {e}")
+        return None
+    return c.get('timestamp', '-') if c else None
+
+# --- GRAVAÇÃO ---
+# A varredura completa reescreve o cache inteiro; o observador da pasta de XML só mescla as notas
+# que chegaram. O lock evita que as duas gravem o mesmo arquivo ao mesmo tempo.
+_LOCK_CACHE = threading.Lock()
+
+def _gravar(arquivo, conteudo):
+    # Grava num temporário ao lado e troca de uma vez: quem lê nunca pega o arquivo pela metade
+    texto = json.dumps({'versao': VERSAO_CACHE, **conteudo}, ensure_ascii=False, separators=(',', ':'))
+    binario = zlib.compress(texto.encode('utf-8'), Config.CACHE_COMPRESSAO)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(arquivo) or '.', prefix='.vila_cache_', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(binario)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, arquivo)
+    except Exception:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+
+    # O JSON antigo ficou para trás: sem apagar, ele voltaria a ser lido se o arquivo novo sumisse
+    legado = _arquivo_legado(arquivo)
+    if legado != arquivo and os.path.exists(legado):
+        try: os.remove(legado)
+        except OSError as e: print(f"Erro ao apagar cache antigo ({legado}): {e}")
+
+def _agora():
+    return datetime.now().strftime("%d/%m/%Y às %H:%M")
+
+def salvar_cache(arquivo, dados, timestamp=None):
+    """Substitui o conteúdo de um arquivo de cache pela lista de notas."""
+    try:
+        with _LOCK_CACHE:
+            _gravar(arquivo, {"timestamp": timestamp or _agora(), "dados": dados})
+        return True
+    except Exception as e:
+        print(f"ERRO AO SALVAR CACHE: {e}")
+        return False
+
+def chave_nota(nota):
+    # Chave de acesso identifica a nota; sem ela (XML incompleto), o nome do arquivo
+    return nota.get('Chave_Acesso') or nota.get('Arquivo') or ''
+
+def mesclar_cache(arquivo, novas, remover=()):
+    """
+    Atualiza um arquivo de cache sem refazê-lo: tira as notas cujas chaves estão em 'remover'
+    e insere/substitui as 'novas' (mesma Chave_Acesso substitui a anterior).
+    Retorna a quantidade de notas no cache depois da mescla (ou None se deu erro).
+    """
+    try:
+        with _LOCK_CACHE:
+            dados = _carregar(arquivo).get('dados', [])
+
+            sair = set(remover) | {chave_nota(n) for n in novas}
+            dados = [n for n in dados if chave_nota(n) not in sair]
+            dados.extend(novas)
+            _gravar(arquivo, {"timestamp": _agora(), "dados": dados})
+            return len(dados)
+    except Exception as e:
+        print(f"Erro ao mesclar cache ({arquivo}): {e}")
+        return None
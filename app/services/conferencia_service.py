@@ -7,8 +7,10 @@ import time
 import os
 import json
 import tempfile
+import concurrent.futures
 from io import BytesIO, StringIO
-from app.repository.conferencia_repo import buscar_acerto_sql_repo, buscar_vendas_sql_repo
+from app.repository.conferencia_repo import buscar_acerto_sql_repo, buscar_vendas_sql_repo_em_lotes, buscar_vendas_agregadas_sql_repo
+from config import Config
 
 # --- CONFIGURAÇÃO DE PERSISTÊNCIA (DISCO EM VEZ DE RAM) ---
 # Usamos a pasta temporária do sistema para salvar os dados da conferência.
@@ -37,8 +39,9 @@ def _garantir_dataframe_seguro(df, colunas_obrigatorias):
     return df
 
 # --- PROCESSAMENTO SQL ---
-def processar_acerto_sql_service(pedidos_list):
-    df_raw = buscar_acerto_sql_repo(pedidos_list)
+def processar_acerto_sql_service(pedidos_list, propagar_erro=False):
+    # propagar_erro=True: falha do banco vira exceção (a conferência mostra o erro da fonte), não acerto vazio
+    df_raw = buscar_acerto_sql_repo(pedidos_list, propagar_erro=propagar_erro)
     cols_retorno = ['filial', 'ISBN', 'Titulo', 'Quant', 'Vl. Unit._acerto', 'Desconto', 'fornecedor']
     if df_raw.empty: return pd.DataFrame(columns=cols_retorno), "Sem Filial", "Sem Fornecedor"
     
@@ -51,14 +54,15 @@ def processar_acerto_sql_service(pedidos_list):
     df['ISBN_limpo'] = df['ISBN'].apply(_limpar_isbn)
     df = df[df['ISBN_limpo'].notna()].copy()
     
+    # Quant, VlUnit e VlLiqItem já chegam numéricos (schema do buscar_acerto_sql_repo): só os nulos viram zero
     col_qtd = next((c for c in ['QUANT', 'QTT'] if c in df.columns), None)
-    df['Quant'] = pd.to_numeric(df.get(col_qtd, 0), errors='coerce').fillna(0)
+    df['Quant'] = df[col_qtd].fillna(0) if col_qtd else 0.0
     
-    col_vlu = next((c for c in ['VLUNIT', 'VL_UNIT', 'PRECUNITTAB'] if c in df.columns), 'VlUnit')
-    df['VlUnit'] = pd.to_numeric(df.get(col_vlu, 0), errors='coerce').fillna(0)
+    col_vlu = next((c for c in ['VLUNIT', 'VL_UNIT', 'PRECUNITTAB'] if c in df.columns), None)
+    df['VlUnit'] = df[col_vlu].fillna(0) if col_vlu else 0.0
     
-    col_liq = next((c for c in ['VLLIQITEM', 'VLLIQU', 'PRECUNITLIQ'] if c in df.columns), 'VlLiqItem')
-    df['VlLiqItem'] = pd.to_numeric(df.get(col_liq, df['VlUnit']), errors='coerce').fillna(0)
+    col_liq = next((c for c in ['VLLIQITEM', 'VLLIQU', 'PRECUNITLIQ'] if c in df.columns), None)
+    df['VlLiqItem'] = df[col_liq].fillna(0) if col_liq else df['VlUnit']
 
     df['DescontoCalculado'] = df.apply(lambda row: (1 - (row['VlLiqItem'] / row['VlUnit'])) if row['VlUnit'] > 0 else 0, axis=1)
     
@@ -74,13 +78,10 @@ def processar_acerto_sql_service(pedidos_list):
     df_acerto = df_acerto.rename(columns={'ISBN_limpo': 'ISBN', 'VlUnit': 'Vl. Unit._acerto', 'DescontoCalculado': 'Desconto'})
     return _garantir_dataframe_seguro(df_acerto, cols_retorno), "Múltiplas", fornecedor_global
 
-def processar_vendas_sql_service(data_ini, data_fim, fornecedor_id):
-    cols_padrao = ['filial', 'ISBN', 'Quant_venda', 'Vl. Unit._venda', 'Preco_Venda_F']
-    df_raw = buscar_vendas_sql_repo(data_ini, data_fim, fornecedor_id)
-    if df_raw.empty: return pd.DataFrame(columns=cols_padrao)
-    
+def _agregar_lote_vendas(df_raw):
+    """Normaliza filial/ISBN de um lote de vendas e soma quantidade e valor por (filial, ISBN)."""
     df_raw.columns = [str(c).upper().strip() for c in df_raw.columns]
-    df = df_raw.copy()
+    df = df_raw
     for col, default in [('FILIAL', 'desconhecida'), ('ISBN', '')]:
         if col not in df.columns: df[col] = default
         
@@ -94,13 +95,99 @@ def processar_vendas_sql_service(data_ini, data_fim, fornecedor_id):
     df['Quantidade'] = pd.to_numeric(df.get(col_qtd, 0), errors='coerce').fillna(0)
     df['Valor_Total'] = pd.to_numeric(df.get(col_total, 0), errors='coerce').fillna(0)
     
-    df_venda = df.groupby(['filial', 'ISBN'], as_index=False).agg(
+    return df.groupby(['filial', 'ISBN'], as_index=False).agg(
         Quant_venda=('Quantidade', 'sum'), 
         Vl_Unit__venda=('Valor_Total', 'sum')
     )
+
+def _somar_parciais_vendas(parciais):
+    """Junta agregados parciais de vendas (a soma é associativa, então o resultado é o mesmo de agregar tudo de uma vez)."""
+    if len(parciais) == 1: return parciais[0]
+    return pd.concat(parciais, ignore_index=True).groupby(['filial', 'ISBN'], as_index=False).agg(
+        Quant_venda=('Quant_venda', 'sum'), 
+        Vl_Unit__venda=('Vl_Unit__venda', 'sum')
+    )
+
+def processar_vendas_sql_service(data_ini, data_fim, fornecedor_id, tamanho_lote=None, propagar_erro=False):
+    """
+    Vendas do período agregadas por (filial, ISBN).
+    Quando o agrupamento no servidor não está disponível, as linhas chegam do banco em lotes; cada lote é agregado e descartado, então o pico de
+    memória depende do tamanho do lote e da quantidade de títulos distintos, não do período.
+    propagar_erro=True repassa a falha do banco em vez de devolver um resultado vazio.
+    """
+    cols_padrao = ['filial', 'ISBN', 'Quant_venda', 'Vl. Unit._venda', 'Preco_Venda_F']
+    parciais = []
+
+    # 1. Caminho preferido: o SQL Server já devolve as vendas somadas por filial/ISBN.
+    #    A normalização em Python roda só sobre os títulos distintos e as somas são refeitas,
+    #    então o resultado é o mesmo da leitura item a item.
+    if Config.VENDAS_AGREGADAS_SQL:
+        try:
+            df_agregado = buscar_vendas_agregadas_sql_repo(data_ini, data_fim, fornecedor_id)
+            if df_agregado.empty: return pd.DataFrame(columns=cols_padrao)
+            df_venda = _agregar_lote_vendas(df_agregado).rename(columns={'Vl_Unit__venda': 'Vl. Unit._venda'})
+            return _garantir_dataframe_seguro(df_venda, cols_padrao)
+        except Exception as e:
+            print(f"Vendas agregadas no SQL falharam ({e}). Usando leitura item a item.")
+
+    # 2. Reserva: linhas item a item, lidas e agregadas em lotes
+    try:
+        for lote in buscar_vendas_sql_repo_em_lotes(data_ini, data_fim, fornecedor_id, tamanho_lote):
+            if lote.empty: continue
+            parciais.append(_agregar_lote_vendas(lote))
+            # Consolida de tempos em tempos para a lista de parciais não crescer sem limite
+            if len(parciais) >= 8: parciais = [_somar_parciais_vendas(parciais)]
+    except Exception as e:
+        print(f"Erro ao buscar vendas: {e}")
+        if propagar_erro: raise
+        return pd.DataFrame(columns=cols_padrao)
+
+    if not parciais: return pd.DataFrame(columns=cols_padrao)
+    
+    df_venda = _somar_parciais_vendas(parciais)
     df_venda = df_venda.rename(columns={'Vl_Unit__venda': 'Vl. Unit._venda'})
     return _garantir_dataframe_seguro(df_venda, cols_padrao)
 
+# --- CARGA CONCORRENTE DAS FONTES ---
+# Acerto, vendas do período, vendas da ação e quebras são independentes entre si.
+# Rodam todas ao mesmo tempo, então a conferência demora o tempo da fonte mais lenta, e não a soma de todas.
+# Cada conferência tem o seu executor: uma fonte que estoura o tempo segue ocupando só a thread dela
+# até a consulta terminar, sem atrasar as conferências seguintes.
+
+def carregar_fontes_concorrente(tarefas, timeout=None):
+    """
+    Executa as tarefas em paralelo.
+
+    Args:
+        tarefas (dict): nome da fonte -> função sem argumentos (ex: functools.partial).
+        timeout (float): orçamento total em segundos para todas as fontes.
+
+    Returns:
+        tuple: (resultados, erros), ambos dicts indexados pelo nome da fonte.
+               Fontes que falharam ou estouraram o tempo aparecem só em 'erros', com a mensagem.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max(1, min(Config.CONFERENCIA_MAX_WORKERS, len(tarefas))), thread_name_prefix='conferencia_fontes'
+    )
+    try:
+        futures = {nome: executor.submit(func) for nome, func in tarefas.items()}
+        concurrent.futures.wait(futures.values(), timeout=timeout)
+    finally:
+        # Não espera a fonte atrasada: a thread dela termina sozinha quando a consulta voltar
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    resultados, erros = {}, {}
+    for nome, fut in futures.items():
+        if not fut.done() or fut.cancelled():
+            # Não dá para interromper uma consulta em andamento; o resultado só é ignorado
+            # (cancelada: ainda estava na fila quando o tempo acabou)
+            erros[nome] = f"tempo limite de {timeout:.0f}s excedido"
+        elif fut.exception() is not None:
+            erros[nome] = str(fut.exception()) or fut.exception().__class__.__name__
+        else:
+            resultados[nome] = fut.result()
+    return resultados, erros
+
 # --- PROCESSAMENTO EXCEL ---
 def carregar_acerto_excel(stream):
     try:
@@ -0,0 +1,64 @@
+# --- DIVERGÊNCIA ITEM A ITEM (XML x PEDIDO DO ERP) ---
+# As telas de acerto e devolução refaziam a conta em JavaScript a cada nota aberta (find por ISBN, O(itens²)).
+# Aqui a tabela item a item de uma nota é montada no servidor, com dois dicionários (ISBN -> item de cada lado),
+# como o gerar_resumo_divergencia do processamento. Quem usa: a nota aberta na tela (notas_service.buscar_nota)
+# e o confronto com outro pedido escolhido na tela (/api/divergencias). A tabela não vai para o cache.
+#
+# Regras (as mesmas do gerar_resumo_divergencia):
+#   - o ISBN é comparado como texto, sem espaços nas pontas (str(ISBN).strip());
+#   - ISBN repetido do mesmo lado: vale o último item;
+#   - unitário do XML = líquido / quantidade (0 sem quantidade); o do ERP é o VlLiqUnit;
+#   - quantidade diferente, ou unitário diferente por mais de 1 centavo, é divergência.
+
+import math
+
+TOLERANCIA_PRECO = 0.01
+
+# Campos de cada linha da tabela item a item, no formato que as telas desenham
+CAMPOS_DIVERGENCIA = ['ISBN', 'Titulo', 'Status', 'Qtd_XML', 'Unit_XML', 'Qtd_ERP', 'Unit_ERP',
+                      'Dif_Qtd', 'Dif_Unit', 'Div_Qtd', 'Div_Preco']
+
+def _numero(valor):
+    # Valor ilegível vira NaN (não quebra a tabela; conta como quantidade diferente)
+    try: return float(valor)
+    except (TypeError, ValueError): return math.nan
+
+def _json(valor):
+    # NaN não é JSON válido para o navegador
+    return None if valor is None or math.isnan(valor) else valor
+
+def _linha(isbn, x, e):
+    qtd_x = _numero(x.get('Quantidade', 0)) if x else None
+    unit_x = (_numero(x.get('Valor_Liquido', 0)) / qtd_x if qtd_x > 0 else 0.0) if x else None
+    qtd_e = _numero(e.get('Quant', 0)) if e else None
+    unit_e = _numero(e.get('VlLiqUnit', 0)) if e else None
+    # NaN != NaN: quantidade ilegível dos dois lados conta como diferente, como no resumo
+    div_qtd = bool(x and e and qtd_x != qtd_e)
+    div_preco = bool(x and e and abs(unit_x - unit_e) > TOLERANCIA_PRECO)
+    if x and e: status = 'DIV' if div_qtd or div_preco else 'OK'
+    else: status = 'XML' if x else 'ERP'
+    # Lado que falta conta como zero na diferença (a tela de devolução mostra a sobra nessas colunas)
+    return {
+        'ISBN': isbn, 'Titulo': (x or e).get('Titulo'), 'Status': status,
+        'Qtd_XML': _json(qtd_x), 'Unit_XML': _json(unit_x), 'Qtd_ERP': _json(qtd_e), 'Unit_ERP': _json(unit_e),
+        'Dif_Qtd': _json((qtd_x if x else 0.0) - (qtd_e if e else 0.0)),
+        'Dif_Unit': _json((unit_x if x else 0.0) - (unit_e if e else 0.0)),
+        'Div_Qtd': div_qtd, 'Div_Preco': div_preco,
+    }
+
+def divergencias_da_nota(itens_xml, itens_erp):
+    """
+    Confronto de uma nota com um pedido (listas de dicts, como no cache e no /api/buscar_pedido).
+    Retorna (linhas, resumo): a tabela item a item em ordem de ISBN e o texto do Divergencia_Resumo.
+    """
+    map_xml = {str(i.get('ISBN', '')).strip(): i for i in itens_xml}
+    map_erp = {str(i.get('ISBN', '')).strip(): i for i in itens_erp}
+    linhas = [_linha(isbn, map_xml.get(isbn), map_erp.get(isbn)) for isbn in sorted(map_xml.keys() | map_erp.keys())]
+
+    msgs = []
+    c_qtd = sum(1 for l in linhas if l['Div_Qtd'])
+    c_preco = sum(1 for l in linhas if l['Div_Preco'])
+    if c_qtd > 0: msgs.append(f"Qtde Diferente ({c_qtd}x)")
+    if c_preco > 0: msgs.append(f"Preço Diferente ({c_preco}x)")
+    if msgs: return linhas, " | ".join(msgs)
+    return linhas, ("" if itens_xml else "XML Vazio")
@@ -0,0 +1,115 @@
+# --- MANIFESTO PERSISTENTE DA VARREDURA DE XML ---
+# A pasta de XML acumula anos de notas, mas de um dia para o outro só entram as notas novas.
+# O manifesto guarda, para cada arquivo já lido, o tamanho, a data de modificação (e, se ligado,
+# o hash do conteúdo) junto com o resultado do parse. Na varredura seguinte só são lidos os
+# arquivos novos ou alterados; os que sumiram da pasta saem do manifesto.
+#
+# O resultado guardado é o parse SEM filtro de CFOP: o mesmo manifesto atende acerto, devolução
+# e leitor geral, cada um aplicando seus CFOPs na hora de montar a lista.
+#
+# O arquivo é JSON comprimido com zlib, não pickle: fica no PATH_CACHE, que pode ser uma pasta
+# compartilhada, e carregar um pickle executa o que estiver no arquivo. Na leitura as listas voltam
+# a ser tuplas (nota compacta) e frozenset (CFOPs), e os textos repetidos voltam a ser uma cópia só.
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import zlib
+
+from config import Config
+from app.services.xml_compactados import abrir_xml
+
+# Mude quando o formato do resultado do parse mudar: manifestos de outra versão são descartados
+VERSAO_MANIFESTO = 3
+
+_LOCK = threading.Lock()
+_MANIFESTOS = {}  # arquivo do manifesto -> {caminho_xml: entrada}
+
+def _arquivo_manifesto(caminho_pasta):
+    # Um manifesto por pasta varrida (o nome leva um hash do caminho)
+    sufixo = hashlib.md5(os.path.normcase(os.path.abspath(caminho_pasta)).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(Config.PATH_CACHE or tempfile.gettempdir(), f'vila_manifesto_xml_{sufixo}.json.zlib')
+
+def hash_arquivo(caminho):
+    """Hash do conteúdo do arquivo (blake2b), lido em blocos. Membro de .zip / .xml.gz: hash do XML descompactado."""
+    h = hashlib.blake2b(digest_size=16)
+    with abrir_xml(caminho) as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def _unico(valor):
+    return sys.intern(valor) if type(valor) is str else valor
+
+def _para_json(entrada):
+    return dict(entrada, cfops=sorted(entrada['cfops']))
+
+def _de_json(entrada):
+    entrada['cfops'] = frozenset(entrada['cfops'])
+    if entrada['dados'] is not None:
+        cabecalho, itens = entrada['dados']
+        entrada['dados'] = (tuple(map(_unico, cabecalho)), tuple(tuple(map(_unico, i)) for i in itens))
+    return entrada
+
+def carregar_manifesto(caminho_pasta):
+    """
+    Devolve o manifesto da pasta ({caminho_xml: entrada}), lendo do disco só na primeira vez.
+    Entrada: {'tamanho', 'mtime', 'hash', 'cfops': frozenset, 'dados': nota compacta (xml_service) ou None}.
+    O dicionário devolvido é compartilhado: altere-o só dentro de travar_manifesto().
+    """
+    arquivo = _arquivo_manifesto(caminho_pasta)
+    with _LOCK:
+        if arquivo in _MANIFESTOS: return _MANIFESTOS[arquivo]
+        entradas = {}
+        if os.path.exists(arquivo):
+            try:
+                with open(arquivo, 'rb') as f:
+                    conteudo = json.loads(zlib.decompress(f.read()))
+                if conteudo.get('versao') == VERSAO_MANIFESTO:
+                    entradas = {xml: _de_json(e) for xml, e in conteudo.get('entradas', {}).items()}
+                else:
+                    print("Manifesto XML de outra versão: será refeito.")
+            except Exception as e:
+                # Manifesto corrompido só custa uma varredura completa
+                print(f"Erro ao ler manifesto XML ({arquivo}): {e}")
+        _MANIFESTOS[arquivo] = entradas
+        return entradas
+
+def travar_manifesto():
+    """Lock para ler/alterar o manifesto quando mais de uma varredura roda ao mesmo tempo."""
+    return _LOCK
+
+def salvar_manifesto(caminho_pasta):
+    """Grava o manifesto em disco (arquivo temporário + os.replace: nunca fica pela metade)."""
+    arquivo = _arquivo_manifesto(caminho_pasta)
+    try:
+        with _LOCK:
+            entradas = _MANIFESTOS.get(arquivo)
+            if entradas is None: return
+            texto = json.dumps({'versao': VERSAO_MANIFESTO, 'entradas': {xml: _para_json(e) for xml, e in entradas.items()}},
+                               ensure_ascii=False, separators=(',', ':'))
+        dados = zlib.compress(texto.encode('utf-8'), Config.CACHE_COMPRESSAO)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(arquivo), prefix='.vila_manifesto_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dados)
+            os.replace(tmp, arquivo)
+        except Exception:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
+    except Exception as e:
+        print(f"Erro ao salvar manifesto XML: {e}")
+
+def descartar_manifesto(caminho_pasta=None):
+    """Esquece o manifesto (de uma pasta ou de todas), na memória e no disco: a próxima varredura lê tudo."""
+    with _LOCK:
+        arquivos = [_arquivo_manifesto(caminho_pasta)] if caminho_pasta else list(_MANIFESTOS.keys())
+        for arquivo in arquivos:
+            _MANIFESTOS.pop(arquivo, None)
+            try:
+                if os.path.exists(arquivo): os.remove(arquivo)
+            except OSError as e:
+                print(f"Erro ao apagar manifesto XML: {e}")
@@ -0,0 +1,153 @@
+# --- CONSULTA PAGINADA DOS CACHES DOS MÓDULOS ---
+# As telas de acerto, devolução e leitor geral recebiam o cache inteiro embutido no HTML ({{ dados | tojson }}),
+# com os itens do XML e do ERP de todas as notas: páginas de vários MB que o
+# navegador ainda tinha que filtrar sozinho. Aqui o filtro, a ordenação, a paginação e a escolha dos campos
+# são feitos no servidor, e as telas buscam só o que vão mostrar:
+#   - consultar_notas: uma página da lista (só os campos pedidos, sem as listas de itens por padrão);
+#   - buscar_nota: a nota inteira, quando o usuário escolhe uma (com a tabela item a item das divergências);
+#   - opcoes_filtros: os valores distintos para as sugestões (datalist) dos filtros.
+# O Status_Workflow entra nas notas devolvidas pelo ler_cache (cópias: o conteúdo em memória não muda).
+
+from datetime import datetime
+
+from app.services.cache_service import ler_cache, chave_nota
+from app.repository.gestao_repo import _carregar_workflow_local
+from app.services.divergencia_itens import divergencias_da_nota
+
+MODULOS = ('acerto', 'devolucao', 'geral')
+
+# Listas de cada nota: só vêm na página se pedidas em 'campos' (e sempre em buscar_nota)
+CAMPOS_PESADOS = ('Itens', 'Itens_ERP')
+
+def _data(texto):
+    """'dd/mm/aaaa' -> 'aaaammdd' (ordena como texto); '' se não é data."""
+    try: return datetime.strptime(str(texto or '').strip(), '%d/%m/%Y').strftime('%Y%m%d')
+    except ValueError: return ''
+
+def _valor(texto):
+    """'R$ 15.732,50' -> 15732.5 (formato do formatar_moeda); 0 se ilegível."""
+    try: return float(str(texto or '').replace('R$', '').strip().replace('.', '').replace(',', '.'))
+    except ValueError: return 0.0
+
+def _numero(texto):
+    # Nota '00123' ordena como 123; o que não é número vai para o fim, em ordem de texto
+    texto = str(texto or '').strip()
+    return (0, int(texto), '') if texto.isdigit() else (1, 0, texto)
+
+def _fornecedor(nota):
+    fantasia = nota.get('Nome_Fantasia')
+    return fantasia if fantasia and fantasia != '-' else (nota.get('Nome_Emitente') or '')
+
+ORDENACOES_NOTAS = {
+    'emissao': lambda n: _data(n.get('Data_Emissao')),
+    'vencimento': lambda n: _data(n.get('Data_Vencimento')),
+    'nota': lambda n: _numero(n.get('Numero_NF')),
+    'valor': lambda n: _valor(n.get('Valor_Total')),
+    'fornecedor': lambda n: _fornecedor(n).lower(),
+    'filial': lambda n: str(n.get('Filial') or '').lower(),
+    'dia_acerto': lambda n: _numero(n.get('Dia_Acerto')),
+    'status': lambda n: n.get('Status_Workflow', ''),
+}
+
+def _status_workflow():
+    """Chave de acesso -> status salvo na tela (o legado guardava só o texto do status)."""
+    db_st = _carregar_workflow_local()
+    return {chave: (entry if isinstance(entry, str) else entry.get('status', 'PENDENTE')) for chave, entry in db_st.items()}
+
+def _contem(valor, termo):
+    return termo in str(valor or '').lower()
+
+def _filtrar(notas, filtros):
+    """Aplica os filtros (todos opcionais; texto vazio não filtra). Ver consultar_notas."""
+    filial = (filtros.get('filial') or '').strip().lower()
+    fornecedor = (filtros.get('fornecedor') or '').strip().lower()
+    nota = (filtros.get('nota') or '').strip().lower()
+    dia = (filtros.get('dia_acerto') or '').strip()
+    busca = (filtros.get('q') or '').strip().lower()
+    cfops = {c.strip() for c in (filtros.get('cfop') or '').split(',') if c.strip()}
+    status = (filtros.get('status') or '').strip().upper()
+    divergencia = (filtros.get('divergencia') or '').strip().lower()
+    # Datas do formulário vêm como 'aaaa-mm-dd'; comparadas como 'aaaammdd'
+    data_ini = (filtros.get('data_ini') or '').replace('-', '')
+    data_fim = (filtros.get('data_fim') or '').replace('-', '')
+
+    for n in notas:
+        if filial and not _contem(n.get('Filial'), filial): continue
+        if fornecedor and not (_contem(n.get('Nome_Fantasia'), fornecedor) or _contem(n.get('Nome_Emitente'), fornecedor)
+                               or _contem(n.get('CNPJ_Emitente'), fornecedor)): continue
+        if nota and not _contem(n.get('Numero_NF'), nota): continue
+        if dia and dia not in str(n.get('Dia_Acerto') or ''): continue
+        if busca and not any(_contem(n.get(c), busca) for c in ('Numero_NF', 'Nome_Fantasia', 'Nome_Emitente', 'Filial', 'Chave_Acesso')): continue
+        if cfops and not cfops & {c.strip() for c in str(n.get('CFOPs') or '').split(',')}: continue
+        if status and n.get('Status_Workflow') != status: continue
+        if divergencia in ('sim', 'nao'):
+            # Nota sem resumo (leitor geral, que não cruza com o ERP) conta como sem divergência
+            if bool(n.get('Divergencia_Resumo')) != (divergencia == 'sim'): continue
+        if data_ini or data_fim:
+            emissao = _data(n.get('Data_Emissao'))
+            if not emissao: continue
+            if data_ini and emissao < data_ini: continue
+            if data_fim and emissao > data_fim: continue
+        yield n
+
+def _com_status(notas, status_wf):
+    # As notas do ler_cache já são cópias rasas: o Status_Workflow não vai parar na memória do cache
+    for n in notas:
+        n['Status_Workflow'] = status_wf.get(n.get('Chave_Acesso'), 'PENDENTE')
+        yield n
+
+def consultar_notas(modulo, filtros=None, ordem='emissao', direcao='desc', limite=50, offset=0, campos=None):
+    """
+    Uma página das notas do cache do módulo.
+    filtros (todos opcionais): filial, fornecedor (fantasia, razão social ou CNPJ), nota, dia_acerto, cfop (lista
+    separada por vírgula: basta um deles), data_ini/data_fim ('aaaa-mm-dd', sobre a emissão), status (workflow),
+    divergencia ('sim'/'nao') e q (busca livre em nota, fornecedor, filial e chave).
+    campos: lista dos campos de cada nota (None = todos menos CAMPOS_PESADOS); Chave_Acesso sempre vem.
+    Retorna {'itens', 'total', 'tem_mais', 'proximo_offset', 'ultima_atualizacao'}.
+    """
+    dados, ts = ler_cache(modulo)
+    filtradas = list(_filtrar(_com_status(dados, _status_workflow()), filtros or {}))
+
+    # sorted é estável: notas empatadas ficam na ordem do cache
+    chave = ORDENACOES_NOTAS.get(ordem, ORDENACOES_NOTAS['emissao'])
+    filtradas.sort(key=chave, reverse=(direcao == 'desc'))
+
+    pagina = filtradas[offset:offset + limite]
+    if campos:
+        campos = list(dict.fromkeys(['Chave_Acesso', *campos]))
+        pagina = [{c: n.get(c) for c in campos if c in n} for n in pagina]
+    else:
+        pagina = [{c: v for c, v in n.items() if c not in CAMPOS_PESADOS} for n in pagina]
+
+    tem_mais = offset + limite < len(filtradas)
+    return {
+        'itens': pagina,
+        'total': len(filtradas),
+        'tem_mais': tem_mais,
+        'proximo_offset': offset + limite if tem_mais else None,
+        'ultima_atualizacao': ts,
+    }
+
+def buscar_nota(modulo, chave):
+    """A nota inteira (com itens e divergências) pela chave de acesso, ou None se não está no cache."""
+    dados, _ = ler_cache(modulo)
+    for n in dados:
+        if chave_nota(n) == chave:
+            # Tabela item a item contra o pedido da própria nota: só para a nota aberta, não fica no cache
+            if n.get('Itens_ERP'): n['Divergencias'], _ = divergencias_da_nota(n.get('Itens') or [], n['Itens_ERP'])
+            return next(_com_status([n], _status_workflow()))
+    return None
+
+def opcoes_filtros(modulo):
+    """Valores distintos para as sugestões dos filtros: nota, fornecedor, dia de acerto, filial e CFOP."""
+    dados, _ = ler_cache(modulo)
+    opcoes = {'nota': set(), 'fornecedor': set(), 'dia_acerto': set(), 'filial': set(), 'cfop': set()}
+    for n in dados:
+        opcoes['nota'].add(str(n.get('Numero_NF') or '').strip())
+        opcoes['fornecedor'].add(_fornecedor(n).strip())
+        opcoes['dia_acerto'].add(str(n.get('Dia_Acerto') or '').strip())
+        opcoes['filial'].add(str(n.get('Filial') or '').strip())
+        opcoes['cfop'].update(c.strip() for c in str(n.get('CFOPs') or '').split(','))
+    opcoes = {campo: sorted(v for v in valores if v and v != '-') for campo, valores in opcoes.items()}
+    opcoes['nota'].sort(key=_numero)
+    return opcoes
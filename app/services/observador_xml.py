@@ -0,0 +1,345 @@
+# --- OBSERVADOR DA PASTA DE XML ---
+# Sem ele, uma nota que chega na pasta só aparece nas telas depois de uma varredura completa
+# (botão "Processar"). O observador fica em segundo plano olhando CAMINHO_XML_PADRAO e, quando um
+# XML novo é gravado, movido para dentro, alterado ou apagado, lê só esse arquivo, cruza com o ERP
+# e mescla o resultado nos caches de acerto, devolução e leitor geral.
+#
+# Dois modos:
+#   - inotify (Linux, disco local): o kernel avisa cada arquivo fechado/movido/apagado. Chamado via
+#     ctypes, sem dependência nova. De tempos em tempos (OBSERVADOR_XML_RECONCILIAR) a pasta inteira
+#     é conferida contra o manifesto, para pegar o que escapou (fila do kernel estourada, etc.).
+#   - polling (pasta de rede, Windows): a cada OBSERVADOR_XML_INTERVALO a pasta é listada e comparada
+#     com o manifesto. Arquivo novo só é lido quando tamanho e data ficam iguais em duas listagens
+#     seguidas (ainda está sendo copiado).
+# No modo 'auto' a pasta de rede (CIFS/SMB, NFS...) vai para o polling mesmo no Linux: o inotify só vê o
+# que é gravado pela própria máquina, e as notas chegam gravadas por outras.
+# As PASTAS_IGNORADAS valem igual à varredura completa. O estado "o que já foi lido" é o mesmo
+# manifesto da varredura (app/services/manifesto_xml.py): a varredura completa e o observador nunca
+# leem o mesmo arquivo duas vezes.
+# Um .zip novo, regravado ou apagado dispara a conferência da pasta, que relista os XML de dentro dele.
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+from datetime import datetime
+
+from config import Config
+from app.services.cache_service import mesclar_cache, chave_nota
+from app.services.manifesto_xml import carregar_manifesto, travar_manifesto
+from app.services.xml_compactados import e_zip, e_xml_gz
+from app.services.processamento_service import config_modulo, enriquecer_notas
+from app.services.tarefas_service import ha_tarefa_rodando
+from app.services.xml_service import (
+    listar_xmls, passa_filtro_cfop, POS_CHAVE, PASTAS_IGNORADAS,
+    atualizar_arquivos, notas_do_manifesto, montar_tabelas, chave_compacta
+)
+
+MODULOS = ('acerto', 'devolucao', 'geral')
+
+ESTADO_OBSERVADOR = {
+    'ativo': False, 'modo': None, 'pasta': None, 'pastas_observadas': 0,
+    'pendentes': 0, 'lotes': 0, 'arquivos_lidos': 0, 'notas_incluidas': 0, 'notas_removidas': 0,
+    'ultimo_lote': None, 'ultima_conferencia': None, 'erro': None
+}
+
+_THREAD = None
+
+# Sistemas de arquivos de rede (tipo em /proc/mounts): o inotify não recebe as gravações feitas por outras máquinas
+_SISTEMAS_DE_REDE = ('cifs', 'smb3', 'smbfs', 'nfs', 'nfs4', 'fuse.sshfs', 'afs', 'ceph', 'glusterfs', '9p')
+
+def _sistema_de_arquivos(pasta):
+    """Tipo do sistema de arquivos onde está a pasta (ponto de montagem mais longo em /proc/mounts); None se não dá para saber."""
+    try:
+        with open('/proc/mounts', encoding='utf-8', errors='replace') as f:
+            linhas = f.read().splitlines()
+    except OSError:
+        return None
+    caminho = os.path.realpath(pasta)
+    melhor, tipo = -1, None
+    for linha in linhas:
+        campos = linha.split()
+        if len(campos) < 3: continue
+        # Espaços no ponto de montagem vêm como \040
+        ponto = campos[1].replace('\\040', ' ')
+        if (caminho == ponto or caminho.startswith(ponto.rstrip('/') + '/')) and len(ponto) > melhor:
+            melhor, tipo = len(ponto), campos[2]
+    return tipo
+
+def _pasta_de_rede(pasta):
+    return (_sistema_de_arquivos(pasta) or '') in _SISTEMAS_DE_REDE
+
+# --- INOTIFY VIA CTYPES ---
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x00000040, 0x00000080, 0x00000100, 0x00000200
+IN_DELETE_SELF, IN_MOVE_SELF = 0x00000400, 0x00000800
+IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR, IN_ISDIR = 0x00004000, 0x00008000, 0x01000000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+
+_MASCARA = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+            | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENTO = struct.Struct('iIII')  # wd, mask, cookie, len (seguido do nome com len bytes)
+
+class _Inotify:
+    """Observação recursiva de uma árvore de pastas com inotify (um watch por pasta)."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.pastas = {}  # wd -> caminho da pasta
+
+    def observar(self, pasta):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(pasta), _MASCARA)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), pasta)
+        self.pastas[wd] = pasta
+
+    def observar_arvore(self, raiz, pastas_ignoradas):
+        """Põe watch na pasta e em todas as subpastas não ignoradas."""
+        pilha = [raiz]
+        while pilha:
+            pasta = pilha.pop()
+            try:
+                self.observar(pasta)
+                with os.scandir(pasta) as it:
+                    for e in it:
+                        if e.is_dir(follow_symlinks=False) and e.name.lower().strip() not in pastas_ignoradas:
+                            pilha.append(e.path)
+            except OSError as e:
+                # Limite de watches do sistema (fs.inotify.max_user_watches) ou pasta que sumiu
+                print(f"Observador XML: não foi possível observar {pasta}: {e}")
+
+    def esquecer_arvore(self, raiz):
+        prefixo = raiz + os.sep
+        for wd, pasta in list(self.pastas.items()):
+            if pasta == raiz or pasta.startswith(prefixo):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.pastas[wd]
+
+    def ler(self, timeout):
+        """Eventos disponíveis: [(wd, mask, nome)]. Espera até 'timeout' segundos pelo primeiro."""
+        prontos, _, _ = select.select([self.fd], [], [], timeout)
+        if not prontos: return []
+        try: dados = os.read(self.fd, 256 * 1024)
+        except BlockingIOError: return []
+        eventos = []
+        pos = 0
+        while pos + _EVENTO.size <= len(dados):
+            wd, mask, _, tamanho = _EVENTO.unpack_from(dados, pos)
+            pos += _EVENTO.size
+            nome = os.fsdecode(dados[pos:pos + tamanho].rstrip(b'\0'))
+            pos += tamanho
+            eventos.append((wd, mask, nome))
+        return eventos
+
+    def fechar(self):
+        os.close(self.fd)
+
+# --- APLICAÇÃO DAS MUDANÇAS NOS CACHES ---
+
+def _aplicar_mudancas(app, pasta, alterados, removidos):
+    """Lê os arquivos alterados, tira os removidos e mescla o resultado no cache de cada módulo."""
+    with app.app_context():
+        mudancas = atualizar_arquivos(pasta, alterados, removidos)
+        if not mudancas: return
+
+        ESTADO_OBSERVADOR['arquivos_lidos'] += sum(1 for _, _, nova in mudancas if nova is not None)
+        app_config = {'CFOPS_PADRAO': Config.CFOPS_PADRAO}
+
+        for modulo in MODULOS:
+            cfops, tipo_pedido, arquivo_cache = config_modulo(modulo, app_config)
+            # Módulo que nunca foi processado: quem monta o cache é a varredura completa
+            if not os.path.exists(arquivo_cache): continue
+
+            remover, tocadas, novas = set(), set(), []
+            for _, anterior, nova in mudancas:
+                if anterior and anterior['dados'] is not None and passa_filtro_cfop(anterior['cfops'], cfops):
+                    remover.add(chave_compacta(anterior['dados']))
+                if nova and nova['dados'] is not None and passa_filtro_cfop(nova['cfops'], cfops):
+                    if nova['dados'][0][POS_CHAVE]: tocadas.add(nova['dados'][0][POS_CHAVE])
+                    else: novas.append(nova['dados'])
+
+            # A mesma nota pode estar em mais de um arquivo (cópia em outra subpasta): a versão que
+            # fica no cache vem do manifesto, a de menor caminho, como na varredura completa.
+            # Apagar uma das cópias não tira a nota do cache.
+            if remover or tocadas: novas.extend(notas_do_manifesto(pasta, remover | tocadas, cfops))
+            if not remover and not novas: continue
+
+            lista = enriquecer_notas(*montar_tabelas(novas), tipo_pedido) if novas else []
+            total = mesclar_cache(arquivo_cache, lista, remover)
+            if total is None: continue
+            removidas = len(remover - {chave_nota(n) for n in lista})
+            ESTADO_OBSERVADOR['notas_incluidas'] += len(lista)
+            ESTADO_OBSERVADOR['notas_removidas'] += removidas
+            print(f"Observador XML ({modulo}): {len(lista)} nota(s) atualizada(s), {removidas} removida(s). Cache com {total}.")
+
+        ESTADO_OBSERVADOR['lotes'] += 1
+        ESTADO_OBSERVADOR['ultimo_lote'] = datetime.now().isoformat(timespec='seconds')
+
+def _conferir_pasta(pasta, pastas_ignoradas, anterior=None):
+    """
+    Compara a pasta com o manifesto. Retorna (alterados, removidos, listagem).
+    Com 'anterior' (listagem da conferência passada), arquivo novo/alterado só entra se
+    tamanho e data não mudaram desde lá: ainda pode estar sendo copiado.
+    """
+    listagem = {xml: (tamanho, mtime) for xml, tamanho, mtime in listar_xmls(pasta, pastas_ignoradas)}
+    manifesto = carregar_manifesto(pasta)
+    with travar_manifesto():
+        # Entrada só pré-filtrada (varredura de outro módulo) conta como não lida: o observador lê
+        # a nota inteira e ela entra nos caches dos módulos cujo filtro ela passa
+        conhecidos = {xml: (e['tamanho'], e['mtime']) for xml, e in manifesto.items() if not e.get('pre')}
+        removidos = [xml for xml in manifesto if xml not in listagem]
+    alterados = [xml for xml, tm in listagem.items()
+                 if conhecidos.get(xml) != tm and (anterior is None or anterior.get(xml) == tm)]
+    ESTADO_OBSERVADOR['ultima_conferencia'] = datetime.now().isoformat(timespec='seconds')
+    return alterados, removidos, listagem
+
+def _manifesto_vazio(pasta):
+    # Sem manifesto a pasta inteira pareceria nova: espera a primeira varredura completa montá-lo
+    manifesto = carregar_manifesto(pasta)
+    with travar_manifesto():
+        return not manifesto
+
+def _processar_pendentes(app, pasta, pendentes):
+    """Processa até OBSERVADOR_XML_LOTE arquivos pendentes ({xml: removido?}). O resto fica para o próximo ciclo."""
+    lote = list(pendentes.items())[:max(1, Config.OBSERVADOR_XML_LOTE)]
+    for xml, _ in lote: del pendentes[xml]
+    alterados = [xml for xml, removido in lote if not removido]
+    removidos = [xml for xml, removido in lote if removido]
+    try:
+        _aplicar_mudancas(app, pasta, alterados, removidos)
+    except Exception as e:
+        # Devolve o lote para a fila: o erro pode ser passageiro (ERP fora do ar)
+        print(f"Erro no observador XML: {e}")
+        ESTADO_OBSERVADOR['erro'] = str(e)
+        for xml, removido in lote: pendentes.setdefault(xml, removido)
+        return False
+    ESTADO_OBSERVADOR['erro'] = None
+    return True
+
+def _ocupado():
+    # Durante a varredura completa o cache vai ser reescrito inteiro: espera ela terminar
+    return ha_tarefa_rodando()
+
+# --- LAÇOS DOS DOIS MODOS ---
+
+def _laco_inotify(app, pasta, pastas_ignoradas, ino):
+    ino.observar_arvore(pasta, pastas_ignoradas)
+    pendentes = {}
+    conferir = True  # confere na partida: o que chegou com o sistema fora do ar
+    ultimo_evento = 0.0
+    proxima_conferencia = time.monotonic() + Config.OBSERVADOR_XML_RECONCILIAR
+
+    while True:
+        ESTADO_OBSERVADOR['pastas_observadas'] = len(ino.pastas)
+        for wd, mask, nome in ino.ler(timeout=1.0):
+            if mask & IN_Q_OVERFLOW:
+                conferir = True
+                continue
+            base = ino.pastas.get(wd)
+            if mask & IN_IGNORED:
+                ino.pastas.pop(wd, None)
+                continue
+            if base is None or not nome: continue
+            caminho = os.path.join(base, nome)
+            ultimo_evento = time.monotonic()
+
+            if mask & IN_ISDIR:
+                # Pasta criada/movida para dentro: passa a ser observada e seus arquivos entram pela conferência
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if nome.lower().strip() not in pastas_ignoradas: ino.observar_arvore(caminho, pastas_ignoradas)
+                elif mask & (IN_MOVED_FROM | IN_DELETE):
+                    ino.esquecer_arvore(caminho)
+                conferir = True
+                continue
+
+            # .zip novo/regravado/apagado: a conferência relista os membros
+            if e_zip(nome):
+                conferir = True
+                continue
+            if not nome.lower().endswith('.xml') and not e_xml_gz(nome): continue
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO): pendentes[caminho] = False
+            elif mask & (IN_DELETE | IN_MOVED_FROM): pendentes[caminho] = True
+
+        agora = time.monotonic()
+        if agora >= proxima_conferencia:
+            conferir = True
+            proxima_conferencia = agora + Config.OBSERVADOR_XML_RECONCILIAR
+
+        ESTADO_OBSERVADOR['pendentes'] = len(pendentes)
+        # Espera a rajada de eventos acalmar (cópia de muitos arquivos) antes de processar
+        if (not pendentes and not conferir) or agora - ultimo_evento < Config.OBSERVADOR_XML_ESPERA or _ocupado():
+            continue
+        if _manifesto_vazio(pasta):
+            pendentes.clear()
+            conferir = False
+            continue
+
+        if conferir:
+            alterados, removidos, _ = _conferir_pasta(pasta, pastas_ignoradas)
+            for xml in alterados: pendentes.setdefault(xml, False)
+            for xml in removidos: pendentes.setdefault(xml, True)
+            conferir = False
+        if pendentes: _processar_pendentes(app, pasta, pendentes)
+
+def _laco_polling(app, pasta, pastas_ignoradas):
+    anterior = None
+    pendentes = {}
+    while True:
+        if not _ocupado() and not _manifesto_vazio(pasta):
+            alterados, removidos, anterior = _conferir_pasta(pasta, pastas_ignoradas, anterior)
+            for xml in alterados: pendentes.setdefault(xml, False)
+            for xml in removidos: pendentes.setdefault(xml, True)
+            while pendentes and not _ocupado():
+                if not _processar_pendentes(app, pasta, pendentes): break
+        ESTADO_OBSERVADOR['pendentes'] = len(pendentes)
+        time.sleep(Config.OBSERVADOR_XML_INTERVALO)
+
+def _executar(app):
+    pasta = os.path.normpath(Config.CAMINHO_XML_PADRAO)
+    pastas_ignoradas = Config.PASTAS_IGNORADAS or PASTAS_IGNORADAS
+    ESTADO_OBSERVADOR.update({'ativo': True, 'pasta': pasta})
+
+    modo = Config.OBSERVADOR_XML_MODO
+    while True:
+        ino = None
+        if modo == 'auto' and _pasta_de_rede(pasta):
+            print(f"Observador XML: {pasta} é pasta de rede ({_sistema_de_arquivos(pasta)}). Usando polling.")
+        elif modo in ('auto', 'inotify'):
+            try:
+                ino = _Inotify()
+            except (OSError, AttributeError) as e:
+                # Windows/macOS ou kernel sem inotify: polling
+                print(f"Observador XML: inotify indisponível ({e}). Usando polling.")
+        ESTADO_OBSERVADOR['modo'] = 'inotify' if ino else 'polling'
+
+        try:
+            if not os.path.isdir(pasta): raise OSError(f"Pasta não encontrada: {pasta}")
+            if ino: _laco_inotify(app, pasta, pastas_ignoradas, ino)
+            else: _laco_polling(app, pasta, pastas_ignoradas)
+        except Exception as e:
+            print(f"Erro no observador XML: {e}")
+            ESTADO_OBSERVADOR['erro'] = str(e)
+        finally:
+            if ino: ino.fechar()
+        # Pasta de rede fora do ar, etc.: tenta de novo mais tarde
+        time.sleep(Config.OBSERVADOR_XML_INTERVALO)
+
+def iniciar_observador(app):
+    """Sobe a thread do observador (uma única vez por processo)."""
+    global _THREAD
+    if _THREAD is not None and _THREAD.is_alive(): return
+    _THREAD = threading.Thread(target=_executar, args=(app,), name='observador_xml', daemon=True)
+    _THREAD.start()
+
+def status_observador():
+    """Modo em uso, pendências e contadores desde que o sistema subiu."""
+    return dict(ESTADO_OBSERVADOR)
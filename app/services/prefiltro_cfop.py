@@ -0,0 +1,66 @@
+# --- PRÉ-FILTRO DE CFOP NOS BYTES DO XML ---
+# A devolução só quer notas com CFOP 5917/6917, mas sem o pré-filtro toda nota da pasta é lida
+# por inteiro (árvore, itens, datas) para depois ser descartada pelo filtro.
+# Aqui os valores das tags <CFOP> são procurados direto nos bytes do arquivo, com uma expressão
+# regular. Se nenhum deles passa no filtro, a nota nem é lida.
+#
+# A regra é nunca descartar uma nota que o leitor completo aceitaria: os CFOPs achados aqui são
+# sempre um superconjunto dos que o leitor acha (qualquer tag CFOP do arquivo, com qualquer prefixo).
+# Quando o texto não dá para confiar (UTF-16, entidades, CDATA), devolve None e a nota é lida inteira.
+
+import mmap
+import os
+import re
+import zipfile
+
+from app.services.xml_compactados import abrir_xml, e_membro_zip
+
+# A busca começa pelo literal 'CFOP' (bem mais rápida que começar por '<'); o que vem antes
+# é conferido em _abertura_da_tag. O grupo 2 (lookahead: não consome o '<' da tag seguinte)
+# confere se o texto termina no fechamento da tag.
+_RE_CFOP = re.compile(rb'CFOP(?:\s[^>]*)?>([^<]*)(?=(<.))')
+_RE_PREFIXO = re.compile(rb'(?:[A-Za-z_][\w.\-]*:)?')
+
+# Acima disso o arquivo é mapeado (mmap) em vez de lido inteiro para a memória
+_TAMANHO_MMAP = 1024 * 1024
+
+def _abertura_da_tag(conteudo, pos):
+    """True se o 'CFOP' em pos é o nome de uma tag de abertura (<CFOP ou <prefixo:CFOP)."""
+    lt = conteudo.rfind(b'<', max(0, pos - 64), pos)
+    if lt < 0: return False
+    return _RE_PREFIXO.fullmatch(conteudo[lt + 1:pos]) is not None
+
+def _procurar(conteudo):
+    inicio = conteudo[:4]
+    # BOM de UTF-16/UTF-32 ou bytes nulos no início: os bytes não são ASCII puro
+    if inicio[:2] in (b'\xff\xfe', b'\xfe\xff') or b'\x00' in inicio: return None
+    cfops = set()
+    for m in _RE_CFOP.finditer(conteudo):
+        # </CFOP>, <xCFOP>, texto solto: não é a tag
+        if not _abertura_da_tag(conteudo, m.start()): continue
+        texto, fechamento = m.group(1), m.group(2)
+        # CDATA/comentário dentro da tag ou entidade (&#53;...): o texto real é outro
+        if fechamento != b'</' or b'&' in texto: return None
+        cfops.add(texto.decode('utf-8'))
+    return frozenset(cfops)
+
+def cfops_brutos(xml_path):
+    """
+    CFOPs que aparecem no arquivo (frozenset de textos, como o leitor os veria),
+    ou None se não der para decidir sem ler a nota inteira.
+    """
+    try:
+        if e_membro_zip(xml_path) or xml_path.lower().endswith('.gz'):
+            # Membro de .zip / .xml.gz: descompacta para a memória (as notas são pequenas)
+            with abrir_xml(xml_path) as f: conteudo = f.read()
+            return _procurar(conteudo) if conteudo else None
+        with open(xml_path, 'rb') as f:
+            tamanho = os.fstat(f.fileno()).st_size
+            # Arquivo vazio: o leitor completo resolve (nota inválida)
+            if tamanho == 0: return None
+            if tamanho < _TAMANHO_MMAP: return _procurar(f.read())
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try: return _procurar(mm)
+            finally: mm.close()
+    except (OSError, ValueError, UnicodeDecodeError, EOFError, zipfile.BadZipFile):
+        return None
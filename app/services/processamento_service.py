@@ -1,27 +1,15 @@
 # --- IMPORTAÇÕES ---
-import json
 import pandas as pd
 import re
 from datetime import datetime
 
 # Importações do projeto
 from app.repository.geral_repo import buscar_filiais, buscar_dados_fornecedores, buscar_itens_pedidos_lote
-from app.services.cache_service import CACHE_ACERTO, CACHE_DEVOLUCAO, CACHE_GERAL
+from app.services.cache_service import CACHE_ACERTO, CACHE_DEVOLUCAO, CACHE_GERAL, salvar_cache
+from app.services.xml_service import CAMPOS_ITEM
+from app.services.tarefas_service import Tarefa
 from config import Config
 
-STATUS_GLOBAL = {'atual': 0, 'total': 0, 'status': 'parado', 'msg': ''}
-
-def atualizar_progresso(atual, total):
-    STATUS_GLOBAL['atual'] = atual
-    STATUS_GLOBAL['total'] = total
-    STATUS_GLOBAL['status'] = 'rodando'
-
-def resetar_progresso():
-    STATUS_GLOBAL['atual'] = 0
-    STATUS_GLOBAL['total'] = 0
-    STATUS_GLOBAL['status'] = 'iniciando'
-    STATUS_GLOBAL['msg'] = ''
-
 # --- FUNÇÕES AUXILIARES ---
 
 def limpar_cnpj(valor):
@@ -67,49 +55,57 @@ def gerar_resumo_divergencia(nota):
         return "" 
     return " | ".join(msgs)
 
-# --- TAREFA PRINCIPAL (THREAD) ---
+# --- ENRIQUECIMENTO DAS NOTAS (usado pela varredura completa e pelo observador da pasta) ---
 
-def tarefa_background(modulo, app_config):
-    """
-    Função principal que é executada em segundo plano.
-    """
-    caminho_xml = Config.CAMINHO_XML_PADRAO
-    
-    # DEBUG: Imprime no terminal para sabermos onde ele está a procurar
-    print(f"--- INICIANDO PROCESSAMENTO BACKEND ---")
-    print(f"Pasta Alvo: {caminho_xml}")
-    
+def config_modulo(modulo, app_config):
+    """CFOPs, tipo de pedido no ERP e arquivo de cache de cada módulo."""
     if modulo == 'devolucao':
-        cfops = ['5917', '6917']
-        tipo_pedido = 4
-        arquivo_cache = CACHE_DEVOLUCAO
+        return ['5917', '6917'], 4, CACHE_DEVOLUCAO
     elif modulo == 'acerto':
-        cfops = app_config.get('CFOPS_PADRAO')
-        tipo_pedido = 1
-        arquivo_cache = CACHE_ACERTO
+        return app_config.get('CFOPS_PADRAO'), 1, CACHE_ACERTO
     else: 
-        cfops = app_config.get('CFOPS_PADRAO')
-        tipo_pedido = 1
-        arquivo_cache = CACHE_GERAL
+        return app_config.get('CFOPS_PADRAO'), 1, CACHE_GERAL
+
+def _normalizar_itens(df_itens):
+    """Valor unitário zerado no XML é recalculado pelo líquido / quantidade (coluna inteira de uma vez)."""
+    if df_itens.empty: return df_itens
+    zerado = df_itens['Valor_Unitario'] == 0
+    com_qtd = zerado & (df_itens['Quantidade'] > 0)
+    df_itens.loc[com_qtd, 'Valor_Unitario'] = df_itens.loc[com_qtd, 'Valor_Liquido'] / df_itens.loc[com_qtd, 'Quantidade']
+    df_itens.loc[zerado & ~com_qtd, 'Valor_Unitario'] = 0.0
+    return df_itens
+
+def _itens_por_nota(df_itens, total_notas):
+    """Lista de itens (dicts, formato do cache) de cada nota, na posição do Id_Nota."""
+    por_nota = [[] for _ in range(total_notas)]
+    if df_itens.empty: return por_nota
+    # Colunas como listas e um dict por item direto delas: os valores são os mesmos objetos das notas compactas
+    colunas = [df_itens[c].tolist() for c in CAMPOS_ITEM]
+    for id_nota, valores in zip(df_itens['Id_Nota'].tolist(), zip(*colunas)):
+        por_nota[id_nota].append(dict(zip(CAMPOS_ITEM, valores)))
+    return por_nota
+
+def _itens_erp_por_pedido(df_itens_erp):
+    """
+    Índice pedido -> itens do pedido no ERP (dicts, formato do cache), montado uma vez só:
+    um to_dict da tabela inteira e um passe agrupando pela chave, na ordem das linhas.
+    Substitui o filtro df[df['Numero_Pedido_Chave'] == ped] por nota (a tabela inteira varrida a cada nota).
+    """
+    if df_itens_erp.empty: return {}
+    por_pedido = {}
+    for ped, item in zip(df_itens_erp['Numero_Pedido_Chave'].tolist(), df_itens_erp.to_dict('records')):
+        por_pedido.setdefault(ped, []).append(item)
+    return por_pedido
 
-    STATUS_GLOBAL['msg'] = 'Lendo arquivos XML...'
-    
-    from app.services.xml_service import processar_pasta_xml_thread_safe 
-    
-    pastas_ign = app_config.get('PASTAS_IGNORADAS', [])
-    df_xml, msg = processar_pasta_xml_thread_safe(caminho_xml, cfops, atualizar_progresso, pastas_ign)
-    
-    # --- CORREÇÃO CRÍTICA AQUI ---
-    # Se não encontrou XMLs, imprimimos o aviso mas CONTINUAMOS.
-    # Isso garante que lá no final do código ele salve um arquivo vazio,
-    # limpando os dados antigos da tela.
-    if df_xml.empty:
-        print(f"AVISO BACKEND: Nenhum XML encontrado. Motivo: {msg}")
-        STATUS_GLOBAL['msg'] = msg or "Nenhum XML encontrado"
-        # NÃO FAZEMOS MAIS 'return' AQUI. O CÓDIGO SEGUE PARA LIMPAR O ARQUIVO.
+def enriquecer_notas(df_notas, df_itens, tipo_pedido, avisar=None):
+    """
+    Cruza as notas lidas dos XML com o ERP (filial, fornecedor, itens do pedido) e calcula a divergência.
+    Recebe as tabelas de xml_service.montar_tabelas; os itens só viram dicts no fim, já no formato do cache.
+    Retorna a lista de notas no formato do cache. avisar(msg) recebe as mensagens de andamento.
+    """
+    if avisar is None: avisar = lambda msg: None
+    df_xml = df_notas
 
-    STATUS_GLOBAL['msg'] = 'Cruzando dados com ERP...'
-    
     # 2. Cruzamento com Lojas (Filiais)
     if not df_xml.empty and 'CNPJ_Destinatario' in df_xml.columns:
         df_xml['KEY_CNPJ'] = df_xml['CNPJ_Destinatario'].apply(limpar_cnpj)
@@ -150,6 +146,12 @@ def tarefa_background(modulo, app_config):
         else: df_final[c] = df_final[c].fillna('-')
         
     df_final = df_final.fillna("")
+
+    # A lista de itens entra logo depois da chave de acesso (mesma ordem de campos do cache de sempre)
+    ids_notas = df_final['Id_Nota'].tolist()
+    df_final = df_final.drop(columns=['Id_Nota'])
+    df_final.insert(df_final.columns.get_loc('Chave_Acesso') + 1, 'Itens', None)
+    if 'Valor_Total' in df_final.columns: df_final['Valor_Total'] = df_final['Valor_Total'].map(formatar_moeda)
     
     lista = df_final.to_dict('records')
     
@@ -158,7 +160,7 @@ def tarefa_background(modulo, app_config):
     
     df_itens_erp = pd.DataFrame()
     if pedidos:
-        STATUS_GLOBAL['msg'] = f'Buscando {len(pedidos)} pedidos no Banco...'
+        avisar(f'Buscando {len(pedidos)} pedidos no Banco...')
         try:
             df_itens_erp = buscar_itens_pedidos_lote(pedidos, tipo_acerto_alvo=tipo_pedido)
             if not df_itens_erp.empty:
@@ -167,49 +169,74 @@ def tarefa_background(modulo, app_config):
         except Exception as e:
             print(f"Erro ao buscar pedidos no lote: {e}")
 
-    STATUS_GLOBAL['msg'] = 'Finalizando análises...'
+    avisar('Finalizando análises...')
     
-    # 5. Cruzamento Final Item a Item
-    for nota in lista:
-        for item in nota.get('Itens', []):
-            item.setdefault('Titulo', item.get('xProd', 'Produto Sem Nome'))
-            if 'Valor_Liquido' not in item:
-                try: item['Valor_Liquido'] = float(item.get('vProd', 0))
-                except: item['Valor_Liquido'] = 0.0
-            
-            if 'Quantidade' in item:
-                try: item['Quantidade'] = float(item['Quantidade'])
-                except: item['Quantidade'] = 0.0
-                
-            if 'Valor_Unitario' not in item or item['Valor_Unitario'] == 0:
-                qtd = item.get('Quantidade', 0)
-                if qtd > 0: item['Valor_Unitario'] = item.get('Valor_Liquido', 0) / qtd
-                else: item['Valor_Unitario'] = 0.0
-
+    # 5. Cruzamento Final Item a Item (itens do XML e do ERP já agrupados: uma consulta ao dicionário por nota)
+    itens_por_nota = _itens_por_nota(_normalizar_itens(df_itens), len(df_notas))
+    itens_erp_por_pedido = _itens_erp_por_pedido(df_itens_erp)
+    for nota, id_nota in zip(lista, ids_notas):
+        nota['Itens'] = itens_por_nota[id_nota]
         ped = str(nota.get('Numero_Pedido', ''))
-        nota['Itens_ERP'] = []
-        
-        if ped and not df_itens_erp.empty:
-            itens = df_itens_erp[df_itens_erp['Numero_Pedido_Chave'] == ped]
-            if not itens.empty: nota['Itens_ERP'] = itens.to_dict('records')
-        
+        # Lista própria de cada nota (notas do mesmo pedido não dividem a lista)
+        nota['Itens_ERP'] = list(itens_erp_por_pedido.get(ped, ())) if ped else []
+        # Só o resumo vai para o cache; a tabela item a item é montada quando a nota é aberta (notas_service.buscar_nota)
         nota['Divergencia_Resumo'] = gerar_resumo_divergencia(nota)
-        if 'Valor_Total' in nota: nota['Valor_Total'] = formatar_moeda(nota['Valor_Total'])
+
+    return lista
+
+# --- TAREFA PRINCIPAL (THREAD) ---
+
+def _texto_resumo(resumo):
+    """Resumo da leitura dos XML para a mensagem final: '120 notas (15 lidas, 300 reaproveitadas, ...)'."""
+    partes = [f"{resumo[campo]} {nome}" for campo, nome in (
+        ('lidos', 'lidas'), ('reaproveitados', 'reaproveitadas'), ('pulados_prefiltro', 'puladas pelo CFOP'),
+        ('copias_identicas', 'cópias idênticas'), ('duplicadas_chave', 'com chave repetida')) if resumo.get(campo)]
+    texto = f"{resumo.get('notas', 0)} notas"
+    return f"{texto} ({', '.join(partes)})" if partes else texto
+
+def tarefa_background(modulo, app_config, tarefa=None):
+    """
+    Função principal que é executada em segundo plano (ver tarefas_service).
+    O progresso vai para a 'tarefa'; se ela for cancelada, TarefaCancelada sai daqui e o cache não é gravado.
+    """
+    if tarefa is None: tarefa = Tarefa(modulo, app_config)
+    caminho_xml = Config.CAMINHO_XML_PADRAO
+    
+    # DEBUG: Imprime no terminal para sabermos onde ele está a procurar
+    print(f"--- INICIANDO PROCESSAMENTO BACKEND ---")
+    print(f"Pasta Alvo: {caminho_xml}")
+    
+    cfops, tipo_pedido, arquivo_cache = config_modulo(modulo, app_config)
+
+    tarefa.mudar_fase('Lendo arquivos XML...')
+    
+    from app.services.xml_service import ler_pasta_xml 
+    
+    pastas_ign = app_config.get('PASTAS_IGNORADAS', [])
+    (df_xml, df_itens), msg, tarefa.resumo = ler_pasta_xml(caminho_xml, cfops, tarefa.progresso, pastas_ign)
+    
+    # --- CORREÇÃO CRÍTICA AQUI ---
+    # Se não encontrou XMLs, imprimimos o aviso mas CONTINUAMOS.
+    # Isso garante que lá no final do código ele salve um arquivo vazio,
+    # limpando os dados antigos da tela.
+    if df_xml.empty:
+        print(f"AVISO BACKEND: Nenhum XML encontrado. Motivo: {msg}")
+        tarefa.msg = msg or "Nenhum XML encontrado"
+        # NÃO FAZEMOS MAIS 'return' AQUI. O CÓDIGO SEGUE PARA LIMPAR O ARQUIVO.
+
+    tarefa.mudar_fase('Cruzando dados com ERP...')
+    
+    lista = enriquecer_notas(df_xml, df_itens, tipo_pedido, avisar=tarefa.mudar_fase)
 
     # 6. Salva no Disco (Cache)
     # IMPORTANTE: Se a lista estiver vazia, ele vai salvar vazio, limpando o cache antigo.
     ts = datetime.now().strftime("%d/%m/%Y às %H:%M")
-    try:
-        print(f"Salvando {len(lista)} registros em: {arquivo_cache}")
-        with open(arquivo_cache, 'w', encoding='utf-8') as f:
-            json.dump({"timestamp": ts, "dados": lista}, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"ERRO AO SALVAR CACHE: {e}")
+    tarefa.mudar_fase('Salvando cache...')
+    print(f"Salvando {len(lista)} registros em: {arquivo_cache}")
+    salvar_cache(arquivo_cache, lista, ts)
 
     # Avisa que acabou
     if not lista:
-        STATUS_GLOBAL['status'] = 'concluido_vazio' # Status especial para avisar que limpou
-        STATUS_GLOBAL['msg'] = 'Nenhum arquivo encontrado na pasta.'
+        tarefa.encerrar('concluido_vazio', 'Nenhum arquivo encontrado na pasta.') # Status especial para avisar que limpou
     else:
-        STATUS_GLOBAL['status'] = 'concluido'
-        STATUS_GLOBAL['msg'] = 'Concluído!'
\ No newline at end of file
+        tarefa.encerrar('concluido', f'Concluído! {_texto_resumo(tarefa.resumo)}')
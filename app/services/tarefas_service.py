@@ -0,0 +1,210 @@
+# --- TAREFAS EM SEGUNDO PLANO (PROCESSAMENTO DOS MÓDULOS) ---
+# Antes havia um STATUS_GLOBAL só: enquanto a devolução processava, o acerto não podia começar, e um
+# processamento travado não tinha como ser parado. Aqui cada pedido de processamento vira uma tarefa
+# com id próprio, que:
+#   - roda na sua thread, no máximo TAREFAS_POR_MODULO por módulo e TAREFAS_SIMULTANEAS no total;
+#     o que passa do limite espera na fila, na ordem de chegada;
+#   - guarda o próprio progresso (arquivos, fases, ritmo) e acorda quem acompanha pelo stream SSE;
+#   - pode ser cancelada: o pedido fica marcado e a tarefa para no próximo ponto de conferência
+#     (a cada arquivo lido e a cada fase do cruzamento com o ERP). O cache anterior fica como estava.
+# As tarefas terminadas ficam no histórico (as últimas TAREFAS_HISTORICO).
+
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from config import Config
+
+FINALIZADOS = ('concluido', 'concluido_vazio', 'cancelado', 'erro')
+
+# Um lock (reentrante) para o registro e o progresso de todas as tarefas; notify_all acorda os streams
+_MUDOU = threading.Condition()
+_TAREFAS = {}    # id -> Tarefa, na ordem de criação (ativas e histórico)
+_FILA = deque()  # tarefas esperando vaga
+
+class TarefaCancelada(Exception):
+    """Levantada dentro da tarefa, no ponto de conferência seguinte ao pedido de cancelamento."""
+
+class Tarefa:
+    """Um processamento de módulo: estado, progresso e pedido de cancelamento."""
+
+    def __init__(self, modulo, app_config=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.modulo = modulo
+        self.app_config = app_config or {}
+        self.status = 'na_fila'
+        self.msg = 'Na fila...'
+        self.atual = 0
+        self.total = 0
+        self.fases = []      # [[msg, início, fim]] (time.monotonic)
+        self.ritmo = None    # (instante, atual) do primeiro aviso de arquivo da fase
+        self.resumo = {}     # contagens da leitura dos XML (lidos, reaproveitados, pulados, duplicadas...)
+        self.versao = 0
+        self.criada = datetime.now()
+        self.iniciada = None
+        self.terminada = None
+        self._cancelar = threading.Event()
+
+    def _mudou(self):
+        with _MUDOU:
+            self.versao += 1
+            _MUDOU.notify_all()
+
+    def conferir_cancelamento(self):
+        if self._cancelar.is_set(): raise TarefaCancelada()
+
+    def progresso(self, atual, total):
+        """Callback de progresso da leitura dos XML (também é ponto de cancelamento)."""
+        self.conferir_cancelamento()
+        self.atual = atual
+        self.total = total
+        # O primeiro aviso da fase pode já vir adiantado (notas reaproveitadas do manifesto): o ritmo conta a partir dele
+        if self.ritmo is None: self.ritmo = (time.monotonic(), atual)
+        self._mudou()
+
+    def mudar_fase(self, msg):
+        """Troca a mensagem de andamento e começa a contar o tempo de uma nova fase (também é ponto de cancelamento)."""
+        self.conferir_cancelamento()
+        agora = time.monotonic()
+        self._fechar_fase(agora)
+        self.fases.append([msg, agora, None])
+        self.ritmo = None
+        self.msg = msg
+        self._mudou()
+
+    def _fechar_fase(self, agora):
+        if self.fases and self.fases[-1][2] is None: self.fases[-1][2] = agora
+
+    def encerrar(self, status, msg):
+        self._fechar_fase(time.monotonic())
+        self.status = status
+        self.msg = msg
+        self.terminada = datetime.now()
+        self._mudou()
+
+    def retrato(self):
+        """Estado para as rotas: campos do antigo /api/progresso + arquivos/s, segundos restantes, tempo de cada fase e resumo da leitura."""
+        agora = time.monotonic()
+        atual, total = self.atual, self.total
+        dados = {
+            'id': self.id, 'modulo': self.modulo,
+            'atual': atual, 'total': total,
+            'percentual': int((atual / total) * 100) if total > 0 else 0,
+            'status': self.status, 'msg': self.msg,
+            'cancelamento_pedido': self._cancelar.is_set(),
+        }
+
+        por_segundo, restante = None, None
+        if self.ritmo is not None and self.status == 'rodando':
+            inicio, atual_inicio = self.ritmo
+            if agora > inicio and atual > atual_inicio:
+                por_segundo = (atual - atual_inicio) / (agora - inicio)
+                restante = round((total - atual) / por_segundo, 1)
+                por_segundo = round(por_segundo, 1)
+        dados['arquivos_por_segundo'] = por_segundo
+        dados['segundos_restantes'] = restante
+
+        fases = list(self.fases)
+        dados['fases'] = [{'fase': msg, 'segundos': round((fim or agora) - inicio, 2)} for msg, inicio, fim in fases]
+        dados['segundos_total'] = round((fases[-1][2] or agora) - fases[0][1], 2) if fases else 0
+        for campo in ('criada', 'iniciada', 'terminada'):
+            valor = getattr(self, campo)
+            dados[campo] = valor.isoformat(timespec='seconds') if valor else None
+        dados['resumo'] = dict(self.resumo)
+        dados['versao'] = self.versao
+        return dados
+
+# --- REGISTRO E FILA ---
+
+def _rodando():
+    return [t for t in _TAREFAS.values() if t.status == 'rodando']
+
+def _despachar(app):
+    """Põe para rodar as tarefas da fila que cabem nos limites (chamar com _MUDOU travado)."""
+    rodando = _rodando()
+    for tarefa in list(_FILA):
+        if len(rodando) >= max(1, Config.TAREFAS_SIMULTANEAS): break
+        if sum(1 for t in rodando if t.modulo == tarefa.modulo) >= max(1, Config.TAREFAS_POR_MODULO): continue
+        _FILA.remove(tarefa)
+        tarefa.status = 'rodando'
+        tarefa.msg = 'Iniciando...'
+        tarefa.iniciada = datetime.now()
+        tarefa._mudou()
+        rodando.append(tarefa)
+        threading.Thread(target=_executar, args=(app, tarefa), name=f'tarefa_{tarefa.modulo}_{tarefa.id}', daemon=True).start()
+
+def _podar_historico():
+    terminadas = [t.id for t in _TAREFAS.values() if t.status in FINALIZADOS]
+    for id_tarefa in terminadas[:max(0, len(terminadas) - Config.TAREFAS_HISTORICO)]:
+        del _TAREFAS[id_tarefa]
+
+def _executar(app, tarefa):
+    from app.services.processamento_service import tarefa_background
+    try:
+        # O contexto da aplicação é empurrado aqui para o database.py conseguir ler a string de conexão
+        with app.app_context():
+            tarefa_background(tarefa.modulo, tarefa.app_config, tarefa)
+    except TarefaCancelada:
+        print(f"Tarefa {tarefa.id} ({tarefa.modulo}) cancelada.")
+        tarefa.encerrar('cancelado', 'Cancelado. O cache anterior foi mantido.')
+    except Exception as e:
+        print(f"Erro na tarefa {tarefa.id} ({tarefa.modulo}): {e}")
+        tarefa.encerrar('erro', f'Erro no processamento: {e}')
+    finally:
+        with _MUDOU:
+            if tarefa.status not in FINALIZADOS: tarefa.encerrar('concluido', 'Concluído!')
+            _podar_historico()
+            _despachar(app)
+
+def iniciar_tarefa(app, modulo, app_config):
+    """
+    Cria a tarefa de processamento do módulo e a põe para rodar (ou na fila, se não há vaga).
+    Se já existe uma tarefa do módulo esperando na fila, devolve ela: duas na fila fariam o mesmo trabalho.
+    """
+    with _MUDOU:
+        for tarefa in _FILA:
+            if tarefa.modulo == modulo: return tarefa
+        tarefa = Tarefa(modulo, app_config)
+        _TAREFAS[tarefa.id] = tarefa
+        _FILA.append(tarefa)
+        _despachar(app)
+        return tarefa
+
+def cancelar_tarefa(id_tarefa):
+    """Cancela a tarefa: na fila sai na hora; rodando para no próximo ponto de conferência. None se não existe."""
+    with _MUDOU:
+        tarefa = _TAREFAS.get(id_tarefa)
+        if tarefa is None: return None
+        if tarefa.status == 'na_fila':
+            _FILA.remove(tarefa)
+            tarefa.encerrar('cancelado', 'Cancelado antes de começar.')
+        elif tarefa.status == 'rodando' and not tarefa._cancelar.is_set():
+            tarefa._cancelar.set()
+            tarefa.msg = 'Cancelando...'
+            tarefa._mudou()
+        return tarefa
+
+def buscar_tarefa(id_tarefa=None):
+    """A tarefa pelo id. Sem id: a rodando mais recente; sem nenhuma rodando, a última criada (ou None)."""
+    with _MUDOU:
+        if id_tarefa: return _TAREFAS.get(id_tarefa)
+        rodando = _rodando()
+        if rodando: return rodando[-1]
+        return next(reversed(_TAREFAS.values()), None)
+
+def listar_tarefas():
+    """Retrato de todas as tarefas (ativas, na fila e histórico), da mais nova para a mais antiga."""
+    with _MUDOU:
+        return [t.retrato() for t in reversed(_TAREFAS.values())]
+
+def ha_tarefa_rodando():
+    with _MUDOU:
+        return bool(_rodando())
+
+def esperar_mudanca(tarefa, versao, timeout):
+    """Espera o progresso da tarefa mudar depois da 'versao' (até timeout segundos). Retorna a versão atual."""
+    with _MUDOU:
+        _MUDOU.wait_for(lambda: tarefa.versao != versao, timeout)
+        return tarefa.versao
@@ -0,0 +1,131 @@
+# --- XML DENTRO DE ARQUIVOS COMPACTADOS (.zip / .xml.gz) ---
+# Fornecedores e o download da SEFAZ entregam os XML em lotes .zip. Extrair na pasta dobra o disco
+# e a quantidade de arquivos; em vez disso a varredura trata cada .zip como uma subpasta: cada XML
+# de dentro vira o caminho virtual 'lote.zip::pasta/nota.xml' e é lido direto do .zip, sem arquivo
+# temporário. Um .xml.gz é uma nota só, descompactada enquanto é lida.
+#
+# Para o manifesto, a "data" de um membro do .zip é o CRC32 dele (vem do diretório do .zip, sem ler
+# o membro): regravar o .zip com uma nota a mais não faz as outras serem lidas de novo.
+# As PASTAS_IGNORADAS valem também para as pastas de dentro do .zip e para o nome do próprio .zip.
+# Quais formatos são lidos: Config.XML_COMPACTADOS.
+#
+# Abrir o ZipFile lê o diretório inteiro do .zip: numa leitura em lote (zips_abertos) cada thread
+# reaproveita o seu para os membros seguintes, e no fim do lote todos são fechados (no Windows um
+# .zip aberto não pode ser movido nem apagado). Fora de um lote, cada membro abre e fecha o seu.
+
+import contextlib
+import gzip
+import os
+import threading
+import zipfile
+
+from config import Config
+
+SEPARADOR = '::'
+_MARCA_ZIP = '.zip' + SEPARADOR
+
+_LOCAL = threading.local()
+_TRAVA = threading.Lock()
+# Lotes em andamento (varreduras podem se sobrepor: observador e leitura manual) e ZipFiles abertos neles
+_LOTES = {'abertos': 0, 'geracao': 0, 'zips': set()}
+
+def e_membro_zip(caminho):
+    return _MARCA_ZIP in caminho.lower()
+
+def _dividir(caminho):
+    """'lote.zip::pasta/nota.xml' -> ('lote.zip', 'pasta/nota.xml')."""
+    pos = caminho.lower().index(_MARCA_ZIP) + len('.zip')
+    return caminho[:pos], caminho[pos + len(SEPARADOR):]
+
+def nome_arquivo(caminho):
+    """Nome do XML como ficaria extraído: 'nota.xml' para 'lote.zip::pasta/nota.xml' e para 'nota.xml.gz'."""
+    if e_membro_zip(caminho): return _dividir(caminho)[1].replace('\\', '/').rsplit('/', 1)[-1]
+    nome = os.path.basename(caminho)
+    return nome[:-3] if nome.lower().endswith('.gz') else nome
+
+@contextlib.contextmanager
+def zips_abertos():
+    """Leitura em lote: dentro do bloco cada thread reaproveita o ZipFile aberto; no fim do último lote, todos são fechados."""
+    with _TRAVA:
+        _LOTES['abertos'] += 1
+    try:
+        yield
+    finally:
+        with _TRAVA:
+            _LOTES['abertos'] -= 1
+            zips = []
+            if not _LOTES['abertos']:
+                zips, _LOTES['zips'] = list(_LOTES['zips']), set()
+                _LOTES['geracao'] += 1
+        # Membro ainda sendo lido não quebra: o arquivo só fecha de fato quando ele também fechar
+        for zf in zips: zf.close()
+
+def _zip_da_thread(caminho_zip):
+    """ZipFile aberto para a thread no lote atual, ou None se não há lote em andamento."""
+    with _TRAVA:
+        if not _LOTES['abertos']: return None
+        geracao = _LOTES['geracao']
+    st = os.stat(caminho_zip)
+    marca = (geracao, caminho_zip, st.st_size, st.st_mtime_ns)
+    atual = getattr(_LOCAL, 'zip', None)
+    if atual is not None:
+        if atual[0] == marca: return atual[1]
+        # Outro .zip (ou o mesmo regravado) na mesma thread: o anterior não será mais usado
+        _LOCAL.zip = None
+        with _TRAVA:
+            _LOTES['zips'].discard(atual[1])
+        atual[1].close()
+    zf = zipfile.ZipFile(caminho_zip)
+    with _TRAVA:
+        _LOTES['zips'].add(zf)
+    _LOCAL.zip = (marca, zf)
+    return zf
+
+def abrir_xml(caminho):
+    """Arquivo binário para leitura do XML: arquivo normal, membro de .zip ou .xml.gz."""
+    if e_membro_zip(caminho):
+        caminho_zip, membro = _dividir(caminho)
+        zf = _zip_da_thread(caminho_zip)
+        if zf is not None: return zf.open(membro)
+        # Fora de lote: o ZipFile fecha aqui e o .zip é liberado quando o membro for fechado
+        with zipfile.ZipFile(caminho_zip) as zf:
+            return zf.open(membro)
+    if caminho.lower().endswith('.gz'): return gzip.open(caminho, 'rb')
+    return open(caminho, 'rb')
+
+def e_xml_gz(nome):
+    return 'gz' in Config.XML_COMPACTADOS and nome.lower().endswith('.xml.gz')
+
+def e_zip(nome):
+    return 'zip' in Config.XML_COMPACTADOS and nome.lower().endswith('.zip')
+
+def listar_membros(caminho_zip, pastas_ignoradas):
+    """[(caminho virtual, tamanho, crc)] dos XML dentro do .zip, no formato de listar_xmls."""
+    if os.path.basename(caminho_zip)[:-4].lower().strip() in pastas_ignoradas: return []
+    try:
+        with zipfile.ZipFile(caminho_zip) as zf:
+            infos = zf.infolist()
+    except (OSError, zipfile.BadZipFile) as e:
+        # .zip corrompido ou ainda sendo copiado
+        print(f"Erro ao abrir {caminho_zip}: {e}")
+        return []
+    membros = []
+    for info in infos:
+        if info.is_dir() or not info.filename.lower().endswith('.xml'): continue
+        pastas = info.filename.replace('\\', '/').split('/')[:-1]
+        if any(p.lower().strip() in pastas_ignoradas for p in pastas): continue
+        membros.append((caminho_zip + SEPARADOR + info.filename, info.file_size, info.CRC))
+    return membros
+
+def tamanho_e_data(caminho):
+    """(tamanho, data) como na listagem da pasta (membro de .zip: CRC no lugar da data). OSError se não existe."""
+    if e_membro_zip(caminho):
+        caminho_zip, membro = _dividir(caminho)
+        try:
+            with zipfile.ZipFile(caminho_zip) as zf:
+                info = zf.getinfo(membro)
+        except (KeyError, zipfile.BadZipFile) as e:
+            raise OSError(f"{caminho}: {e}") from e
+        return info.file_size, info.CRC
+    st = os.stat(caminho)
+    return st.st_size, st.st_mtime_ns
@@ -0,0 +1,160 @@
+# --- LEITOR RÁPIDO DE NF-e ---
+# Alternativa ao parse_nfe padrão, que faz um find() com namespace para cada campo de cada item
+# (o ElementPath interpreta o caminho 'nfe:xxx' a cada chamada).
+# Aqui a árvore continua sendo montada pelo ET.parse (em C), mas os campos são tirados num passe
+# único pelos filhos de cada nó, comparando as tags já no formato '{namespace}tag'.
+#
+# O resultado precisa ser IDÊNTICO ao do leitor padrão (xml_service._ler_nfe), inclusive nos casos
+# estranhos: <prod> sem filhos é ignorado, xPed de <compra> tem prioridade sobre o dos itens,
+# valores inválidos zeram os quatro campos do item, item sem xProd invalida a nota, etc.
+# Ver benchmark.py (subcomando 'parser') para comparar os dois leitores numa pasta.
+
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+from app.services.xml_compactados import abrir_xml, nome_arquivo
+
+_NS = '{http://www.portalfiscal.inf.br/nfe}'
+_INF, _DET, _PROD, _COMPRA, _XPED = _NS + 'infNFe', _NS + 'det', _NS + 'prod', _NS + 'compra', _NS + 'xPed'
+_IDE, _EMIT, _DEST, _TOTAL, _ICMSTOT, _VNF = _NS + 'ide', _NS + 'emit', _NS + 'dest', _NS + 'total', _NS + 'ICMSTot', _NS + 'vNF'
+_DVENC = _NS + 'dVenc'
+_CFOP, _VPROD, _QCOM, _VUNCOM, _VDESC, _XPROD, _CEAN = (
+    _NS + 'CFOP', _NS + 'vProd', _NS + 'qCom', _NS + 'vUnCom', _NS + 'vDesc', _NS + 'xProd', _NS + 'cEAN')
+_TAGS_PROD = frozenset((_CFOP, _XPED, _VPROD, _QCOM, _VUNCOM, _VDESC, _XPROD, _CEAN))
+_TAGS_IDE = frozenset((_NS + 'nNF', _NS + 'serie', _NS + 'dhEmi', _NS + 'dEmi'))
+_TAGS_PARTE = frozenset((_NS + 'CNPJ', _NS + 'xNome'))
+
+def _primeiros(elem, tags):
+    """{tag: texto} do primeiro filho direto de cada tag pedida (um passe só pelos filhos)."""
+    achados = {}
+    for filho in elem:
+        t = filho.tag
+        if t in tags and t not in achados: achados[t] = filho.text
+    return achados
+
+def _ler_det(det, itens, cfops, pedido_det):
+    """Processa um <det> exatamente como o laço de itens do leitor padrão. Retorna o pedido encontrado no item."""
+    prod = None
+    for filho in det:
+        if filho.tag == _PROD:
+            prod = filho
+            break
+    # Igual ao 'if prod:' do leitor padrão: elemento sem filhos conta como falso
+    if prod is None or len(prod) == 0: return pedido_det
+
+    campos = {}
+    for filho in prod:
+        t = filho.tag
+        if t in _TAGS_PROD and t not in campos: campos[t] = filho.text
+
+    if _CFOP in campos: cfops.add(campos[_CFOP])
+    if not pedido_det and _XPED in campos: pedido_det = str(campos[_XPED]).strip()
+
+    try:
+        vprod = float(campos[_VPROD] or 0)
+        qcom = float(campos[_QCOM] or 0)
+        vuncom = float(campos[_VUNCOM] or 0)
+        vdesc = 0.0
+        if _VDESC in campos: vdesc = float(campos[_VDESC] or 0)
+    except:
+        vprod = 0.0; qcom = 0.0; vuncom = 0.0; vdesc = 0.0
+
+    # Sem xProd o leitor padrão levanta erro e descarta a nota: KeyError aqui faz o mesmo
+    xprod = campos[_XPROD]
+    cean = campos.get(_CEAN, "")
+
+    itens.append({
+        'ISBN': cean,
+        'Titulo': xprod,
+        'Quantidade': qcom,
+        'Valor_Unitario': vuncom,
+        'Valor_Bruto': vprod,
+        'Valor_Liquido': vprod - vdesc
+    })
+    return pedido_det
+
+def _data_br(texto):
+    try: return datetime.strptime(texto[:10], '%Y-%m-%d').strftime('%d/%m/%Y')
+    except: return ""
+
+def ler_nfe_rapido(xml_path):
+    """Mesmo contrato de xml_service._ler_nfe: (dados, cfops) ou (None, frozenset())."""
+    try:
+        with abrir_xml(xml_path) as f: raiz = ET.parse(f).getroot()
+
+        # Primeiro infNFe abaixo da raiz (mesmo critério de find('.//nfe:infNFe'))
+        inf = None
+        for el in raiz.iter(_INF):
+            if el is not raiz:
+                inf = el
+                break
+        if inf is None: return None, frozenset()
+
+        # Um passe pelos filhos do infNFe separa o que interessa
+        dets, totais = [], []
+        compra = ide = emit = dest = None
+        for filho in inf:
+            t = filho.tag
+            if t == _DET: dets.append(filho)
+            elif t == _TOTAL: totais.append(filho)
+            elif t == _COMPRA:
+                if compra is None: compra = filho
+            elif t == _IDE:
+                if ide is None: ide = filho
+            elif t == _EMIT:
+                if emit is None: emit = filho
+            elif t == _DEST:
+                if dest is None: dest = filho
+
+        # Pedido Global (da <compra>); o dos itens só vale se este estiver vazio
+        pedido = None
+        if compra is not None:
+            for filho in compra:
+                if filho.tag == _XPED:
+                    pedido = str(filho.text).strip()
+                    break
+
+        itens, cfops = [], set()
+        pedido_det = None
+        for det in dets: pedido_det = _ler_det(det, itens, cfops, pedido_det)
+        pedido = pedido or pedido_det
+
+        ide = _primeiros(ide, _TAGS_IDE) if ide is not None else None
+        emit = _primeiros(emit, _TAGS_PARTE) if emit is not None else None
+        dest = _primeiros(dest, _TAGS_PARTE) if dest is not None else None
+
+        def get_val(grupo, tag):
+            if grupo is None: return ""
+            return grupo.get(_NS + tag, "")
+
+        raw_date = get_val(ide, 'dhEmi') or get_val(ide, 'dEmi')
+        data_fmt = _data_br(raw_date) if raw_date else ""
+
+        el_venc = next(inf.iter(_DVENC), None)
+        vencimento_fmt = _data_br(el_venc.text) if el_venc is not None and el_venc.text else ""
+
+        # Mesmo critério de find('nfe:total/nfe:ICMSTot') seguido de find('nfe:vNF')
+        valor_total = 0.0
+        icmstot = next((neto for total in totais for neto in total if neto.tag == _ICMSTOT), None)
+        if icmstot is not None:
+            vnf = next((f for f in icmstot if f.tag == _VNF), None)
+            if vnf is not None: valor_total = float(vnf.text)
+
+        dados = {
+            'Arquivo': nome_arquivo(xml_path),
+            'CFOPs': ", ".join(sorted(cfops)),
+            'Numero_Pedido': pedido or "",
+            'Numero_NF': get_val(ide, 'nNF'),
+            'Serie': get_val(ide, 'serie'),
+            'Data_Emissao': data_fmt,
+            'Data_Vencimento': vencimento_fmt,
+            'CNPJ_Emitente': get_val(emit, 'CNPJ'),
+            'Nome_Emitente': get_val(emit, 'xNome'),
+            'CNPJ_Destinatario': get_val(dest, 'CNPJ'),
+            'Nome_Destinatario': get_val(dest, 'xNome'),
+            'Valor_Total': valor_total,
+            'Chave_Acesso': inf.attrib.get('Id', '')[3:],
+            'Itens': itens
+        }
+        return dados, frozenset(cfops)
+    except: return None, frozenset()
@@ -1,26 +1,58 @@
 import os
+import re
+import sys
+import time
 import pandas as pd
 import xml.etree.ElementTree as ET
 from datetime import datetime
 import concurrent.futures
+import contextlib
+
+from config import Config
+from app.services.manifesto_xml import carregar_manifesto, salvar_manifesto, travar_manifesto, hash_arquivo
+from app.services.xml_parser_rapido import ler_nfe_rapido
+from app.services.prefiltro_cfop import cfops_brutos
+from app.services.xml_compactados import abrir_xml, zips_abertos, nome_arquivo, e_zip, e_xml_gz, listar_membros, tamanho_e_data
 
 # Configurações Globais
 CFOPS_PADRAO = ['5113', '5114', '6113', '6114', '1113', '1114', '2113', '2114']
 PASTAS_IGNORADAS = ['enviados', 'associado', 'associados', 'canceladas', 'inutilizadas'] 
 
+def passa_filtro_cfop(cfops_encontrados, cfops_filtro):
+    """True se algum CFOP da nota está no filtro (None = CFOPS_PADRAO; lista vazia = aceita todas)."""
+    cfops_validos = cfops_filtro if cfops_filtro is not None else CFOPS_PADRAO
+    return not cfops_validos or bool(cfops_encontrados.intersection(set(cfops_validos)))
+
 def parse_nfe(xml_path, cfops_filtro=None):
     """Função worker: Processa um único arquivo XML."""
-    cfops_validos = cfops_filtro if cfops_filtro is not None else CFOPS_PADRAO
+    cfops_pre = _filtro_prefiltro(cfops_filtro)
+    if cfops_pre:
+        brutos = cfops_brutos(xml_path)
+        if brutos is not None and not passa_filtro_cfop(brutos, cfops_pre): return None
+    dados, cfops_encontrados = _ler_nota(xml_path)
+    if dados is None or not passa_filtro_cfop(cfops_encontrados, cfops_filtro): return None
+    return dados
+
+def _ler_nota(xml_path):
+    """Lê a nota com o leitor configurado (Config.XML_PARSER): 'rapido' ou 'padrao'. O resultado é o mesmo."""
+    if Config.XML_PARSER == 'rapido': return ler_nfe_rapido(xml_path)
+    return _ler_nfe(xml_path)
+
+def _ler_nfe(xml_path):
+    """
+    Lê a nota inteira, sem filtro de CFOP.
+    Retorna (dados, cfops encontrados); dados=None se o arquivo não for NF-e ou não puder ser lido.
+    """
     try:
-        # Abre e lê o arquivo XML
-        tree = ET.parse(xml_path)
+        # Abre e lê o arquivo XML (também de dentro de .zip/.gz, ver xml_compactados)
+        with abrir_xml(xml_path) as f: tree = ET.parse(f)
         root = tree.getroot()
         # Namespace padrão da NFe
         ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
         
         # Localiza infNFe
         inf_nfe = root.find('.//nfe:infNFe', ns)
-        if inf_nfe is None: return None
+        if inf_nfe is None: return None, frozenset()
 
         cfops_encontrados = set()
         lista_itens = []
@@ -73,10 +105,6 @@ def parse_nfe(xml_path, cfops_filtro=None):
                     'Valor_Liquido': vprod - vdesc
                 })
         
-        # Filtro de CFOP
-        if cfops_validos and not cfops_encontrados.intersection(set(cfops_validos)):
-            return None 
-
         # Dados Gerais
         ide = inf_nfe.find('nfe:ide', ns)
         emit = inf_nfe.find('nfe:emit', ns)
@@ -106,7 +134,7 @@ def parse_nfe(xml_path, cfops_filtro=None):
         chave = inf_nfe.attrib.get('Id', '')[3:]
 
         dados = {
-            'Arquivo': os.path.basename(xml_path),
+            'Arquivo': nome_arquivo(xml_path),
             'CFOPs': ", ".join(sorted(cfops_encontrados)),
             'Numero_Pedido': pedido_encontrado or "",
             'Numero_NF': get_val(ide, 'nNF'),
@@ -121,46 +149,389 @@ def parse_nfe(xml_path, cfops_filtro=None):
             'Chave_Acesso': chave,
             'Itens': lista_itens
         }
-        return dados
-    except: return None
+        return dados, frozenset(cfops_encontrados)
+    except: return None, frozenset()
 
-def processar_pasta_xml_thread_safe(caminho_pasta, cfops_filtro, callback_progresso, pastas_ignoradas=None):
+def listar_xmls(caminho, pastas_ignoradas):
+    """
+    Lista os XML da pasta (recursivo) com tamanho e data de modificação.
+    Usa os.scandir: no Windows o tamanho/data vêm da própria listagem, sem um stat por arquivo.
+    Os XML dentro de .zip entram como 'lote.zip::membro.xml' (ver xml_compactados).
+    """
+    # Mesmo critério do os.walk anterior: pasta ignorada em qualquer nível do caminho fica de fora
+    if any(p in caminho.lower().split(os.sep) for p in pastas_ignoradas): return []
+
+    arquivos = []
+    pilha = [caminho]
+    while pilha:
+        pasta = pilha.pop()
+        try:
+            with os.scandir(pasta) as it:
+                entradas = list(it)
+        except OSError:
+            continue
+        for e in entradas:
+            try:
+                if e.is_dir():
+                    if e.name.lower().strip() in pastas_ignoradas or e.is_symlink(): continue
+                    pilha.append(e.path)
+                elif e.name.lower().endswith('.xml') or e_xml_gz(e.name):
+                    st = e.stat()
+                    arquivos.append((e.path, st.st_size, st.st_mtime_ns))
+                elif e_zip(e.name):
+                    arquivos.extend(listar_membros(e.path, pastas_ignoradas))
+            except OSError:
+                continue
+    return arquivos
+
+# --- REPRESENTAÇÃO COMPACTA DAS NOTAS ---
+# Cada nota lida vira (cabeçalho, itens): uma tupla com os campos da nota e uma tupla por item,
+# na ordem de CAMPOS_NOTA / CAMPOS_ITEM. É assim que as notas ficam no manifesto, viajam entre
+# processos e chegam ao cruzamento com o ERP: dezenas de milhares de dicts (um por nota e um por
+# item) custam várias vezes mais memória que as tuplas. Tuplas não mudam: ninguém precisa copiar
+# o que está no manifesto antes de usar.
+# Para o cruzamento, as notas viram duas tabelas (montar_tabelas): notas, uma linha por nota, e
+# itens, ligados à nota pela coluna Id_Nota (posição da nota na tabela de notas).
+
+CAMPOS_NOTA = ('Arquivo', 'CFOPs', 'Numero_Pedido', 'Numero_NF', 'Serie', 'Data_Emissao', 'Data_Vencimento',
+               'CNPJ_Emitente', 'Nome_Emitente', 'CNPJ_Destinatario', 'Nome_Destinatario', 'Valor_Total', 'Chave_Acesso')
+CAMPOS_ITEM = ('ISBN', 'Titulo', 'Quantidade', 'Valor_Unitario', 'Valor_Bruto', 'Valor_Liquido')
+
+_POS_ARQUIVO = CAMPOS_NOTA.index('Arquivo')
+POS_CHAVE = CAMPOS_NOTA.index('Chave_Acesso')
+
+def _texto_unico(valor):
+    # Títulos, ISBNs, CNPJs e nomes se repetem em milhares de notas: uma cópia só de cada texto
+    # (o manifesto refaz o mesmo na leitura do arquivo)
+    return sys.intern(valor) if type(valor) is str else valor
+
+def _compactar(dados):
+    if dados is None: return None
+    return (tuple(_texto_unico(dados[c]) for c in CAMPOS_NOTA),
+            tuple(tuple(_texto_unico(i[c]) for c in CAMPOS_ITEM) for i in dados['Itens']))
+
+def _expandir(compacto):
+    if compacto is None: return None
+    cabecalho, itens = compacto
+    dados = dict(zip(CAMPOS_NOTA, cabecalho))
+    dados['Itens'] = [dict(zip(CAMPOS_ITEM, i)) for i in itens]
+    return dados
+
+def chave_compacta(compacto):
+    """Chave de acesso da nota compacta (nome do arquivo se faltar), como cache_service.chave_nota."""
+    cabecalho = compacto[0]
+    return cabecalho[POS_CHAVE] or cabecalho[_POS_ARQUIVO] or ''
+
+def montar_tabelas(compactos):
     """
-    Função principal que varre a pasta e usa threads para ler os arquivos.
+    [(cabeçalho, itens)] -> (df_notas, df_itens).
+    df_notas: colunas de CAMPOS_NOTA + Id_Nota. df_itens: Id_Nota + colunas de CAMPOS_ITEM.
+    """
+    df_notas = pd.DataFrame.from_records([c for c, _ in compactos], columns=CAMPOS_NOTA)
+    df_notas['Id_Nota'] = range(len(df_notas))
+
+    ids, linhas = [], []
+    for id_nota, (_, itens) in enumerate(compactos):
+        ids.extend([id_nota] * len(itens))
+        linhas.extend(itens)
+    # dtype object: as células são os próprios objetos das tuplas (nada é copiado, None continua None)
+    df_itens = pd.DataFrame(linhas, columns=CAMPOS_ITEM, dtype=object)
+    df_itens.insert(0, 'Id_Nota', pd.array(ids, dtype='int64'))
+    return df_notas, df_itens
+
+# --- LEITURA DOS ARQUIVOS (THREADS OU PROCESSOS) ---
+# Threads: bom para pasta de rede (o tempo é de espera de disco/rede).
+# Processos: o ET.parse e os find() usam CPU e disputam o GIL; em disco local, processos usam todos os núcleos.
+# Cada processo recebe um lote de arquivos (menos idas e vindas entre processos) e devolve o resultado compacto.
+
+def _filtro_prefiltro(cfops_filtro):
+    """CFOPs para o pré-filtro nos bytes (Config.XML_PREFILTRO_CFOP), ou None se não há o que filtrar."""
+    if not Config.XML_PREFILTRO_CFOP: return None
+    cfops_validos = cfops_filtro if cfops_filtro is not None else CFOPS_PADRAO
+    return list(cfops_validos) or None
+
+def _processar_arquivo(caminho_xml, hash_anterior, usar_hash, cfops_pre=None):
+    """
+    Retorna (hash, reaproveitar, dados compactos, cfops, pulado). reaproveitar=True: o conteúdo é igual ao já lido.
+    pulado=True: nenhum CFOP do arquivo passa em cfops_pre, a nota não foi lida (cfops = os achados nos bytes).
+    """
+    h = None
+    if usar_hash:
+        try: h = hash_arquivo(caminho_xml)
+        except Exception: h = None
+        # Só a data mudou (arquivo copiado de novo, tocado): reaproveita o parse anterior
+        if h and h == hash_anterior: return h, True, None, frozenset(), False
+    if cfops_pre:
+        brutos = cfops_brutos(caminho_xml)
+        if brutos is not None and not passa_filtro_cfop(brutos, cfops_pre): return h, False, None, brutos, True
+    dados, cfops = _ler_nota(caminho_xml)
+    return h, False, _compactar(dados), cfops, False
+
+def _processar_lote(itens, usar_hash, cfops_pre=None):
+    """Worker do pool de processos: [(xml, hash_anterior)] -> [(xml, hash, reaproveitar, dados compactos, cfops, pulado)]."""
+    saida = []
+    with zips_abertos():
+        for caminho_xml, hash_anterior in itens:
+            try:
+                h, reaproveitar, dados, cfops, pulado = _processar_arquivo(caminho_xml, hash_anterior, usar_hash, cfops_pre)
+            except Exception:
+                h, reaproveitar, dados, cfops, pulado = None, False, None, frozenset(), False
+            saida.append((caminho_xml, h, reaproveitar, dados, cfops, pulado))
+    return saida
+
+def _ler_com_threads(itens, usar_hash, cfops_pre=None):
+    with zips_abertos():
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=20)
+        try:
+            futures = {executor.submit(_processar_arquivo, xml, h, usar_hash, cfops_pre): xml for xml, h in itens}
+            for future in concurrent.futures.as_completed(futures):
+                try: yield (futures[future],) + future.result()
+                except Exception: yield futures[future], None, False, None, frozenset(), False
+        finally:
+            # Leitura interrompida (tarefa cancelada): o que ainda não começou nem começa
+            executor.shutdown(wait=True, cancel_futures=True)
+
+def _ler_com_processos(itens, usar_hash, cfops_pre=None):
+    tamanho = max(1, Config.XML_LOTE_PROCESSO)
+    lotes = [itens[i:i + tamanho] for i in range(0, len(itens), tamanho)]
+    entregues = set()
+    try:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=Config.XML_PROCESSOS or None)
+        try:
+            futures = [executor.submit(_processar_lote, lote, usar_hash, cfops_pre) for lote in lotes]
+            for future in concurrent.futures.as_completed(futures):
+                for resultado in future.result():
+                    entregues.add(resultado[0])
+                    yield resultado
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    except Exception as e:
+        # Pool quebrado (processo morto, ambiente sem fork/spawn): termina o que falta com threads
+        print(f"Erro no pool de processos ({e}). Continuando com threads.")
+        yield from _ler_com_threads([i for i in itens if i[0] not in entregues], usar_hash, cfops_pre)
+
+def _ler_arquivos(itens, usar_hash=False, cfops_pre=None):
+    """
+    Lê os arquivos com o motor configurado (Config.XML_MOTOR) e devolve, conforme terminam,
+    (xml, hash, reaproveitar, dados compactos, cfops, pulado).
+    cfops_pre: arquivos sem nenhum desses CFOPs nos bytes nem são lidos (pulado=True).
+    Poucos arquivos (até um lote) vão sempre por threads: não compensa subir processos.
+    Quem parar no meio deve fechar o gerador (contextlib.closing): os arquivos que ainda não
+    começaram a ser lidos são descartados na hora, sem esperar o fim do traceback.
+    """
+    if Config.XML_MOTOR == 'processos' and len(itens) > Config.XML_LOTE_PROCESSO:
+        return _ler_com_processos(itens, usar_hash, cfops_pre)
+    return _ler_com_threads(itens, usar_hash, cfops_pre)
+
+def _entrada_manifesto(tamanho, mtime, anterior, h, reaproveitar, dados, cfops, pulado):
+    if reaproveitar: return dict(anterior, tamanho=tamanho, mtime=mtime)
+    entrada = {'tamanho': tamanho, 'mtime': mtime, 'hash': h, 'cfops': cfops, 'dados': dados}
+    # Nota só pré-filtrada: 'cfops' são os achados nos bytes; outro filtro que os aceite relê o arquivo
+    if pulado: entrada['pre'] = True
+    return entrada
+
+def _hash_reaproveitavel(entrada):
+    # Entrada pré-filtrada não tem parse para reaproveitar
+    if entrada is None or entrada.get('pre'): return None
+    return entrada.get('hash')
+
+# --- NOTAS DUPLICADAS ---
+# A mesma NF-e aparece várias vezes na pasta (baixada de novo, copiada para outra subpasta).
+# Duas etapas:
+#   - Antes de ler: arquivos idênticos byte a byte (mesmo tamanho e mesmo hash) são lidos uma vez só;
+#     as cópias recebem o resultado do original. Só é calculado o hash de arquivos com o mesmo tamanho
+#     e a mesma chave no nome (quando o nome traz os 44 dígitos): nomes com chaves diferentes são
+#     notas diferentes. O nome sozinho não basta para pular a leitura: os XML de evento
+#     (cancelamento, carta de correção) trazem a mesma chave no nome.
+#   - Depois de ler: notas com a mesma Chave_Acesso ficam uma vez só na lista.
+# Nos dois casos vale a cópia de menor caminho (ordem alfabética): o resultado não depende da ordem
+# em que os arquivos terminam de ser lidos.
+
+_RE_CHAVE_NOME = re.compile(r'(?<!\d)\d{44}(?!\d)')
+
+def _chave_do_nome(caminho_xml):
+    m = _RE_CHAVE_NOME.search(nome_arquivo(caminho_xml))
+    return m.group(0) if m else None
+
+def _hash_ou_none(caminho_xml):
+    try: return hash_arquivo(caminho_xml)
+    except Exception: return None  # arquivo sumiu, .zip corrompido
+
+def _copias_identicas(arquivos):
+    """[(xml, tamanho)] -> {cópia: original} dos arquivos idênticos byte a byte. Original = menor caminho."""
+    grupos = {}
+    for xml, tamanho in arquivos:
+        grupos.setdefault((tamanho, _chave_do_nome(xml)), []).append(xml)
+    candidatos = sorted(xml for grupo in grupos.values() if len(grupo) > 1 for xml in grupo)
+    if not candidatos: return {}
+
+    with zips_abertos(), concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
+        hashes = dict(zip(candidatos, executor.map(_hash_ou_none, candidatos)))
+
+    tamanhos = dict(arquivos)
+    originais, copias = {}, {}
+    for xml in candidatos:  # em ordem: o primeiro de cada conteúdo é o original
+        h = hashes[xml]
+        if h is None: continue
+        conteudo = (tamanhos[xml], h)
+        if conteudo in originais: copias[xml] = originais[conteudo]
+        else: originais[conteudo] = xml
+    return copias
+
+def _remover_duplicadas(pares):
+    """[(xml, nota compacta)] -> (notas, quantas saíram). Mesma Chave_Acesso em mais de um arquivo: fica o de menor caminho."""
+    vencedor = {}
+    for xml, compacto in pares:
+        chave = compacto[0][POS_CHAVE]
+        if chave and (chave not in vencedor or xml < vencedor[chave]): vencedor[chave] = xml
+    notas = [c for xml, c in pares if not c[0][POS_CHAVE] or vencedor[c[0][POS_CHAVE]] == xml]
+    return notas, len(pares) - len(notas)
+
+def _varrer_com_manifesto(caminho, arquivos, cfops_filtro, callback_progresso):
+    """
+    Lê só os arquivos novos ou alterados desde a última varredura; os demais vêm do manifesto.
+    Retorna ([(xml, dados compactos)], contagens da varredura).
+    """
+    manifesto = carregar_manifesto(caminho)
+    total = len(arquivos)
+    cfops_pre = _filtro_prefiltro(cfops_filtro)
+    vistos = set()
+    pendentes = {}
+    with travar_manifesto():
+        for xml, tamanho, mtime in arquivos:
+            vistos.add(xml)
+            e = manifesto.get(xml)
+            if e is None or e['tamanho'] != tamanho or e['mtime'] != mtime:
+                pendentes[xml] = (tamanho, mtime, e)
+            elif e.get('pre') and (cfops_pre is None or passa_filtro_cfop(e['cfops'], cfops_pre)):
+                # Pulado pelo pré-filtro de outro módulo, mas interessa a este: agora precisa ser lido
+                pendentes[xml] = (tamanho, mtime, e)
+        # Arquivos que sumiram da pasta saem do manifesto
+        removidos = [xml for xml in manifesto if xml not in vistos]
+        for xml in removidos: del manifesto[xml]
+
+    lidos_count = total - len(pendentes)
+    if callback_progresso: callback_progresso(lidos_count, total)
+
+    pulados = 0
+    copias = {}
+    try:
+        if pendentes:
+            if Config.XML_DEDUPLICAR: copias = _copias_identicas([(xml, p[0]) for xml, p in pendentes.items()])
+            itens = [(xml, _hash_reaproveitavel(e)) for xml, (_, _, e) in pendentes.items() if xml not in copias]
+            with contextlib.closing(_ler_arquivos(itens, Config.MANIFESTO_XML_HASH, cfops_pre)) as leitura:
+                for xml, h, reaproveitar, dados, cfops, pulado in leitura:
+                    tamanho, mtime, anterior = pendentes[xml]
+                    entrada = _entrada_manifesto(tamanho, mtime, anterior, h, reaproveitar, dados, cfops, pulado)
+                    with travar_manifesto():
+                        # A varredura de outro módulo, rodando junto, pode já ter lido a nota inteira: o pré-filtro não a substitui
+                        atual = manifesto.get(xml)
+                        if not (pulado and atual and not atual.get('pre') and atual['tamanho'] == tamanho and atual['mtime'] == mtime):
+                            manifesto[xml] = entrada
+                    pulados += pulado
+                    lidos_count += 1
+                    if callback_progresso: callback_progresso(lidos_count, total)
+
+            # Cópias idênticas ficam no manifesto com o resultado do original (a mesma tupla, sem memória extra)
+            for copia, original in copias.items():
+                tamanho, mtime, _ = pendentes[copia]
+                with travar_manifesto():
+                    if original in manifesto: manifesto[copia] = dict(manifesto[original], tamanho=tamanho, mtime=mtime)
+                lidos_count += 1
+            if copias and callback_progresso: callback_progresso(lidos_count, total)
+    finally:
+        # Também quando a leitura é interrompida (tarefa cancelada): o que já foi lido não se perde
+        if pendentes or removidos: salvar_manifesto(caminho)
+
+    pares = []
+    with travar_manifesto():
+        for xml, _, _ in arquivos:
+            e = manifesto.get(xml)
+            if e and e['dados'] is not None and passa_filtro_cfop(e['cfops'], cfops_filtro):
+                pares.append((xml, e['dados']))
+
+    resumo = {'arquivos': total, 'reaproveitados': total - len(pendentes),
+              'lidos': len(pendentes) - pulados - len(copias), 'pulados_prefiltro': pulados,
+              'copias_identicas': len(copias), 'removidos': len(removidos)}
+    return pares, resumo
+
+def _ler_pasta(caminho_pasta, cfops_filtro, callback_progresso, pastas_ignoradas=None):
+    """
+    Varre a pasta e lê os arquivos em paralelo (threads ou processos, ver Config.XML_MOTOR).
+    Retorna (notas compactas, mensagem de erro ou None, resumo da varredura). O resumo conta arquivos lidos,
+    reaproveitados do manifesto, pulados pelo pré-filtro de CFOP, cópias idênticas e notas de chave repetida.
     """
     caminho = os.path.normpath(caminho_pasta)
-    if not os.path.exists(caminho): return pd.DataFrame(), "Pasta não encontrada"
+    if not os.path.exists(caminho): return [], "Pasta não encontrada", {}
     
     # Se não passar pastas ignoradas, usa a global (evita erro de contexto)
     if pastas_ignoradas is None:
         pastas_ignoradas = PASTAS_IGNORADAS
 
-    arquivos_para_ler = []
-    for root, dirs, files in os.walk(caminho):
-        dirs[:] = [d for d in dirs if d.lower().strip() not in pastas_ignoradas]
-        if any(p in os.path.normpath(root).lower().split(os.sep) for p in pastas_ignoradas): continue
-        for f in files:
-            if f.lower().endswith('.xml'): arquivos_para_ler.append(os.path.join(root, f))
+    inicio = time.perf_counter()
+    arquivos = listar_xmls(caminho, pastas_ignoradas)
     
-    total_arquivos = len(arquivos_para_ler)
-    if total_arquivos == 0: return pd.DataFrame(), "Nenhum XML encontrado."
+    total_arquivos = len(arquivos)
+    if total_arquivos == 0: return [], "Nenhum XML encontrado.", {}
 
-    if callback_progresso: callback_progresso(0, total_arquivos)
+    if Config.MANIFESTO_XML_ATIVO:
+        # Varredura incremental: o tempo depende das notas novas, não do tamanho do arquivo morto
+        pares, resumo = _varrer_com_manifesto(caminho, arquivos, cfops_filtro, callback_progresso)
+    else:
+        if callback_progresso: callback_progresso(0, total_arquivos)
 
-    lista_dados = []
-    lidos_count = 0
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-        futures = {executor.submit(parse_nfe, xml, cfops_filtro): xml for xml in arquivos_para_ler}
-        for future in concurrent.futures.as_completed(futures):
-            lidos_count += 1
-            if callback_progresso: callback_progresso(lidos_count, total_arquivos)
-            try:
-                resultado = future.result()
-                if resultado: lista_dados.append(resultado)
-            except: pass
+        pares = []
+        lidos_count = 0
+        pulados = 0
+        copias = _copias_identicas([(xml, tamanho) for xml, tamanho, _ in arquivos]) if Config.XML_DEDUPLICAR else {}
+        originais = set(copias.values())
+        resultados = {}
+        
+        itens = [(xml, None) for xml, _, _ in arquivos if xml not in copias]
+        with contextlib.closing(_ler_arquivos(itens, cfops_pre=_filtro_prefiltro(cfops_filtro))) as leitura:
+            for xml, _, _, dados, cfops, pulado in leitura:
+                lidos_count += 1
+                pulados += pulado
+                if callback_progresso: callback_progresso(lidos_count, total_arquivos)
+                if xml in originais: resultados[xml] = (dados, cfops)
+                if dados is not None and passa_filtro_cfop(cfops, cfops_filtro): pares.append((xml, dados))
+
+        for copia, original in copias.items():
+            dados, cfops = resultados[original]
+            if dados is not None and passa_filtro_cfop(cfops, cfops_filtro): pares.append((copia, dados))
+        if copias and callback_progresso: callback_progresso(total_arquivos, total_arquivos)
+
+        resumo = {'arquivos': total_arquivos, 'reaproveitados': 0,
+                  'lidos': total_arquivos - pulados - len(copias), 'pulados_prefiltro': pulados,
+                  'copias_identicas': len(copias), 'removidos': 0}
 
-    df = pd.DataFrame(lista_dados)
+    if Config.XML_DEDUPLICAR:
+        lista_dados, duplicadas = _remover_duplicadas(pares)
+    else:
+        lista_dados, duplicadas = [c for _, c in pares], 0
+
+    resumo.update({'motor': Config.XML_MOTOR, 'notas': len(lista_dados), 'duplicadas_chave': duplicadas,
+                   'segundos': round(time.perf_counter() - inicio, 2)})
+    print(f"Varredura XML: {resumo}")
+
+    return lista_dados, None, resumo
+
+def ler_pasta_xml(caminho_pasta, cfops_filtro, callback_progresso, pastas_ignoradas=None):
+    """
+    Função principal: varre a pasta e devolve ((df_notas, df_itens), mensagem de erro ou None, resumo da varredura).
+    Ver montar_tabelas para o formato das duas tabelas e _ler_pasta para o resumo.
+    """
+    compactos, msg, resumo = _ler_pasta(caminho_pasta, cfops_filtro, callback_progresso, pastas_ignoradas)
+    return montar_tabelas(compactos), msg, resumo
+
+def processar_pasta_xml_thread_safe(caminho_pasta, cfops_filtro, callback_progresso, pastas_ignoradas=None):
+    """
+    Formato antigo: um DataFrame de notas com a coluna 'Itens' (lista de dicts).
+    O processamento usa ler_pasta_xml, que não monta um dict por item.
+    """
+    compactos, msg, _ = _ler_pasta(caminho_pasta, cfops_filtro, callback_progresso, pastas_ignoradas)
+    if msg: return pd.DataFrame(), msg
+    df = pd.DataFrame([_expandir(c) for c in compactos])
     
     cols_obrig = ['CNPJ_Destinatario', 'CNPJ_Emitente', 'Numero_Pedido', 'Valor_Total', 'Data_Vencimento']
     if not df.empty:
@@ -171,6 +542,62 @@ def processar_pasta_xml_thread_safe(caminho_pasta, cfops_filtro, callback_progre
 
     return df, None
 
+# --- ATUALIZAÇÃO PONTUAL (OBSERVADOR DA PASTA) ---
+
+def atualizar_arquivos(caminho_pasta, alterados, removidos=()):
+    """
+    Lê só os arquivos indicados (novos/alterados) e tira do manifesto os removidos.
+    Retorna [(xml, entrada_anterior, entrada_nova)] das entradas que mudaram de fato
+    (entrada None = não existe). Arquivo alterado que já não existe conta como removido.
+    """
+    caminho = os.path.normpath(caminho_pasta)
+    manifesto = carregar_manifesto(caminho)
+    mudancas = []
+    pendentes = {}
+
+    with travar_manifesto():
+        for xml in removidos:
+            anterior = manifesto.pop(xml, None)
+            if anterior is not None: mudancas.append((xml, anterior, None))
+        for xml in alterados:
+            try: tamanho, mtime = tamanho_e_data(xml)
+            except OSError:
+                anterior = manifesto.pop(xml, None)
+                if anterior is not None: mudancas.append((xml, anterior, None))
+                continue
+            e = manifesto.get(xml)
+            if e is not None and e['tamanho'] == tamanho and e['mtime'] == mtime and not e.get('pre'): continue
+            pendentes[xml] = (tamanho, mtime, e)
+
+    if pendentes:
+        # Sem pré-filtro: o observador abastece todos os módulos de uma vez
+        itens = [(xml, _hash_reaproveitavel(e)) for xml, (_, _, e) in pendentes.items()]
+        for xml, h, reaproveitar, dados, cfops, pulado in _ler_arquivos(itens, Config.MANIFESTO_XML_HASH):
+            tamanho, mtime, anterior = pendentes[xml]
+            entrada = _entrada_manifesto(tamanho, mtime, anterior, h, reaproveitar, dados, cfops, pulado)
+            with travar_manifesto(): manifesto[xml] = entrada
+            # Só a data mudou e o conteúdo é o mesmo: nada muda nos caches
+            if not reaproveitar: mudancas.append((xml, anterior, entrada))
+
+    if pendentes or mudancas: salvar_manifesto(caminho)
+    return mudancas
+
+def notas_do_manifesto(caminho_pasta, chaves, cfops_filtro):
+    """
+    Notas compactas do manifesto com Chave_Acesso em 'chaves' e que passam no filtro de CFOP.
+    Uma por chave: a do arquivo de menor caminho, como na varredura completa.
+    """
+    manifesto = carregar_manifesto(os.path.normpath(caminho_pasta))
+    achadas = {}
+    with travar_manifesto():
+        for xml, e in manifesto.items():
+            d = e['dados']
+            if d is None: continue
+            chave = d[0][POS_CHAVE]
+            if chave not in chaves or (chave in achadas and achadas[chave][0] < xml): continue
+            if passa_filtro_cfop(e['cfops'], cfops_filtro): achadas[chave] = (xml, d)
+    return [d for _, d in achadas.values()]
+
 # Função wrapper (mantida para compatibilidade)
 def processar_pasta_xml(caminho_pasta, cfops_filtro=None, callback_progresso=None):
     return processar_pasta_xml_thread_safe(caminho_pasta, cfops_filtro, callback_progresso)
\ No newline at end of file
@@ -0,0 +1,166 @@
+# --- BENCHMARKS ---
+# Medições de desempenho feitas com os dados reais (pasta de XML da empresa).
+# Uso:
+#   python benchmark.py parser [PASTA] [--repeticoes N]
+#       Compara o leitor padrão de NF-e com o leitor rápido (um passe pelos filhos, sem find): tempo por nota
+#       e conferência de que os dois devolvem exatamente o mesmo resultado para cada arquivo.
+#       PASTA padrão: CAMINHO_XML_PADRAO do .env.
+#   python benchmark.py enriquecimento [--notas N ...] [--itens N] [--repeticoes N]
+#       Junção das notas com os itens do ERP (Itens_ERP de cada nota): filtro do DataFrame inteiro por nota
+#       (como era) x índice pedido -> itens montado uma vez. Dados sintéticos, sem banco; confere que dá o mesmo.
+#   python benchmark.py cache [--modulo geral|acerto|devolucao] [--repeticoes N]
+#       Cache do módulo gravado e lido no JSON com indentação (como era) x JSON compacto comprimido (cache_service):
+#       tamanho, tempo de gravação e de leitura. Usa o cache atual do módulo.
+#       Também mede o ler_cache com o arquivo lido do disco x vindo da memória (arquivo sem mudança).
+
+import argparse
+import random
+import time
+
+from config import Config
+
+def _medir(funcao, arquivos, repeticoes):
+    """Melhor tempo (s) entre as repetições, lendo todos os arquivos em sequência (uma thread: mede CPU, não disco)."""
+    melhor = None
+    resultados = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultados = [funcao(xml) for xml in arquivos]
+        gasto = time.perf_counter() - inicio
+        melhor = gasto if melhor is None else min(melhor, gasto)
+    return melhor, resultados
+
+def bench_parser(args):
+    from app.services.xml_service import listar_xmls, _ler_nfe, PASTAS_IGNORADAS
+    from app.services.xml_parser_rapido import ler_nfe_rapido
+    from app.services.xml_compactados import abrir_xml
+
+    pasta = args.pasta or Config.CAMINHO_XML_PADRAO
+    arquivos = [xml for xml, _, _ in listar_xmls(pasta, Config.PASTAS_IGNORADAS or PASTAS_IGNORADAS)]
+    if not arquivos:
+        print(f"Nenhum XML em {pasta}")
+        return
+    print(f"{len(arquivos)} arquivos em {pasta}")
+
+    # Uma leitura antes de medir, para os dois pegarem o disco no mesmo estado (cache do sistema)
+    for xml in arquivos:
+        with abrir_xml(xml) as f: f.read()
+
+    t_padrao, r_padrao = _medir(_ler_nfe, arquivos, args.repeticoes)
+    t_rapido, r_rapido = _medir(ler_nfe_rapido, arquivos, args.repeticoes)
+
+    diferentes = [xml for xml, a, b in zip(arquivos, r_padrao, r_rapido) if a != b]
+    n = len(arquivos)
+    print(f"padrão : {t_padrao:8.3f}s  ({t_padrao / n * 1e6:8.1f} µs/nota)")
+    print(f"rápido : {t_rapido:8.3f}s  ({t_rapido / n * 1e6:8.1f} µs/nota)  {t_padrao / t_rapido:5.2f}x")
+    print(f"resultados diferentes: {len(diferentes)}")
+    for xml in diferentes[:20]: print(f"  {xml}")
+
+def _itens_erp_filtrando(df_itens_erp, pedidos):
+    """Como era no enriquecer_notas: um filtro do DataFrame inteiro para cada nota (O(notas x itens))."""
+    saida = []
+    for ped in pedidos:
+        if not df_itens_erp.empty and ped:
+            saida.append(df_itens_erp[df_itens_erp['Numero_Pedido_Chave'] == ped].to_dict('records'))
+        else:
+            saida.append([])
+    return saida
+
+def _itens_erp_indexando(df_itens_erp, pedidos, itens_erp_por_pedido):
+    """Como é hoje: um dicionário pedido -> itens montado uma vez (itens_erp_por_pedido do processamento)."""
+    por_pedido = itens_erp_por_pedido(df_itens_erp)
+    return [list(por_pedido.get(ped, ())) if ped else [] for ped in pedidos]
+
+# Títulos distintos nos dados sintéticos (os mesmos livros aparecem em muitos pedidos, como no ERP)
+_CATALOGO = 20000
+
+def _erp_sintetico(n_notas, itens_por_pedido, rnd):
+    """Pedidos das notas (alguns vazios, alguns sem itens no ERP) e os itens do ERP, embaralhados como vêm do banco."""
+    import pandas as pd
+    pedidos = [str(100000 + i) if rnd.random() > 0.05 else '' for i in range(n_notas)]
+    linhas = []
+    for ped in pedidos:
+        if not ped or rnd.random() < 0.1: continue
+        for j in range(rnd.randint(1, 2 * itens_por_pedido)):
+            quant = float(rnd.randint(1, 50))
+            unit = round(rnd.uniform(5, 200), 2)
+            linhas.append({'Numero_Pedido_Chave': ped, 'TIPO_ACERTO': 1, 'Filial': 'F01', 'Fornecedor': 'FORN',
+                           'Data_Emissao': '2024-01-01 00:00:00', 'ISBN': f'978{rnd.randint(0, _CATALOGO - 1):010d}',
+                           'Titulo': f'Titulo {j}', 'Quant': quant, 'VlLiqUnit': unit,
+                           'Valor_Liquido': quant * unit, 'Valor_Bruto': quant * unit})
+    rnd.shuffle(linhas)
+    return pedidos, pd.DataFrame(linhas)
+
+def bench_enriquecimento(args):
+    # Importado antes de medir: o tempo de import não entra na conta do índice
+    from app.services.processamento_service import _itens_erp_por_pedido
+    rnd = random.Random(42)
+    for n in args.notas:
+        pedidos, df_itens_erp = _erp_sintetico(n, args.itens, rnd)
+        funcoes = {'filtro': _itens_erp_filtrando,
+                   'índice': lambda df, peds: _itens_erp_indexando(df, peds, _itens_erp_por_pedido)}
+        tempos, resultados = {}, {}
+        for nome, funcao in funcoes.items():
+            # _medir chama a função uma vez por "arquivo": aqui o único "arquivo" é a lista de pedidos
+            tempos[nome], (resultados[nome],) = _medir(lambda peds: funcao(df_itens_erp, peds), [pedidos], args.repeticoes)
+        igual = resultados['filtro'] == resultados['índice']
+        print(f"{n:7d} notas, {len(df_itens_erp):8d} itens ERP | filtro: {tempos['filtro']:8.3f}s | "
+              f"índice: {tempos['índice']:8.3f}s  {tempos['filtro'] / tempos['índice']:7.1f}x | "
+              f"{'mesmo resultado' if igual else 'RESULTADOS DIFERENTES'}")
+
+def bench_cache(args):
+    import json
+    import zlib
+    from app.services.cache_service import ler_cache, esquecer_memoria, VERSAO_CACHE
+
+    dados, ts = ler_cache(args.modulo)
+    if not dados:
+        print(f"Cache '{args.modulo}' vazio: rode o processamento do módulo primeiro.")
+        return
+    conteudo = {'timestamp': ts, 'dados': dados}
+    print(f"{len(dados)} notas no cache '{args.modulo}'")
+
+    formatos = {
+        'json': (lambda c: json.dumps(c, ensure_ascii=False, indent=4).encode('utf-8'),
+                 lambda b: json.loads(b.decode('utf-8'))),
+        'json+zlib': (lambda c: zlib.compress(json.dumps({'versao': VERSAO_CACHE, **c}, ensure_ascii=False,
+                                                         separators=(',', ':')).encode('utf-8'), Config.CACHE_COMPRESSAO),
+                      lambda b: json.loads(zlib.decompress(b))),
+    }
+    for nome, (gravar, ler) in formatos.items():
+        t_gravar, (binario,) = _medir(gravar, [conteudo], args.repeticoes)
+        t_ler, _ = _medir(ler, [binario], args.repeticoes)
+        print(f"{nome:12s}: {len(binario) / 1e6:8.2f} MB | grava {t_gravar:7.3f}s | lê {t_ler:7.3f}s")
+
+    def ler_do_disco(modulo):
+        esquecer_memoria(modulo)
+        return ler_cache(modulo)
+    t_disco, _ = _medir(ler_do_disco, [args.modulo], args.repeticoes)
+    t_memoria, _ = _medir(ler_cache, [args.modulo], args.repeticoes)
+    print(f"ler_cache   : disco {t_disco:7.3f}s | memória {t_memoria:7.3f}s  {t_disco / t_memoria:5.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do Vila Apps")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p = sub.add_parser('parser', help="leitor padrão x leitor rápido de NF-e")
+    p.add_argument('pasta', nargs='?')
+    p.add_argument('--repeticoes', type=int, default=3)
+    p.set_defaults(func=bench_parser)
+
+    p = sub.add_parser('enriquecimento', help="itens do ERP por nota: filtro por nota x índice por pedido")
+    p.add_argument('--notas', type=int, nargs='+', default=[500, 2000, 8000])
+    p.add_argument('--itens', type=int, default=5, help="média de itens por pedido no ERP")
+    p.add_argument('--repeticoes', type=int, default=3)
+    p.set_defaults(func=bench_enriquecimento)
+
+    p = sub.add_parser('cache', help="cache do módulo em JSON indentado x JSON compacto comprimido")
+    p.add_argument('--modulo', default='geral', choices=['geral', 'acerto', 'devolucao'])
+    p.add_argument('--repeticoes', type=int, default=3)
+    p.set_defaults(func=bench_cache)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
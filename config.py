@@ -24,6 +24,79 @@ class Config:
         f'Encrypt=no;'
     )
 
+    # Pool de conexões com o ERP (app/database.py)
+    DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+    DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+    DB_POOL_TEMPO_OCIOSO = int(os.environ.get('DB_POOL_TEMPO_OCIOSO', 300))      # segundos
+    DB_POOL_HEALTH_CHECK = int(os.environ.get('DB_POOL_HEALTH_CHECK', 30))       # segundos parada antes de testar
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))                 # segundos esperando conexão livre
+    SQL_TAMANHO_LOTE = int(os.environ.get('SQL_TAMANHO_LOTE', 20000))            # linhas por lote nas leituras em streaming
+    SQL_ARROW = os.environ.get('SQL_ARROW', '0') == '1'                          # colunas de texto em Arrow (requer pyarrow)
+    SQL_LOTE_CHAVES = int(os.environ.get('SQL_LOTE_CHAVES', 512))                # chaves por lote nas consultas com IN (limite do SQL Server: 2100 parâmetros)
+    SQL_LOTE_CHAVES_WORKERS = int(os.environ.get('SQL_LOTE_CHAVES_WORKERS', 4))  # lotes de IN executados em paralelo
+
+    # Espelho local (SQLite) do cadastro de clientes do ERP (app/repository/espelho_repo.py)
+    ESPELHO_ATIVO = os.environ.get('ESPELHO_ATIVO', '0') == '1'                     # ligar em um processo só (copia o ERP para o SQLite)
+    ESPELHO_DB_PATH = os.environ.get('ESPELHO_DB_PATH')                              # padrão: PATH_CACHE/vila_espelho_erp.db
+    ESPELHO_INTERVALO_MIN = int(os.environ.get('ESPELHO_INTERVALO_MIN', 15))         # sincronização incremental
+    ESPELHO_COMPLETA_HORAS = int(os.environ.get('ESPELHO_COMPLETA_HORAS', 1))        # recópia completa (pega alterações)
+    ESPELHO_IDADE_MAXIMA_HORAS = int(os.environ.get('ESPELHO_IDADE_MAXIMA_HORAS', 2)) # cópia completa mais velha que isso: consulta vai ao ERP
+
+    # Conferência (/conferencia/iniciar_processamento): fontes carregadas em paralelo
+    CONFERENCIA_MAX_WORKERS = int(os.environ.get('CONFERENCIA_MAX_WORKERS', 8))   # threads por conferência
+    CONFERENCIA_TIMEOUT = int(os.environ.get('CONFERENCIA_TIMEOUT', 120))         # segundos para todas as fontes
+
+    VENDAS_AGREGADAS_SQL = os.environ.get('VENDAS_AGREGADAS_SQL', '1') == '1'     # vendas já somadas por filial/ISBN no SQL Server
+
+    # Painel de gestão: propostas carregadas por página conforme a rolagem (/gestao/api/propostas)
+    GESTAO_PAGINA_TAMANHO = int(os.environ.get('GESTAO_PAGINA_TAMANHO', 50))
+    GESTAO_PAGINA_MAXIMO = int(os.environ.get('GESTAO_PAGINA_MAXIMO', 200))       # teto do parâmetro ?limite=
+
+    # Notas dos caches (acerto, devolução, leitor geral) servidas em páginas filtradas (/api/notas/<modulo>)
+    NOTAS_PAGINA_TAMANHO = int(os.environ.get('NOTAS_PAGINA_TAMANHO', 50))
+    NOTAS_PAGINA_MAXIMO = int(os.environ.get('NOTAS_PAGINA_MAXIMO', 500))         # teto do parâmetro ?limite=
+
+    # Métricas e log de consultas lentas (app/metricas_sql.py)
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS', 2000))                   # 0 desliga o log
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG')                            # padrão: PATH_CACHE/vila_slow_queries.log
+    METRICAS_AMOSTRAS = int(os.environ.get('METRICAS_AMOSTRAS', 1000))           # chamadas guardadas por consulta para os percentis
+
+    # Cache em memória das consultas de referência (app/repository/cache_consultas.py), em segundos
+    CACHE_TTL_FILIAIS = int(os.environ.get('CACHE_TTL_FILIAIS', 3600))
+    CACHE_TTL_FORNECEDORES = int(os.environ.get('CACHE_TTL_FORNECEDORES', 1800))
+    CACHE_TTL_LISTAS = int(os.environ.get('CACHE_TTL_LISTAS', 600))
+
+    # Varredura de XML (app/services/manifesto_xml.py): só lê arquivos novos ou alterados desde a última vez
+    MANIFESTO_XML_ATIVO = os.environ.get('MANIFESTO_XML_ATIVO', '1') == '1'
+    MANIFESTO_XML_HASH = os.environ.get('MANIFESTO_XML_HASH', '0') == '1'        # confere o conteúdo quando só a data mudou
+    XML_PARSER = os.environ.get('XML_PARSER', 'rapido')                           # 'rapido' (um passe pelos filhos, sem find) ou 'padrao' (ET.parse + find)
+    XML_PREFILTRO_CFOP = os.environ.get('XML_PREFILTRO_CFOP', '1') == '1'         # procura os CFOPs nos bytes e nem lê a nota que não passa no filtro
+    XML_DEDUPLICAR = os.environ.get('XML_DEDUPLICAR', '1') == '1'                 # mesma NF-e em vários arquivos entra uma vez só (vale a de menor caminho)
+    XML_COMPACTADOS = [p.strip().lower() for p in os.environ.get('XML_COMPACTADOS', 'zip,gz').split(',') if p.strip()]  # lê os XML de dentro de .zip e .xml.gz sem extrair ('' desliga)
+    XML_MOTOR = os.environ.get('XML_MOTOR', 'threads')                            # 'threads' (pasta de rede) ou 'processos' (disco local, usa todos os núcleos)
+    XML_PROCESSOS = int(os.environ.get('XML_PROCESSOS', 0))                       # 0 = um por núcleo
+    XML_LOTE_PROCESSO = int(os.environ.get('XML_LOTE_PROCESSO', 64))              # arquivos enviados de uma vez a cada processo
+
+    # Observador da pasta de XML (app/services/observador_xml.py): notas que chegam entram nos caches sem varredura completa
+    OBSERVADOR_XML_ATIVO = os.environ.get('OBSERVADOR_XML_ATIVO', '0') == '1'        # ligar em um processo só (grava nos caches)
+    OBSERVADOR_XML_MODO = os.environ.get('OBSERVADOR_XML_MODO', 'auto')            # 'auto' (polling em pasta de rede), 'inotify' (Linux, disco local) ou 'polling'
+    OBSERVADOR_XML_INTERVALO = int(os.environ.get('OBSERVADOR_XML_INTERVALO', 30))  # segundos entre verificações no modo polling
+    OBSERVADOR_XML_ESPERA = float(os.environ.get('OBSERVADOR_XML_ESPERA', 2))       # segundos sem eventos antes de processar o lote
+    OBSERVADOR_XML_RECONCILIAR = int(os.environ.get('OBSERVADOR_XML_RECONCILIAR', 600))  # conferência completa da pasta no modo inotify (segundos)
+    OBSERVADOR_XML_LOTE = int(os.environ.get('OBSERVADOR_XML_LOTE', 500))          # máximo de arquivos por lote
+
+    # Processamento dos módulos em segundo plano (app/services/tarefas_service.py)
+    TAREFAS_SIMULTANEAS = int(os.environ.get('TAREFAS_SIMULTANEAS', 2))          # rodando ao mesmo tempo; as outras esperam na fila
+    TAREFAS_POR_MODULO = int(os.environ.get('TAREFAS_POR_MODULO', 1))            # do mesmo módulo (gravam o mesmo cache)
+    TAREFAS_HISTORICO = int(os.environ.get('TAREFAS_HISTORICO', 50))             # tarefas terminadas guardadas para /api/tarefas
+
+    # Caches dos módulos (app/services/cache_service.py): JSON comprimido, trocado de uma vez a cada gravação
+    CACHE_COMPRESSAO = int(os.environ.get('CACHE_COMPRESSAO', 3))                # nível do zlib (0 = sem compressão, 9 = máxima)
+
+    # Progresso do processamento em stream (/api/progresso/stream, Server-Sent Events)
+    PROGRESSO_SSE_INTERVALO = float(os.environ.get('PROGRESSO_SSE_INTERVALO', 0.25))  # mínimo de segundos entre dois eventos
+    PROGRESSO_SSE_PING = int(os.environ.get('PROGRESSO_SSE_PING', 15))               # sem mudança por esse tempo: comentário para manter a conexão
+
     # Caminhos
     CAMINHO_XML_PADRAO = os.environ.get('CAMINHO_XML_PADRAO')
     PATH_CACHE = os.environ.get('PATH_CACHE')